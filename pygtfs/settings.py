@@ -92,6 +92,7 @@ MIDDLEWARE_CLASSES = (
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'web.instrumentation.QueryStatsMiddleware',
 )
 
 AUTHENTICATION_BACKENDS = (
@@ -111,6 +112,15 @@ WSGI_APPLICATION = 'pygtfs.wsgi.application'
 
 DBNAME = 'pygtfs'
 
+# MongoDB connection, opened by the first query rather than at startup so
+# commands that never touch the database do not wait for it. The pool size
+# is per process; the write concern (w, j, wtimeout) applies to every write.
+
+MONGODB_HOST = 'localhost'
+MONGODB_PORT = 27017
+MONGODB_MAX_POOL_SIZE = 100
+MONGODB_WRITE_CONCERN = {'w': 1}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.dummy'
@@ -142,5 +152,70 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
-import mongoengine
-mongoengine.connect(DBNAME)
+
+# API response cache
+# Responses are cached per feed version, see web/cache.py. Set the backend to
+# the name of an entry in CACHES to share them between processes. Streamed
+# listings larger than the maximum entry size (bytes) are not stored.
+
+RESPONSE_CACHE_SIZE = 512
+RESPONSE_CACHE_BACKEND = None
+RESPONSE_CACHE_MAX_ENTRY_SIZE = 1024 * 1024
+
+
+# Query instrumentation
+# Database queries of a request slower than this (milliseconds) are logged
+# with their filter, None to log none. See web/instrumentation.py.
+
+SLOW_QUERY_MS = 100
+
+
+# Map tiles
+# MBTiles file written by the buildtiles command and served by web/views.py.
+
+TILES_PATH = os.path.join(BASE_DIR, 'tiles.mbtiles')
+
+
+# Walking transfers
+# Stop pairs closer than the radius (meters) get a transfer, timed with the
+# walking speed (meters per second). Processes default to one per CPU.
+
+WALKING_TRANSFER_RADIUS = 400.0
+WALKING_SPEED = 1.2
+WALKING_TRANSFER_PROCESSES = None
+
+# Realtime trip updates
+# GTFS-Realtime TripUpdates file path or URL, read again in the background
+# after the refresh interval (seconds), a URL read giving up after the fetch
+# timeout (seconds). Departure queries of REALTIME_FEED apply them over the
+# schedule.
+
+REALTIME_TRIP_UPDATES = None
+REALTIME_REFRESH_INTERVAL = 30
+REALTIME_FETCH_TIMEOUT = 10
+REALTIME_FEED = 'default'
+
+# Document ids
+# Feeds whose document ids are derived from their GTFS ids, see
+# service/identity.py. A feed must be removed before switching.
+
+DETERMINISTIC_ID_FEEDS = ()
+
+
+# Loader
+# Megabytes of lines a parser sorts in memory, stop_times.txt being grouped
+# by trip, before spilling sorted runs to disk.
+
+LOADER_SORT_MEMORY = 256
+
+# Stop time interpolation
+# Worker processes interpolating the times of untimed stops, one per CPU by
+# default.
+
+INTERPOLATION_PROCESSES = None
+
+from mongoengine.connection import DEFAULT_CONNECTION_NAME
+from mongoengine.connection import register_connection
+register_connection(DEFAULT_CONNECTION_NAME, DBNAME, host=MONGODB_HOST,
+                    port=MONGODB_PORT, maxPoolSize=MONGODB_MAX_POOL_SIZE,
+                    **MONGODB_WRITE_CONCERN)
@@ -0,0 +1,182 @@
+""" Stop and route adjacency.
+
+"Which routes serve this stop" and "which stops does this route serve in
+this direction" are materialized from the trip patterns, as
+:py:class:`service.models.StopRoutes` and
+:py:class:`service.models.RouteStops`, so both are answered by a single
+indexed read. The entries of a feed are replaced as a whole whenever its
+patterns are rebuilt, leaving the other feeds untouched.
+
+Every build writes its entries under a new generation id and then points
+the feed's :py:class:`service.models.AdjacencyGeneration` at it in a single
+update, so readers see either the previous entries or the new ones, never a
+half built mix. The previous generation is kept until the next build for the
+readers that looked it up just before the switch. Readers keep the current
+generation in memory until the next feed version, so an answer stays a
+single indexed read.
+
+"""
+from bson import DBRef
+from bson import ObjectId
+from service.models import AdjacencyGeneration
+from service.models import DEFAULT_FEED
+from service.models import Direction
+from service.models import PatternGeneration
+from service.models import Route
+from service.models import RouteStops
+from service.models import Stop
+from service.models import StopRoutes
+from service.models import TripPattern
+from service.versioned import VersionedByFeed
+
+BATCH_SIZE = 1000
+
+
+def _ref_id(value):
+    return value.id if isinstance(value, DBRef) else value
+
+
+def merge_sequences(sequences):
+    """Merges stop sequences into one travel order.
+
+    The longest sequence gives the order; stops only found in the others are
+    inserted right after their closest preceding stop.
+    """
+    sequences = sorted(sequences, key=len, reverse=True)
+    if not sequences:
+        return []
+    merged = list(sequences[0])
+    for sequence in sequences[1:]:
+        previous = None
+        for stop in sequence:
+            if stop not in merged:
+                position = merged.index(previous) + 1 \
+                    if previous is not None else 0
+                merged.insert(position, stop)
+            previous = stop
+    return merged
+
+
+def adjacency(patterns):
+    """Builds both adjacency directions from `(route_id, direction, stops)`
+    patterns, stops being stop_ids."""
+    sequences = {}
+    stop_routes = {}
+    for (route_id, direction, stops) in patterns:
+        sequences.setdefault((route_id, direction), []).append(stops)
+        key = '' if direction is None else str(direction)
+        for stop_id in stops:
+            stop_routes.setdefault(stop_id, {}) \
+                .setdefault(key, set()).add(route_id)
+
+    route_stops = dict((key, merge_sequences(route_sequences))
+                       for (key, route_sequences) in sequences.items())
+    stop_routes = dict((stop_id, dict((key, sorted(routes))
+                                      for (key, routes) in directions.items()))
+                       for (stop_id, directions) in stop_routes.items())
+    return route_stops, stop_routes
+
+
+def _insert(model_class, rows):
+    collection = model_class._get_collection()
+    for index in range(0, len(rows), BATCH_SIZE):
+        collection.insert(rows[index:index + BATCH_SIZE])
+
+
+def _generation(feed):
+    """The adjacency generation of `feed` served to readers, None for entries
+    built before generations."""
+    row = AdjacencyGeneration._get_collection().find_one(
+        {'feed': feed}, {'generation': True})
+    return row['generation'] if row else None
+
+
+def _switch(feed, generation):
+    previous = _generation(feed)
+    AdjacencyGeneration._get_collection().update(
+        {'feed': feed}, {'$set': {'generation': generation}}, upsert=True)
+    # also drops the leftovers of builds that failed before their switch
+    for model_class in (RouteStops, StopRoutes):
+        model_class._get_collection().remove(
+            {'feed': feed, 'generation': {'$nin': [generation, previous]}})
+
+
+def build_adjacency(feed=DEFAULT_FEED):
+    route_ids = dict((route['_id'], route['route_id']) for route in
+                     Route._get_collection().find({'feed': feed},
+                                                  {'route_id': True}))
+    stop_ids = dict((stop['_id'], stop['stop_id']) for stop in
+                    Stop._get_collection().find({'feed': feed},
+                                                {'stop_id': True}))
+    directions = dict((direction['_id'], direction['value']) for direction in
+                      Direction._get_collection().find({}, {'value': True}))
+
+    patterns = []
+    cursor = TripPattern._get_collection().find(
+        {'feed': feed, 'generation': PatternGeneration.current(feed)},
+        {'route': True, 'direction': True, 'stops': True})
+    for pattern in cursor:
+        route_id = route_ids.get(_ref_id(pattern.get('route')))
+        if route_id is None:
+            continue
+        patterns.append((route_id,
+                         directions.get(_ref_id(pattern.get('direction'))),
+                         [stop_ids[_ref_id(stop)] for stop in pattern['stops']
+                          if _ref_id(stop) in stop_ids]))
+
+    (route_stops, stop_routes) = adjacency(patterns)
+    generation = ObjectId()
+    _insert(RouteStops, [
+        {'feed': feed, 'generation': generation, 'route_id': route_id,
+         'direction': direction, 'stops': stops}
+        for ((route_id, direction), stops) in sorted(route_stops.items())])
+    _insert(StopRoutes, [
+        {'feed': feed, 'generation': generation, 'stop_id': stop_id,
+         'routes': routes}
+        for (stop_id, routes) in sorted(stop_routes.items())])
+    _switch(feed, generation)
+    return len(route_stops) + len(stop_routes)
+
+
+_generations = VersionedByFeed(
+    lambda feed: AdjacencyGeneration._get_collection().find_one(
+        {'feed': feed}, {'generation': True}) or {})
+
+
+def _find(model_class, feed, spec, projection):
+    """Entries of the current generation of `feed` matching `spec`."""
+    holder = _generations.holder(feed)
+    generation = holder.get().get('generation')
+    rows = list(model_class._get_collection().find(
+        dict(spec, feed=feed, generation=generation), projection))
+    if not rows:
+        # the entries may have been rebuilt without a new feed version
+        latest = _generation(feed)
+        if latest != generation:
+            holder.value = {'generation': latest}
+            rows = list(model_class._get_collection().find(
+                dict(spec, feed=feed, generation=latest), projection))
+    return rows
+
+
+def routes_of(stop_id, feed=DEFAULT_FEED):
+    """Route ids serving `stop_id` by direction, None for unknown stops."""
+    rows = _find(StopRoutes, feed, {'stop_id': stop_id}, {'routes': True})
+    return rows[0]['routes'] if rows else None
+
+
+def stops_of(route_id, direction=None, feed=DEFAULT_FEED):
+    """Stop ids served by `route_id` in `direction`, None for unknown routes
+    or directions."""
+    rows = _find(RouteStops, feed,
+                 {'route_id': route_id, 'direction': direction},
+                 {'stops': True})
+    return rows[0]['stops'] if rows else None
+
+
+def directions_of(route_id, feed=DEFAULT_FEED):
+    """`(direction, stops)` of every direction of `route_id`, in direction
+    order, empty for unknown routes."""
+    rows = _find(RouteStops, feed, {'route_id': route_id},
+                 {'direction': True, 'stops': True})
+    return sorted((row.get('direction'), row['stops']) for row in rows)
@@ -0,0 +1,236 @@
+""" Route and service level metrics.
+
+A feed is reduced to a compact timetable: parallel arrays holding, for every
+run of a trip, its route, direction and service numbers, its first departure
+and its duration in seconds. Trips listed in frequencies.txt contribute one
+run per headway. Runs without stop times (br-poa only publishes trips.txt)
+have no departure but still count, with the duration given by their
+trip_time column.
+
+Metrics of a service day are then a handful of NumPy group-bys over the runs
+of the services active that day: trips per hour, average headway, span of
+service and vehicle-hours of every route.
+
+"""
+import numpy
+from bson import DBRef
+from service.calendars import services_on
+from service.models import DEFAULT_FEED
+from service.models import Direction
+from service.models import Frequency
+from service.models import PatternGeneration
+from service.models import PatternTrip
+from service.models import Route
+from service.models import Trip
+from service.times import format_time
+from service.versioned import VersionedByFeed
+
+HOUR = 3600
+
+# direction number of the trips without direction_id
+NO_DIRECTION = -1
+
+
+def _ref_id(value):
+    return value.id if isinstance(value, DBRef) else value
+
+
+def _group_starts(keys):
+    """Indexes where a new value starts in the sorted `keys`."""
+    return numpy.flatnonzero(numpy.r_[True, keys[1:] != keys[:-1]])
+
+
+def trips_per_hour(routes, starts, route_count):
+    """`route_count` x hours array of the runs leaving in each hour of the
+    service day, runs without departure left out."""
+    known = ~numpy.isnan(starts)
+    hours = (starts[known] // HOUR).astype(int)
+    width = hours.max() + 1 if len(hours) else 0
+    counts = numpy.bincount(routes[known] * width + hours,
+                            minlength=route_count * width)
+    return counts.reshape(route_count, width)
+
+
+def average_headways(routes, directions, starts, route_count):
+    """Mean seconds between consecutive departures of a route in the same
+    direction, NaN for routes with less than two departures in a
+    direction."""
+    known = ~numpy.isnan(starts)
+    (routes, directions, starts) = (routes[known], directions[known],
+                                    starts[known])
+    order = numpy.lexsort((starts, directions, routes))
+    (routes, directions, starts) = (routes[order], directions[order],
+                                    starts[order])
+    same = (routes[1:] == routes[:-1]) & (directions[1:] == directions[:-1])
+    gaps = numpy.diff(starts)[same]
+    gap_routes = routes[1:][same]
+    totals = numpy.bincount(gap_routes, weights=gaps, minlength=route_count)
+    counts = numpy.bincount(gap_routes, minlength=route_count)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        return numpy.where(counts > 0, totals / counts, numpy.nan)
+
+
+def service_spans(routes, starts, durations, route_count):
+    """First departure and last arrival of every route, NaN for routes
+    without departures."""
+    ends = starts + numpy.nan_to_num(durations)
+    known = ~numpy.isnan(starts)
+    (routes, starts, ends) = (routes[known], starts[known], ends[known])
+    first = numpy.full(route_count, numpy.nan)
+    last = numpy.full(route_count, numpy.nan)
+    if not len(routes):
+        return first, last
+    order = numpy.argsort(routes, kind='mergesort')
+    (routes, starts, ends) = (routes[order], starts[order], ends[order])
+    groups = _group_starts(routes)
+    first[routes[groups]] = numpy.minimum.reduceat(starts, groups)
+    last[routes[groups]] = numpy.maximum.reduceat(ends, groups)
+    return first, last
+
+
+def vehicle_hours(routes, durations, route_count):
+    """Hours spent in service by the runs of every route."""
+    return numpy.bincount(routes, weights=numpy.nan_to_num(durations),
+                          minlength=route_count) / HOUR
+
+
+def _seconds(value):
+    return None if numpy.isnan(value) else int(value)
+
+
+class Timetable(object):
+    """Runs of a feed as parallel arrays.
+
+    `routes` and `services` are numbers into `route_ids` and `service_ids`,
+    `directions` direction_id values or :py:data:`NO_DIRECTION`, `starts`
+    and `durations` seconds, NaN when unknown.
+
+    """
+
+    def __init__(self, route_ids, service_ids, routes, directions, services,
+                 starts, durations):
+        self.route_ids = route_ids
+        self.service_ids = service_ids
+        self.routes = numpy.asarray(routes, dtype=int)
+        self.directions = numpy.asarray(directions, dtype=int)
+        self.services = numpy.asarray(services, dtype=int)
+        self.starts = numpy.asarray(starts, dtype=float)
+        self.durations = numpy.asarray(durations, dtype=float)
+
+    def __len__(self):
+        return len(self.routes)
+
+    def running(self, services):
+        """The runs of the service ids in `services`."""
+        numbers = [number for (number, service_id)
+                   in enumerate(self.service_ids) if service_id in services]
+        mask = numpy.in1d(self.services, numbers)
+        return Timetable(self.route_ids, self.service_ids, self.routes[mask],
+                         self.directions[mask], self.services[mask],
+                         self.starts[mask], self.durations[mask])
+
+    def route_metrics(self):
+        """Metrics of every route having runs, in route_id order."""
+        count = len(self.route_ids)
+        trips = numpy.bincount(self.routes, minlength=count)
+        hourly = trips_per_hour(self.routes, self.starts, count)
+        headways = average_headways(self.routes, self.directions,
+                                    self.starts, count)
+        (first, last) = service_spans(self.routes, self.starts,
+                                      self.durations, count)
+        hours = vehicle_hours(self.routes, self.durations, count)
+        metrics = []
+        for route in numpy.flatnonzero(trips):
+            metrics.append({
+                'route_id': self.route_ids[route],
+                'trips': int(trips[route]),
+                'trips_per_hour': hourly[route].tolist(),
+                'average_headway': _seconds(headways[route]),
+                'first_departure': _seconds(first[route]),
+                'last_arrival': _seconds(last[route]),
+                'span': _seconds(last[route] - first[route]),
+                'vehicle_hours': round(float(hours[route]), 2),
+            })
+        return sorted(metrics, key=lambda metric: metric['route_id'])
+
+    @staticmethod
+    def build(feed=DEFAULT_FEED):
+        spec = {'feed': feed}
+        route_ids = []
+        route_numbers = {}
+        for route in Route._get_collection().find(spec, {'route_id': True}):
+            route_numbers[route['_id']] = len(route_ids)
+            route_ids.append(route['route_id'])
+        direction_values = dict(
+            (direction['_id'], direction['value']) for direction in
+            Direction._get_collection().find({}, {'value': True}))
+
+        # first departure and duration of the trips having stop times
+        scheduled = {}
+        generation = {'feed': feed,
+                      'generation': PatternGeneration.current(feed)}
+        for row in PatternTrip._get_collection().find(
+                generation, {'trip': True, 'start': True, 'times': True}):
+            scheduled[_ref_id(row['trip'])] = (row['start'],
+                                               sum(row['times'][:-1]))
+        periods = {}
+        for row in Frequency._get_collection().find(spec):
+            periods.setdefault(_ref_id(row['trip']), []).append(
+                (row['start_time'], row['end_time'], row['headway_secs']))
+
+        service_ids = []
+        service_numbers = {}
+        (routes, directions, services, starts, durations) = \
+            ([], [], [], [], [])
+        for trip in Trip._get_collection().find(
+                spec, {'route': True, 'direction': True, 'service': True,
+                       'trip_time': True}):
+            route = route_numbers.get(_ref_id(trip.get('route')))
+            if route is None:
+                continue
+            service_id = _ref_id(trip.get('service'))
+            if service_id not in service_numbers:
+                service_numbers[service_id] = len(service_ids)
+                service_ids.append(service_id)
+            direction = direction_values.get(_ref_id(trip.get('direction')),
+                                             NO_DIRECTION)
+            (start, duration) = scheduled.get(trip['_id'], (None, None))
+            if duration is None and trip.get('trip_time') is not None:
+                duration = trip['trip_time'] * 60
+            run_starts = [start]
+            if trip['_id'] in periods:
+                run_starts = [run_start for (start_time, end_time, headway)
+                              in periods[trip['_id']] if headway > 0
+                              for run_start in range(start_time, end_time,
+                                                     headway)]
+            for run_start in run_starts:
+                routes.append(route)
+                directions.append(direction)
+                services.append(service_numbers[service_id])
+                starts.append(numpy.nan if run_start is None else run_start)
+                durations.append(numpy.nan if duration is None else duration)
+        return Timetable(route_ids, service_ids, routes, directions, services,
+                         starts, durations)
+
+
+_timetables = VersionedByFeed(Timetable.build)
+
+
+def route_metrics(day, route_id=None, feed=DEFAULT_FEED):
+    """Metrics of the routes of `feed` running on `day`, only of `route_id`
+    when given."""
+    metrics = _timetables.get(feed).running(services_on(day, feed)) \
+        .route_metrics()
+    if route_id is not None:
+        metrics = [metric for metric in metrics
+                   if metric['route_id'] == route_id]
+    return metrics
+
+
+def formatted(metric):
+    """`metric` with its departure and arrival as GTFS times."""
+    metric = dict(metric)
+    for field in ('first_departure', 'last_arrival'):
+        if metric[field] is not None:
+            metric[field] = format_time(metric[field])
+    return metric
@@ -0,0 +1,67 @@
+""" Service calendars.
+
+Resolves which services run on a given day from calendar.txt weekly
+patterns and their calendar_dates.txt exceptions.
+
+"""
+from datetime import datetime
+from datetime import timedelta
+from bson import DBRef
+from service.models import Calendar
+from service.models import CalendarDate
+from service.models import DEFAULT_FEED
+from service.models import ExceptionType
+
+WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday',
+            'saturday', 'sunday')
+
+# exception_type values
+SERVICE_ADDED = 1
+SERVICE_REMOVED = 2
+
+
+def _ref_id(value):
+    return value.id if isinstance(value, DBRef) else value
+
+
+def _day(value):
+    return value.date() if isinstance(value, datetime) else value
+
+
+def active_services(day, calendars, exceptions):
+    """Services running on `day`.
+
+    `calendars` are raw calendar documents and `exceptions` map services to
+    the exception_type value applying to `day`.
+    """
+    services = set()
+    weekday = WEEKDAYS[day.weekday()]
+    for calendar in calendars:
+        if _day(calendar['start_date']) <= day <= _day(calendar['end_date']) \
+                and int(calendar.get(weekday) or 0) == 1:
+            services.add(_ref_id(calendar['service']))
+    for (service, exception_type) in exceptions.items():
+        if exception_type == SERVICE_ADDED:
+            services.add(service)
+        elif exception_type == SERVICE_REMOVED:
+            services.discard(service)
+    return services
+
+
+def services_on(day, feed=DEFAULT_FEED):
+    """Ids of the services of `feed` running on `day`, a `date`."""
+    calendars = Calendar._get_collection().find(
+        {'feed': feed,
+         'start_date': {'$lte': datetime(day.year, day.month, day.day)},
+         'end_date': {'$gte': datetime(day.year, day.month, day.day)}})
+    exception_types = dict(
+        (row['_id'], row['value']) for row in
+        ExceptionType._get_collection().find({}, {'value': True}))
+    start = datetime(day.year, day.month, day.day)
+    exceptions = dict(
+        (_ref_id(row['service']),
+         exception_types.get(_ref_id(row['exception_type'])))
+        for row in CalendarDate._get_collection().find(
+            {'feed': feed,
+             'date': {'$gte': start, '$lt': start + timedelta(days=1)}}))
+    return active_services(day, calendars, exceptions)
@@ -0,0 +1,346 @@
+""" Streaming export of a feed back to a GTFS zip archive.
+
+Every GTFS file is produced from its collection through a raw cursor read in
+large batches, references being resolved through `_id -> gtfs id` tables
+loaded once per file instead of dereferencing documents. Files do not depend
+on each other, so worker processes write them side by side into temporary
+CSV files which are then streamed into the archive.
+
+Repeated exports of the same data are byte-identical: rows are read in index
+order, entries are added in a fixed order and carry a fixed timestamp and
+mode, which lets the archive be cached by its digest.
+
+"""
+import csv
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from multiprocessing import Pool
+from bson.dbref import DBRef
+from service.models import Agency
+from service.models import Block
+from service.models import Calendar
+from service.models import CalendarDate
+from service.models import DEFAULT_FEED
+from service.models import Direction
+from service.models import DropOffType
+from service.models import ExceptionType
+from service.models import Fare
+from service.models import FareAttribute
+from service.models import FareRule
+from service.models import Frequency
+from service.models import PaymentMethod
+from service.models import PickupType
+from service.models import Route
+from service.models import RouteType
+from service.models import Service
+from service.models import Shape
+from service.models import Stop
+from service.models import StopTime
+from service.models import Trip
+from service.models import WheelchairAccessible
+from service.models import Zone
+from service.times import format_time
+from service.times import seconds_of
+
+# documents fetched per round trip to the database
+BATCH_SIZE = 10000
+
+# timestamp of every archive entry, the earliest a zip file can hold
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+ZIP_MODE = 0o644
+
+
+def _ref_id(value):
+    return value.id if isinstance(value, DBRef) else value
+
+
+def text(value):
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, float):
+        # shortest representation reading back to the same float
+        return repr(value)
+    return str(value)
+
+
+def gtfs_date(value):
+    return value.strftime('%Y%m%d') if value is not None else None
+
+
+def gtfs_time(value):
+    seconds = seconds_of(value)
+    return format_time(seconds) if seconds is not None else None
+
+
+def latitude(geopoint):
+    return geopoint[0] if geopoint else None
+
+
+def longitude(geopoint):
+    return geopoint[1] if geopoint else None
+
+
+class Reference(object):
+    """Replaces references to `model_class` by one of its fields."""
+
+    def __init__(self, model_class, field, shared=False):
+        self.model_class = model_class
+        self.field = field
+        # referential collections are not namespaced by feed
+        self.shared = shared
+        self.values = None
+
+    def load(self, feed):
+        spec = {} if self.shared else {'feed': feed}
+        cursor = self.model_class._get_collection() \
+            .find(spec, {self.field: True}).batch_size(BATCH_SIZE)
+        self.values = dict((row['_id'], row.get(self.field))
+                           for row in cursor)
+
+    def __call__(self, value):
+        return self.values.get(_ref_id(value))
+
+
+class ShapeReference(Reference):
+    """Resolves trip shapes, stored as the list of their points, by the
+    shape_id of their first point."""
+
+    def __init__(self):
+        Reference.__init__(self, Shape, 'shape_id')
+
+    def load(self, feed):
+        # only the first point of each shape is looked up
+        cursor = Trip._get_collection() \
+            .find({'feed': feed}, {'shapes': {'$slice': 1}}) \
+            .batch_size(BATCH_SIZE)
+        first_points = list(set(_ref_id(trip['shapes'][0])
+                                for trip in cursor if trip.get('shapes')))
+        self.values = dict((row['_id'], row['shape_id']) for row in
+                           Shape._get_collection().find(
+                               {'_id': {'$in': first_points}},
+                               {'shape_id': True}))
+
+    def __call__(self, value):
+        return Reference.__call__(self, value[0]) if value else None
+
+
+class GtfsFile(object):
+    """A GTFS file written from the documents of `model_class`.
+
+    `columns` lists `(header, field, convert)` triples, `convert` being
+    applied to non-empty values only. `sort` is what keeps the row order
+    stable between exports, and is served by an index on large files.
+
+    """
+
+    def __init__(self, filename, model_class, columns, sort):
+        self.filename = filename
+        self.model_class = model_class
+        self.columns = columns
+        self.sort = sort
+
+    def references(self):
+        return [convert for (_, _, convert) in self.columns
+                if isinstance(convert, Reference)]
+
+    def rows(self, feed):
+        for reference in self.references():
+            reference.load(feed)
+        fields = dict((field, True) for (_, field, _) in self.columns)
+        cursor = self.model_class._get_collection() \
+            .find({'feed': feed}, fields) \
+            .sort(self.sort) \
+            .batch_size(BATCH_SIZE)
+        for document in cursor:
+            yield self.row(document)
+
+    def row(self, document):
+        row = []
+        for (_, field, convert) in self.columns:
+            value = document.get(field)
+            if value is not None and convert is not None:
+                value = convert(value)
+            row.append(text(value))
+        return row
+
+    def write(self, feed, output):
+        """Writes the file as CSV into `output`, returns the rows count."""
+        writer = csv.writer(output)
+        writer.writerow([header for (header, _, _) in self.columns])
+        count = 0
+        for row in self.rows(feed):
+            writer.writerow(row)
+            count += 1
+        return count
+
+
+GTFS_FILES = [
+    GtfsFile('agency.txt', Agency, [
+        ('agency_id', 'agency_id', None),
+        ('agency_name', 'name', None),
+        ('agency_url', 'url', None),
+        ('agency_timezone', 'timezone', None),
+        ('agency_lang', 'lang', None),
+        ('agency_phone', 'phone', None),
+        ('agency_fare_url', 'fare_url', None),
+    ], sort=[('_id', 1)]),
+    GtfsFile('stops.txt', Stop, [
+        ('stop_id', 'stop_id', None),
+        ('stop_code', 'code', None),
+        ('stop_name', 'name', None),
+        ('stop_desc', 'desc', None),
+        ('stop_lat', 'geopoint', latitude),
+        ('stop_lon', 'geopoint', longitude),
+        ('zone_id', 'zone', Reference(Zone, 'zone_id')),
+        ('stop_url', 'url', None),
+        ('location_type', 'location_type', None),
+        ('parent_station', 'parent_station', Reference(Stop, 'stop_id')),
+        ('wheelchair_boarding', 'wheelchair',
+         Reference(WheelchairAccessible, 'value', shared=True)),
+    ], sort=[('feed', 1), ('stop_id', 1)]),
+    GtfsFile('routes.txt', Route, [
+        ('route_id', 'route_id', None),
+        ('agency_id', 'agency', Reference(Agency, 'agency_id')),
+        ('route_short_name', 'short_name', None),
+        ('route_long_name', 'long_name', None),
+        ('route_desc', 'desc', None),
+        ('route_type', 'route_type',
+         Reference(RouteType, 'value', shared=True)),
+        ('route_url', 'url', None),
+        ('route_color', 'color', None),
+        ('route_text_color', 'text_color', None),
+    ], sort=[('feed', 1), ('route_id', 1)]),
+    GtfsFile('trips.txt', Trip, [
+        ('route_id', 'route', Reference(Route, 'route_id')),
+        ('service_id', 'service', Reference(Service, 'service_id')),
+        ('trip_id', 'trip_id', None),
+        ('trip_headsign', 'headsign', None),
+        ('trip_short_name', 'short_name', None),
+        ('direction_id', 'direction',
+         Reference(Direction, 'value', shared=True)),
+        ('block_id', 'block', Reference(Block, 'block_id')),
+        ('shape_id', 'shapes', ShapeReference()),
+        ('wheelchair_accessible', 'wheelchair',
+         Reference(WheelchairAccessible, 'value', shared=True)),
+    ], sort=[('feed', 1), ('trip_id', 1)]),
+    GtfsFile('stop_times.txt', StopTime, [
+        ('trip_id', 'trip', Reference(Trip, 'trip_id')),
+        ('arrival_time', 'arrival_time', gtfs_time),
+        ('departure_time', 'departure_time', gtfs_time),
+        ('stop_id', 'stop', Reference(Stop, 'stop_id')),
+        ('stop_sequence', 'stop_sequence', None),
+        ('stop_headsign', 'headsign', None),
+        ('pickup_type', 'pickup_type',
+         Reference(PickupType, 'value', shared=True)),
+        ('drop_off_type', 'drop_off_type',
+         Reference(DropOffType, 'value', shared=True)),
+        ('shape_dist_traveled', 'shape_dist_traveled', None),
+    ], sort=[('trip', 1), ('stop_sequence', 1)]),
+    GtfsFile('calendar.txt', Calendar, [
+        ('service_id', 'service', Reference(Service, 'service_id')),
+        ('monday', 'monday', None),
+        ('tuesday', 'tuesday', None),
+        ('wednesday', 'wednesday', None),
+        ('thursday', 'thursday', None),
+        ('friday', 'friday', None),
+        ('saturday', 'saturday', None),
+        ('sunday', 'sunday', None),
+        ('start_date', 'start_date', gtfs_date),
+        ('end_date', 'end_date', gtfs_date),
+    ], sort=[('_id', 1)]),
+    GtfsFile('calendar_dates.txt', CalendarDate, [
+        ('service_id', 'service', Reference(Service, 'service_id')),
+        ('date', 'date', gtfs_date),
+        ('exception_type', 'exception_type',
+         Reference(ExceptionType, 'value', shared=True)),
+    ], sort=[('_id', 1)]),
+    GtfsFile('shapes.txt', Shape, [
+        ('shape_id', 'shape_id', None),
+        ('shape_pt_lat', 'geopoint', latitude),
+        ('shape_pt_lon', 'geopoint', longitude),
+        ('shape_pt_sequence', 'pt_sequence', None),
+        ('shape_dist_traveled', 'dist_traveled', None),
+    ], sort=[('feed', 1), ('shape_id', 1), ('pt_sequence', 1)]),
+    GtfsFile('frequencies.txt', Frequency, [
+        ('trip_id', 'trip', Reference(Trip, 'trip_id')),
+        ('start_time', 'start_time', format_time),
+        ('end_time', 'end_time', format_time),
+        ('headway_secs', 'headway_secs', None),
+        ('exact_times', 'exact_times', None),
+    ], sort=[('trip', 1), ('start_time', 1)]),
+    GtfsFile('fare_attributes.txt', FareAttribute, [
+        ('fare_id', 'fare', Reference(Fare, 'fare_id')),
+        ('price', 'price', None),
+        ('currency_type', 'currency', None),
+        ('payment_method', 'payment_method',
+         Reference(PaymentMethod, 'vale', shared=True)),
+        ('transfers', 'transfers', None),
+        ('transfer_duration', 'transfer_duration', None),
+    ], sort=[('_id', 1)]),
+    GtfsFile('fare_rules.txt', FareRule, [
+        ('fare_id', 'fare', Reference(Fare, 'fare_id')),
+        ('route_id', 'route', Reference(Route, 'route_id')),
+        ('origin_id', 'origin', Reference(Zone, 'zone_id')),
+        ('destination_id', 'destination', Reference(Zone, 'zone_id')),
+        ('contains_id', 'contains', Reference(Zone, 'zone_id')),
+    ], sort=[('_id', 1)]),
+]
+
+
+def _export_file(job):
+    (index, feed, directory) = job
+    gtfs_file = GTFS_FILES[index]
+    path = os.path.join(directory, gtfs_file.filename)
+    with open(path, 'wb') as output:
+        count = gtfs_file.write(feed, output)
+    return gtfs_file.filename, path, count
+
+
+def write_archive(path, entries):
+    """Streams the `(filename, source path)` entries into the zip `path`.
+
+    Entries take the timestamp and mode of their source file, so both are
+    pinned beforehand to keep the archive independent of when it was built.
+
+    """
+    mtime = time.mktime(ZIP_DATE_TIME + (0, 0, -1))
+    archive = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+    try:
+        for (filename, source) in entries:
+            os.chmod(source, ZIP_MODE)
+            os.utime(source, (mtime, mtime))
+            archive.write(source, filename)
+    finally:
+        archive.close()
+
+
+def export(path, feed=DEFAULT_FEED, processes=None):
+    """Exports `feed` as a GTFS zip archive at `path`.
+
+    Returns the number of rows written per file, files without any row
+    being left out of the archive.
+
+    """
+    directory = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(path)))
+    jobs = [(index, feed, directory) for index in range(len(GTFS_FILES))]
+    pool = Pool(processes)
+    try:
+        exported = pool.map(_export_file, jobs)
+        pool.close()
+        pool.join()
+
+        entries = [(filename, source) for (filename, source, count)
+                   in exported if count]
+        # written aside then renamed, readers never see a partial archive
+        partial = os.path.join(directory, os.path.basename(path))
+        write_archive(partial, entries)
+        os.rename(partial, path)
+    finally:
+        pool.terminate()
+        shutil.rmtree(directory, ignore_errors=True)
+    return dict((filename, count) for (filename, _, count) in exported)
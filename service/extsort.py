@@ -0,0 +1,104 @@
+""" External merge sort of rows larger than memory.
+
+Rows are buffered until their estimated size reaches the memory budget, then
+sorted and spilled to a temporary file as a run. The runs are finally merged
+lazily with :py:func:`heapq.merge`, holding a single row per run in memory,
+so feeds not sorted by trip can be grouped by trip whatever their size.
+
+"""
+import heapq
+import marshal
+import os
+import sys
+import tempfile
+from itertools import groupby
+
+# bytes of rows held in memory before a run is spilled to disk
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+
+
+def _row_size(row):
+    return sys.getsizeof(row) + sum(sys.getsizeof(value)
+                                    for value in row.itervalues())
+
+
+def _spill(items, directory):
+    (handle, path) = tempfile.mkstemp(prefix='extsort-', dir=directory)
+    with os.fdopen(handle, 'wb') as run:
+        for item in items:
+            marshal.dump(item, run)
+    return path
+
+
+def _read(path):
+    with open(path, 'rb') as run:
+        while True:
+            try:
+                yield marshal.load(run)
+            except EOFError:
+                return
+
+
+class ExternalSorter(object):
+    """Sorts dict rows by `key`, spilling runs under `directory`.
+
+    Keys and rows must be made of plain values (strings, numbers, lists,
+    dicts) since runs are written with :py:mod:`marshal`. The sort is stable
+    and `runs` tells how many runs the last sort spilled.
+
+    """
+
+    def __init__(self, key, memory_budget=DEFAULT_MEMORY_BUDGET,
+                 directory=None):
+        self.key = key
+        self.memory_budget = memory_budget
+        self.directory = directory
+        self.runs = 0
+
+    def sort(self, rows):
+        paths = []
+        try:
+            buffered = []
+            size = 0
+            # the position keeps equal keys in input order and rows from
+            # ever being compared
+            for (position, row) in enumerate(rows):
+                buffered.append((self.key(row), position, row))
+                size += _row_size(row)
+                if size >= self.memory_budget:
+                    buffered.sort()
+                    paths.append(_spill(buffered, self.directory))
+                    buffered = []
+                    size = 0
+            buffered.sort()
+
+            if not paths:
+                self.runs = 0
+                for (_, _, row) in buffered:
+                    yield row
+                return
+            if buffered:
+                paths.append(_spill(buffered, self.directory))
+            del buffered
+            self.runs = len(paths)
+            for (_, _, row) in heapq.merge(*[_read(path) for path in paths]):
+                yield row
+        finally:
+            for path in paths:
+                os.remove(path)
+
+
+def external_sort(rows, key, memory_budget=DEFAULT_MEMORY_BUDGET,
+                  directory=None):
+    """Yields `rows` sorted by `key` within `memory_budget` bytes."""
+    return ExternalSorter(key, memory_budget, directory).sort(rows)
+
+
+def sorted_groups(rows, key, order=None, memory_budget=DEFAULT_MEMORY_BUDGET,
+                  directory=None):
+    """Yields `(key, rows)` for each key of `rows`, rows of a group being
+    sorted by `order` when given."""
+    sort_key = key if order is None else lambda row: (key(row), order(row))
+    return ((value, list(group)) for (value, group) in
+            groupby(external_sort(rows, sort_key, memory_budget, directory),
+                    key))
@@ -0,0 +1,220 @@
+""" Fare calculation.
+
+The rules of fare_rules.txt are compiled once per feed version into lookup
+tables: one per route having rules of its own plus one for every other
+route, each mapping an `(origin zone, destination zone)` pair to the fare
+classes valid for it, cheapest first. Zones no rule names fall back to the
+`ANY` row or column, so pricing a leg is two set lookups and two dict
+lookups whatever the number of rules. Rules with a contains_id are matched
+separately, only for legs giving the zones they pass through.
+
+A journey is priced leg after leg: a leg rides on the ticket bought for a
+previous one while that fare class is valid for it and has transfers and
+transfer time left, otherwise the cheapest fare class valid for the leg is
+bought.
+
+"""
+from bson import DBRef
+from service.models import DEFAULT_FEED
+from service.models import Fare
+from service.models import FareAttribute
+from service.models import FareRule
+from service.models import Route
+from service.models import Stop
+from service.models import Zone
+from service.versioned import VersionedByFeed
+
+# wildcard of the rules leaving the route or a zone empty
+ANY = None
+
+
+def _ref_id(value):
+    return value.id if isinstance(value, DBRef) else value
+
+
+class FareClass(object):
+    """A fare_attributes.txt row, `transfers` and `transfer_duration` being
+    None when unlimited."""
+    __slots__ = ('fare_id', 'price', 'currency', 'transfers',
+                 'transfer_duration')
+
+    def __init__(self, fare_id, price, currency=None, transfers=None,
+                 transfer_duration=None):
+        self.fare_id = fare_id
+        self.price = price
+        self.currency = currency
+        self.transfers = transfers
+        self.transfer_duration = transfer_duration
+
+    def __repr__(self):
+        return 'FareClass(%r, %r)' % (self.fare_id, self.price)
+
+
+class Leg(object):
+    """A ride on `route_id` from the `origin` to the `destination` zone,
+    boarding at `departure` seconds. `zones` are all the zones the leg
+    passes through, only needed by the fares with contains rules."""
+    __slots__ = ('route_id', 'origin', 'destination', 'departure', 'zones')
+
+    def __init__(self, route_id, origin, destination, departure=None,
+                 zones=None):
+        self.route_id = route_id
+        self.origin = origin
+        self.destination = destination
+        self.departure = departure
+        self.zones = zones
+
+
+class FareTable(object):
+    def __init__(self, fares, rules, stop_zones=None):
+        """`fares` are :py:class:`FareClass` and `rules` `(fare_id, route_id,
+        origin, destination, contains)` tuples, empty fields being
+        :py:data:`ANY`. A fare class without rules is valid everywhere."""
+        self.fares = dict((fare.fare_id, fare) for fare in fares)
+        self.stop_zones = stop_zones or {}
+        plain = []
+        contained = {}
+        for (fare_id, route_id, origin, destination, contains) in rules:
+            if fare_id not in self.fares:
+                continue
+            if contains is ANY:
+                plain.append((fare_id, route_id, origin, destination))
+            else:
+                # the contains rows of a fare form a single rule
+                contained.setdefault((fare_id, route_id, origin, destination),
+                                     set()).add(contains)
+        ruled = set(rule[0] for rule in plain) | \
+            set(key[0] for key in contained)
+        plain.extend((fare_id, ANY, ANY, ANY) for fare_id in self.fares
+                     if fare_id not in ruled)
+
+        self._origins = set(rule[2] for rule in plain) - set([ANY])
+        self._destinations = set(rule[3] for rule in plain) - set([ANY])
+        self._tables = self._compile(plain)
+        self._any_route = self._tables[ANY]
+        self._contained = [(route_id, origin, destination, frozenset(zones),
+                            self.fares[fare_id])
+                           for ((fare_id, route_id, origin, destination),
+                                zones) in sorted(contained.items())]
+
+    def _compile(self, rules):
+        routes = [ANY] + sorted(set(rule[1] for rule in rules) - set([ANY]))
+        origins = [ANY] + sorted(self._origins)
+        destinations = [ANY] + sorted(self._destinations)
+        tables = dict((route_id, {}) for route_id in routes)
+        for (fare_id, route_id, origin, destination) in rules:
+            # a wildcard rule also holds for every named route or zone
+            for table_route in (routes if route_id is ANY else [route_id]):
+                table = tables[table_route]
+                for table_origin in (origins if origin is ANY
+                                     else [origin]):
+                    for table_destination in (destinations
+                                              if destination is ANY
+                                              else [destination]):
+                        table.setdefault((table_origin, table_destination),
+                                         set()).add(fare_id)
+        for table in tables.itervalues():
+            for (pair, fare_ids) in table.items():
+                table[pair] = tuple(sorted(
+                    (self.fares[fare_id] for fare_id in fare_ids),
+                    key=lambda fare: (fare.price, fare.fare_id)))
+        return tables
+
+    def fares_of(self, leg):
+        """Fare classes valid for `leg`, cheapest first."""
+        origin = leg.origin if leg.origin in self._origins else ANY
+        destination = leg.destination \
+            if leg.destination in self._destinations else ANY
+        fares = self._tables.get(leg.route_id, self._any_route) \
+            .get((origin, destination), ())
+        if self._contained and leg.zones:
+            zones = frozenset(leg.zones) | \
+                frozenset([leg.origin, leg.destination])
+            matches = [fare for (route_id, origin, destination, contains, fare)
+                       in self._contained
+                       if route_id in (ANY, leg.route_id)
+                       and origin in (ANY, leg.origin)
+                       and destination in (ANY, leg.destination)
+                       and contains == zones]
+            if matches:
+                fares = tuple(sorted(set(fares) | set(matches),
+                                     key=lambda fare: (fare.price,
+                                                       fare.fare_id)))
+        return fares
+
+    def tickets(self, legs):
+        """Fare classes bought along `legs`, None when a leg has no valid
+        fare."""
+        tickets = []
+        (ticket, bought_at, transfers_left) = (None, None, None)
+        for leg in legs:
+            fares = self.fares_of(leg)
+            if not fares:
+                return None
+            if ticket is not None and ticket in fares \
+                    and transfers_left != 0 \
+                    and (ticket.transfer_duration is None or
+                         leg.departure is None or bought_at is None or
+                         leg.departure - bought_at <=
+                         ticket.transfer_duration):
+                if transfers_left is not None:
+                    transfers_left -= 1
+                continue
+            ticket = fares[0]
+            bought_at = leg.departure
+            transfers_left = ticket.transfers
+            tickets.append(ticket)
+        return tickets
+
+    def price(self, legs):
+        """Total price of `legs`, None when a leg has no valid fare."""
+        tickets = self.tickets(legs)
+        if tickets is None:
+            return None
+        return sum(ticket.price for ticket in tickets)
+
+    def leg(self, route_id, origin_stop, destination_stop, departure=None,
+            stops=None):
+        """The :py:class:`Leg` between two stop_ids, passing through the
+        zones of the stop_ids `stops` when given."""
+        zones = None
+        if stops is not None:
+            zones = set(self.stop_zones.get(stop) for stop in stops)
+            zones.discard(None)
+        return Leg(route_id, self.stop_zones.get(origin_stop),
+                   self.stop_zones.get(destination_stop), departure, zones)
+
+    @staticmethod
+    def build(feed=DEFAULT_FEED):
+        spec = {'feed': feed}
+        fare_ids = dict((fare['_id'], fare['fare_id']) for fare in
+                        Fare._get_collection().find(spec, {'fare_id': True}))
+        route_ids = dict((route['_id'], route['route_id']) for route in
+                         Route._get_collection().find(spec,
+                                                      {'route_id': True}))
+        zone_ids = dict((zone['_id'], zone['zone_id']) for zone in
+                        Zone._get_collection().find(spec, {'zone_id': True}))
+        fares = [FareClass(fare_ids.get(_ref_id(row['fare'])), row['price'],
+                           row.get('currency'), row.get('transfers'),
+                           row.get('transfer_duration'))
+                 for row in FareAttribute._get_collection().find(spec)]
+        rules = [(fare_ids.get(_ref_id(row['fare'])),
+                  route_ids.get(_ref_id(row.get('route'))),
+                  zone_ids.get(_ref_id(row.get('origin'))),
+                  zone_ids.get(_ref_id(row.get('destination'))),
+                  zone_ids.get(_ref_id(row.get('contains'))))
+                 for row in FareRule._get_collection().find(spec)]
+        stop_zones = dict(
+            (stop['stop_id'], zone_ids.get(_ref_id(stop['zone'])))
+            for stop in Stop._get_collection().find(
+                dict(spec, zone={'$exists': True}),
+                {'stop_id': True, 'zone': True}))
+        return FareTable(fares, rules, stop_zones)
+
+
+_tables = VersionedByFeed(FareTable.build)
+
+
+def fare_table(feed=DEFAULT_FEED):
+    """The compiled :py:class:`FareTable` of `feed`."""
+    return _tables.get(feed)
@@ -0,0 +1,160 @@
+""" Lazy expansion of headway-based trips.
+
+A trip listed in frequencies.txt is a template: its stop times only give the
+offsets between stops, and the trip runs every `headway_secs` between
+`start_time` and `end_time`. Expanding every template into explicit stop
+times would multiply the timetable size, so :py:class:`HeadwayTrip` only
+generates the departures falling inside the window a query asks for.
+
+Templates are still stored as ordinary pattern trips; the pattern timetables,
+the origin-destination index and the position engine keep them apart from
+the scheduled trips and expand them through :py:class:`HeadwayTrip` when
+queried.
+
+"""
+from bson import DBRef
+from service.models import DEFAULT_FEED
+from service.models import Frequency
+from service.models import StopTime
+from service.models import Trip
+from service.times import monotonic
+from service.times import seconds_of
+
+
+class HeadwayTrip(object):
+    """A frequency-based trip template.
+
+    `periods` are `(start_time, end_time, headway_secs)` tuples and `offsets`
+    `(stop, arrival_offset, departure_offset)` tuples relative to the first
+    departure of the trip, in stop sequence order. Times are in seconds.
+    """
+
+    def __init__(self, trip_id, periods, offsets):
+        self.trip_id = trip_id
+        self.periods = sorted(periods)
+        self.offsets = offsets
+
+    def starts(self, window_start, window_end):
+        """Yields the trip start times in `[window_start, window_end)`."""
+        for (start_time, end_time, headway) in self.periods:
+            if end_time <= window_start or start_time >= window_end:
+                continue
+            skipped = max(0, -(-(window_start - start_time) // headway))
+            start = start_time + skipped * headway
+            while start < end_time and start < window_end:
+                yield start
+                start += headway
+
+    def departures_at(self, stop_index, window_start, window_end):
+        """Yields `(trip_start, departure)` at the `stop_index`-th stop for
+        departures in `[window_start, window_end)`."""
+        offset = self.offsets[stop_index][2]
+        for start in self.starts(window_start - offset, window_end - offset):
+            yield start, start + offset
+
+    def instance(self, start):
+        """Concrete `(stop, arrival, departure)` of the trip leaving at
+        `start`."""
+        return [(stop, start + arrival, start + departure)
+                for (stop, arrival, departure) in self.offsets]
+
+    def instances(self, window_start, window_end):
+        for start in self.starts(window_start, window_end):
+            yield start, self.instance(start)
+
+    @staticmethod
+    def from_times(trip_id, periods, stops, times):
+        """Template of a trip whose interleaved `(a0, d0, a1, d1, ...)`
+        times are those of its first run."""
+        first = times[1]
+        return HeadwayTrip(trip_id, periods, [
+            (stop, times[2 * index] - first, times[2 * index + 1] - first)
+            for (index, stop) in enumerate(stops)])
+
+
+def _ref_id(value):
+    return value.id if isinstance(value, DBRef) else value
+
+
+def _offsets(rows):
+    """Offsets of the stop times `rows` from the first known time, None when
+    no stop time has one."""
+    rows = sorted(rows, key=lambda row: row['stop_sequence'])
+    arrivals = monotonic([seconds_of(row.get('arrival_time'))
+                          for row in rows])
+    departures = monotonic([seconds_of(row.get('departure_time'))
+                            for row in rows])
+    first = departures[0] if departures[0] is not None else arrivals[0]
+    if first is None:
+        # runs then start at the first stop having a time
+        known = [arrival if arrival is not None else departure
+                 for (arrival, departure) in zip(arrivals, departures)
+                 if arrival is not None or departure is not None]
+        if not known:
+            return None
+        first = known[0]
+    previous = first
+    offsets = []
+    for (row, arrival, departure) in zip(rows, arrivals, departures):
+        arrival = arrival if arrival is not None else departure
+        departure = departure if departure is not None else arrival
+        # stops without times wait at the previous timed stop
+        if arrival is None:
+            (arrival, departure) = (previous, previous)
+        previous = departure
+        offsets.append((_ref_id(row['stop']), arrival - first,
+                        departure - first))
+    return offsets
+
+
+def periods_of(trips=None, feed=DEFAULT_FEED):
+    """`(start_time, end_time, headway_secs)` periods of the frequency-based
+    trips of `feed`, by trip document id, optionally only for the trip
+    document ids `trips`."""
+    spec = {'feed': feed}
+    if trips is not None:
+        spec['trip'] = {'$in': list(trips)}
+    periods = {}
+    for row in Frequency._get_collection().find(
+            spec, {'trip': True, 'start_time': True, 'end_time': True,
+                   'headway_secs': True}):
+        periods.setdefault(_ref_id(row['trip']), []).append(
+            (row['start_time'], row['end_time'], row['headway_secs']))
+    return periods
+
+
+def headway_trips(trip_ids=None, feed=DEFAULT_FEED):
+    """Loads the templates of the frequency-based trips of `feed`, by
+    trip_id.
+
+    Issues one query per collection whatever the number of trips.
+    """
+    trips = None
+    if trip_ids is not None:
+        trips = [trip['_id'] for trip in Trip._get_collection().find(
+            {'feed': feed, 'trip_id': {'$in': list(trip_ids)}},
+            {'trip_id': True})]
+    periods = periods_of(trips, feed)
+    if not periods:
+        return {}
+
+    stop_times = {}
+    cursor = StopTime._get_collection().find(
+        {'trip': {'$in': list(periods)}},
+        {'trip': True, 'stop': True, 'stop_sequence': True,
+         'arrival_time': True, 'departure_time': True})
+    for row in cursor:
+        stop_times.setdefault(_ref_id(row['trip']), []).append(row)
+
+    trip_ids = dict((trip['_id'], trip['trip_id']) for trip in
+                    Trip._get_collection().find(
+                        {'_id': {'$in': list(periods)}}, {'trip_id': True}))
+    templates = {}
+    for (trip, trip_periods) in periods.items():
+        if trip not in stop_times or trip not in trip_ids:
+            continue
+        offsets = _offsets(stop_times[trip])
+        if offsets is not None:
+            templates[trip_ids[trip]] = HeadwayTrip(trip_ids[trip],
+                                                    trip_periods, offsets)
+    return templates
@@ -0,0 +1,180 @@
+""" Geometry helpers for shapes and stops.
+
+Points are `(lat, lon)` pairs, the order used by the `geopoint` fields of
+:py:mod:`service.models`.
+
+"""
+import numpy
+
+EARTH_RADIUS = 6371008.8
+
+# squared degrees added to a snapping going backwards along a segment, far
+# more than any stop off its shape
+BACKWARDS_PENALTY = 1.0
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Great-circle distance in meters, broadcasting over numpy arrays."""
+    (lat1, lon1, lat2, lon2) = [numpy.radians(value) for value in
+                                (lat1, lon1, lat2, lon2)]
+    a = numpy.sin((lat2 - lat1) / 2) ** 2 + \
+        numpy.cos(lat1) * numpy.cos(lat2) * numpy.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * numpy.arcsin(numpy.sqrt(a))
+
+
+def _planar(points):
+    # equirectangular projection around the mean latitude, good enough to
+    # compare distances along a single shape
+    coords = numpy.asarray(points, dtype=float)
+    planar = coords[:, ::-1].copy()
+    planar[:, 0] *= numpy.cos(numpy.radians(coords[:, 0].mean()))
+    return planar
+
+
+def simplify(points, tolerance):
+    """Douglas-Peucker simplification of `points`.
+
+    `tolerance` is expressed in degrees of latitude. Returns the retained
+    points, always including the first and the last one.
+    """
+    if len(points) < 3:
+        return list(points)
+
+    planar = _planar(points)
+    keep = numpy.zeros(len(planar), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(planar) - 1)]
+
+    while stack:
+        (first, last) = stack.pop()
+        if last - first < 2:
+            continue
+        start = planar[first]
+        segment = planar[last] - start
+        offsets = planar[first + 1:last] - start
+        length = numpy.hypot(segment[0], segment[1])
+        if length == 0:
+            distances = numpy.hypot(offsets[:, 0], offsets[:, 1])
+        else:
+            cross = offsets[:, 0] * segment[1] - offsets[:, 1] * segment[0]
+            distances = numpy.abs(cross) / length
+        index = int(distances.argmax())
+        if distances[index] > tolerance:
+            split = first + 1 + index
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+
+    return [point for (point, kept) in zip(points, keep) if kept]
+
+
+def shape_distances(points):
+    """Great-circle distance travelled at each point of a polyline."""
+    coords = numpy.asarray(points, dtype=float).reshape(-1, 2)
+    steps = haversine(coords[:-1, 0], coords[:-1, 1],
+                      coords[1:, 0], coords[1:, 1])
+    return numpy.concatenate([[0.0], numpy.cumsum(steps)])
+
+
+def snap_to_shape(points, stops, distances=None):
+    """Distance along the polyline `points` of each of the ordered `stops`.
+
+    Every stop is projected on a segment of the polyline, segments being
+    chosen in travel order so that the sum of the squared snapping distances
+    is the smallest; a shape going twice by the same street thus keeps its
+    stops in order. `distances` are those of the polyline points, as given
+    by :py:func:`shape_distances` when omitted. The result never decreases.
+    """
+    if distances is None:
+        distances = shape_distances(points)
+    distances = numpy.asarray(distances, dtype=float)
+    if len(points) < 2 or not len(stops):
+        return numpy.zeros(len(stops))
+
+    planar = _planar(points)
+    scale = numpy.cos(numpy.radians(numpy.asarray(points, dtype=float)[:, 0]
+                                    .mean()))
+    coords = numpy.asarray(stops, dtype=float)
+    (stop_x, stop_y) = (coords[:, 1:2] * scale, coords[:, 0:1])
+    (start_x, start_y) = (planar[:-1, 0], planar[:-1, 1])
+    (delta_x, delta_y) = (planar[1:, 0] - start_x, planar[1:, 1] - start_y)
+    lengths = delta_x ** 2 + delta_y ** 2
+
+    # position of every stop on every segment, (stops, segments) arrays
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        ratios = ((stop_x - start_x) * delta_x +
+                  (stop_y - start_y) * delta_y) / lengths
+    ratios = numpy.clip(numpy.nan_to_num(ratios), 0.0, 1.0)
+    costs = (stop_x - start_x - ratios * delta_x) ** 2 + \
+        (stop_y - start_y - ratios * delta_y) ** 2
+
+    # best total cost for the stops up to each one, on each segment: the
+    # previous stop is on an earlier segment, or before on the same one
+    segments = numpy.arange(len(lengths))
+    choices = numpy.zeros(costs.shape, dtype=int)
+    total = costs[0]
+    for index in range(1, len(costs)):
+        best = numpy.minimum.accumulate(total)
+        earlier = numpy.r_[numpy.inf, best[:-1]]
+        earlier_segments = numpy.r_[0, numpy.maximum.accumulate(
+            numpy.where(total == best, segments, 0))[:-1]]
+        same = total + numpy.where(ratios[index - 1] > ratios[index],
+                                   BACKWARDS_PENALTY, 0.0)
+        choices[index] = numpy.where(same <= earlier, segments,
+                                     earlier_segments)
+        total = costs[index] + numpy.minimum(same, earlier)
+
+    chosen = numpy.zeros(len(costs), dtype=int)
+    chosen[-1] = int(total.argmin())
+    for index in range(len(costs) - 1, 0, -1):
+        chosen[index - 1] = choices[index][chosen[index]]
+    ratios = ratios[numpy.arange(len(costs)), chosen]
+    along = distances[chosen] + \
+        ratios * (distances[chosen + 1] - distances[chosen])
+    # stops projected on the same segment may still go backwards
+    return numpy.maximum.accumulate(along)
+
+
+def _encode_value(value):
+    value = ~(value << 1) if value < 0 else value << 1
+    chunks = []
+    while value >= 0x20:
+        chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+        value >>= 5
+    chunks.append(chr(value + 63))
+    return ''.join(chunks)
+
+
+def encode_polyline(points, precision=5):
+    """Encodes `points` with the Google encoded polyline algorithm."""
+    factor = 10 ** precision
+    result = []
+    (previous_lat, previous_lon) = (0, 0)
+    for (lat, lon) in points:
+        lat = int(round(lat * factor))
+        lon = int(round(lon * factor))
+        result.append(_encode_value(lat - previous_lat))
+        result.append(_encode_value(lon - previous_lon))
+        (previous_lat, previous_lon) = (lat, lon)
+    return ''.join(result)
+
+
+def decode_polyline(polyline, precision=5):
+    factor = float(10 ** precision)
+    values = []
+    (value, shift) = (0, 0)
+    for char in polyline:
+        byte = ord(char) - 63
+        value |= (byte & 0x1f) << shift
+        shift += 5
+        if byte < 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            (value, shift) = (0, 0)
+
+    points = []
+    (lat, lon) = (0, 0)
+    for index in range(0, len(values), 2):
+        lat += values[index]
+        lon += values[index + 1]
+        points.append((lat / factor, lon / factor))
+    return points
@@ -0,0 +1,88 @@
+""" Document ids derived from GTFS ids.
+
+Feeds listed in `settings.DETERMINISTIC_ID_FEEDS` give every document the id
+hashed from its feed, its collection and the GTFS fields identifying it,
+instead of an ObjectId made up at insertion. Parsers of these feeds compute
+references from the GTFS ids alone: files no longer have to be loaded after
+the ones they refer to, and loading a file again replaces its documents in
+place instead of duplicating them.
+
+A feed switching strategy must be removed first, since references built by
+the other strategy would point nowhere.
+
+"""
+import hashlib
+from bson.dbref import DBRef
+from bson.objectid import ObjectId
+from django.conf import settings
+from service.models import Agency
+from service.models import Block
+from service.models import Calendar
+from service.models import CalendarDate
+from service.models import Fare
+from service.models import FareAttribute
+from service.models import FareRule
+from service.models import Frequency
+from service.models import Route
+from service.models import Service
+from service.models import Shape
+from service.models import Stop
+from service.models import StopTime
+from service.models import Trip
+from service.models import Zone
+
+# fields identifying a document within its feed
+NATURAL_KEYS = {
+    Agency: ('agency_id',),
+    Zone: ('zone_id',),
+    Stop: ('stop_id',),
+    Route: ('route_id',),
+    Service: ('service_id',),
+    Block: ('block_id',),
+    Shape: ('shape_id', 'pt_sequence'),
+    Trip: ('trip_id',),
+    StopTime: ('trip', 'stop_sequence'),
+    Calendar: ('service',),
+    CalendarDate: ('service', 'date'),
+    Frequency: ('trip', 'start_time'),
+    Fare: ('fare_id',),
+    FareAttribute: ('fare',),
+    FareRule: ('fare', 'route', 'origin', 'destination', 'contains'),
+}
+
+
+def uses_gtfs_ids(feed):
+    return feed in settings.DETERMINISTIC_ID_FEEDS
+
+
+def _key_part(value):
+    if value is None:
+        return ''
+    if isinstance(value, DBRef):
+        value = value.id
+    elif hasattr(value, 'pk'):
+        value = value.pk
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+def document_id(feed, model_class, *key):
+    """The id of the `model_class` document identified by `key`."""
+    parts = [feed, model_class._get_collection_name()] + list(key)
+    digest = hashlib.sha1('\x1f'.join(_key_part(part) for part in parts))
+    return ObjectId(digest.digest()[:12])
+
+
+def natural_id(feed, model_class, values):
+    """The id of the `model_class` document holding the `values` fields."""
+    return document_id(feed, model_class,
+                       *[values.get(field)
+                         for field in NATURAL_KEYS[model_class]])
+
+
+def reference(feed, model_class, *key):
+    """A reference to the `model_class` document identified by `key`, which
+    does not need to exist yet."""
+    return DBRef(model_class._get_collection_name(),
+                 document_id(feed, model_class, *key))
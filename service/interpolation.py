@@ -0,0 +1,231 @@
+""" Times of the stops that are not time points.
+
+GTFS lets stop times leave both arrival and departure empty on stops that
+are not time points. These get times interpolated between the closest timed
+stops of their trip, in proportion to the distance travelled: the
+shape_dist_traveled of the trip when all its stop times have one, the
+great-circle distance between consecutive stops otherwise.
+
+Stop times are streamed trip by trip, ordered by stop sequence, and
+gathered in jobs of whole trips held as flat arrays, so each job is
+interpolated with a few vectorized operations by a worker process. Only a
+few jobs are in flight at once and the times of each one are stored as soon
+as it is done, so memory does not grow with the feed.
+
+"""
+from collections import deque
+from itertools import groupby
+from multiprocessing import Pool
+from multiprocessing import cpu_count
+import numpy
+from bson.dbref import DBRef
+from django.conf import settings
+from service.geometry import haversine
+from service.models import DEFAULT_FEED
+from service.models import Stop
+from service.models import StopTime
+from service.times import seconds_of
+
+# stop times handed to a worker process at once, in whole trips
+ROWS_PER_JOB = 100000
+BATCH_SIZE = 10000
+
+
+def _ref_id(value):
+    return value.id if isinstance(value, DBRef) else value
+
+
+def trip_starts(trips):
+    """Indexes of the first stop time of every trip."""
+    trips = numpy.asarray(trips)
+    if not len(trips):
+        return numpy.zeros(0, dtype=int)
+    return numpy.flatnonzero(numpy.r_[True, trips[1:] != trips[:-1]])
+
+
+def trip_distances(trips, lats, lons, shape_distances):
+    """Distance travelled at every stop time.
+
+    Shape distances are used for the trips having one on every stop time,
+    great-circle distances between consecutive stops otherwise. Only
+    differences within a trip are meaningful.
+    """
+    trips = numpy.asarray(trips)
+    shape_distances = numpy.asarray(shape_distances, dtype=float)
+    count = len(trips)
+    steps = numpy.zeros(count)
+    if count > 1:
+        steps[1:] = haversine(lats[:-1], lons[:-1], lats[1:], lons[1:])
+        steps[1:][trips[1:] != trips[:-1]] = 0.0
+    # stops without a geopoint do not move the vehicle
+    distances = numpy.cumsum(numpy.nan_to_num(steps))
+
+    starts = trip_starts(trips)
+    if not len(starts):
+        return distances
+    measured = numpy.minimum.reduceat(
+        (~numpy.isnan(shape_distances)).astype(int), starts)
+    measured = numpy.repeat(measured.astype(bool),
+                            numpy.diff(numpy.r_[starts, count]))
+    return numpy.where(measured, shape_distances, distances)
+
+
+def interpolate(trips, distances, arrivals, departures):
+    """Fills the missing (NaN) arrival and departure seconds.
+
+    A stop time with one of its times only takes it for the other. Stop
+    times with none are placed between the departure of the previous timed
+    stop and the arrival of the next one of their trip, by distance or by
+    position when the distance does not grow. Stop times before the first or
+    after the last timed stop of their trip stay NaN.
+    """
+    trips = numpy.asarray(trips)
+    distances = numpy.asarray(distances, dtype=float)
+    arrivals = numpy.asarray(arrivals, dtype=float)
+    departures = numpy.asarray(departures, dtype=float)
+    arrivals = numpy.where(numpy.isnan(arrivals), departures, arrivals)
+    departures = numpy.where(numpy.isnan(departures), arrivals, departures)
+
+    count = len(trips)
+    timed = ~numpy.isnan(arrivals)
+    positions = numpy.arange(count)
+    previous = numpy.maximum.accumulate(numpy.where(timed, positions, -1))
+    following = numpy.minimum.accumulate(
+        numpy.where(timed, positions, count)[::-1])[::-1]
+
+    missing = numpy.flatnonzero(~timed & (previous >= 0) & (following < count))
+    before = previous[missing]
+    after = following[missing]
+    inside = (trips[before] == trips[missing]) & \
+        (trips[after] == trips[missing])
+    (missing, before, after) = (missing[inside], before[inside],
+                                after[inside])
+
+    span = distances[after] - distances[before]
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        fraction = numpy.where(
+            span > 0, (distances[missing] - distances[before]) / span,
+            (missing - before) / (after - before).astype(float))
+    fraction = numpy.clip(fraction, 0.0, 1.0)
+    start = departures[before]
+    values = numpy.round(start + fraction * (arrivals[after] - start))
+    arrivals[missing] = values
+    departures[missing] = values
+    return arrivals, departures
+
+
+def _seconds(value):
+    seconds = seconds_of(value)
+    return numpy.nan if seconds is None else seconds
+
+
+def _job(trip_rows, geopoints):
+    """Flat arrays of the stop times of `trip_rows`, a list of trips."""
+    (ids, trips, lats, lons, shape_distances, arrivals, departures) = \
+        ([], [], [], [], [], [], [])
+    for (number, rows) in enumerate(trip_rows):
+        for row in rows:
+            (lat, lon) = geopoints.get(_ref_id(row.get('stop')),
+                                       (None, None))
+            ids.append(row['_id'])
+            trips.append(number)
+            lats.append(numpy.nan if lat is None else lat)
+            lons.append(numpy.nan if lon is None else lon)
+            shape_distance = row.get('shape_dist_traveled')
+            shape_distances.append(numpy.nan if shape_distance is None
+                                   else shape_distance)
+            arrivals.append(_seconds(row.get('arrival_time')))
+            departures.append(_seconds(row.get('departure_time')))
+    return (ids, numpy.array(trips, dtype=int),
+            numpy.array(lats, dtype=float), numpy.array(lons, dtype=float),
+            numpy.array(shape_distances, dtype=float),
+            numpy.array(arrivals, dtype=float),
+            numpy.array(departures, dtype=float))
+
+
+def trip_jobs(trip_rows, geopoints):
+    """Gathers the trips of `trip_rows`, each a list of stop time documents,
+    in jobs of about `ROWS_PER_JOB` stop times."""
+    (chunk, count) = ([], 0)
+    for rows in trip_rows:
+        chunk.append(rows)
+        count += len(rows)
+        if count >= ROWS_PER_JOB:
+            yield _job(chunk, geopoints)
+            (chunk, count) = ([], 0)
+    if chunk:
+        yield _job(chunk, geopoints)
+
+
+def _interpolate_job(job):
+    (ids, trips, lats, lons, shape_distances, arrivals, departures) = job
+    distances = trip_distances(trips, lats, lons, shape_distances)
+    incomplete = numpy.isnan(arrivals) | numpy.isnan(departures)
+    (arrivals, departures) = interpolate(trips, distances, arrivals,
+                                         departures)
+    filled = numpy.flatnonzero(incomplete & ~numpy.isnan(arrivals))
+    return ([ids[index] for index in filled], arrivals[filled],
+            departures[filled])
+
+
+def interpolate_jobs(jobs, processes=None):
+    """Yields `(ids, arrivals, departures)` of the stop times given times by
+    each job, in job order.
+
+    Jobs are read as the workers need them, a job per worker waiting at
+    most.
+    """
+    if processes == 1:
+        for job in jobs:
+            yield _interpolate_job(job)
+        return
+
+    pool = Pool(processes)
+    pending = deque()
+    try:
+        for job in jobs:
+            pending.append(pool.apply_async(_interpolate_job, (job,)))
+            if len(pending) > (processes or cpu_count()):
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _trip_rows(feed):
+    """Yields the stop times of every trip of `feed`, in stop sequence
+    order."""
+    cursor = StopTime._get_collection() \
+        .find({'feed': feed},
+              {'trip': True, 'stop': True, 'arrival_time': True,
+               'departure_time': True, 'shape_dist_traveled': True}) \
+        .sort([('trip', 1), ('stop_sequence', 1)]) \
+        .batch_size(BATCH_SIZE)
+    for (_, rows) in groupby(cursor, lambda row: _ref_id(row['trip'])):
+        yield list(rows)
+
+
+def interpolate_stop_times(feed=DEFAULT_FEED):
+    """Stores interpolated times on the untimed stop times of `feed`,
+    returns how many were filled."""
+    processes = getattr(settings, 'INTERPOLATION_PROCESSES', None)
+    geopoints = dict((stop['_id'], stop.get('geopoint') or (None, None))
+                     for stop in Stop._get_collection().find(
+                         {'feed': feed}, {'geopoint': True}))
+
+    collection = StopTime._get_collection()
+    count = 0
+    jobs = trip_jobs(_trip_rows(feed), geopoints)
+    for (ids, arrivals, departures) in interpolate_jobs(jobs, processes):
+        for start in range(0, len(ids), BATCH_SIZE):
+            bulk = collection.initialize_unordered_bulk_op()
+            for index in range(start, min(start + BATCH_SIZE, len(ids))):
+                bulk.find({'_id': ids[index]}).update({'$set': {
+                    'arrival_time': int(arrivals[index]),
+                    'departure_time': int(departures[index]),
+                }})
+            bulk.execute()
+        count += len(ids)
+    return count
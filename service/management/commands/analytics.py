@@ -0,0 +1,79 @@
+import csv
+import json
+import sys
+from datetime import date
+from datetime import datetime
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from service import analytics
+from service.calendars import services_on
+from service.models import DEFAULT_FEED
+
+ANALYTICS_HELP = 'Compute trips per hour, headways, span of service and ' \
+                 'vehicle-hours of every route on a service day'
+FORMATS = ('csv', 'json')
+CSV_FIELDS = ('route_id', 'trips', 'average_headway', 'first_departure',
+              'last_arrival', 'span', 'vehicle_hours')
+ERROR_DATE = 'Invalid date [%s], expected YYYYMMDD'
+
+
+class Command(BaseCommand):
+    help = ANALYTICS_HELP
+    option_list = BaseCommand.option_list + (
+        make_option('--date', dest='date', default=None,
+                    help='Service day as YYYYMMDD, today by default'),
+        make_option('--feed', dest='feed', default=DEFAULT_FEED,
+                    help='Feed namespace to analyse'),
+        make_option('--route', dest='route', default=None,
+                    help='Only report this route_id'),
+        make_option('--format', type='choice', choices=FORMATS,
+                    dest='format', default='csv',
+                    help='Output format: csv (default) or json'),
+        make_option('--output', dest='output', default=None,
+                    help='Output file, standard output by default'),
+    )
+
+    def handle(self, *args, **options):
+        try:
+            day = datetime.strptime(options['date'], '%Y%m%d').date() \
+                if options['date'] else date.today()
+        except ValueError:
+            raise CommandError(ERROR_DATE % options['date'])
+        timetable = analytics.Timetable.build(options['feed'])
+        metrics = [analytics.formatted(metric) for metric in
+                   timetable.running(services_on(day, options['feed']))
+                   .route_metrics()
+                   if options['route'] in (None, metric['route_id'])]
+
+        output = open(options['output'], 'wb') if options['output'] \
+            else sys.stdout
+        try:
+            if options['format'] == 'json':
+                json.dump({'date': day.strftime('%Y%m%d'),
+                           'routes': metrics}, output, indent=2)
+            else:
+                self._write_csv(output, metrics)
+        finally:
+            if options['output']:
+                output.close()
+
+    def _write_csv(self, output, metrics):
+        hours = max([len(metric['trips_per_hour']) for metric in metrics]
+                    or [0])
+        writer = csv.writer(output)
+        writer.writerow(list(CSV_FIELDS) +
+                        ['trips_%02d' % hour for hour in range(hours)])
+        for metric in metrics:
+            hourly = metric['trips_per_hour']
+            writer.writerow(
+                [_csv_value(metric[field]) for field in CSV_FIELDS] +
+                hourly + [0] * (hours - len(hourly)))
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
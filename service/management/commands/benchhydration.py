@@ -0,0 +1,62 @@
+import timeit
+from datetime import datetime
+from optparse import make_option
+from bson import ObjectId
+from django.core.management.base import BaseCommand
+from service import records
+from service.models import Stop
+from service.models import StopTime
+from service.models import Trip
+
+BENCH_HYDRATION_HELP = 'Compare mongoengine hydration with read-only ' \
+                       'records over synthetic raw documents'
+RESULT = '%-10s documents: %8.3fs  records: %8.3fs  (%5.1fx) per [%s]\n'
+
+
+def _raw_stops(count):
+    return [{'_id': ObjectId(), 'stop_id': str(index), 'code': None,
+             'name': 'CRISTIANO KRAEMER %s' % index, 'desc': None,
+             'location_type': 0, 'geopoint': [-30.117728, -51.206618]}
+            for index in range(count)]
+
+
+def _raw_trips(count):
+    return [{'_id': ObjectId(), 'trip_id': 'T1-2@1#%s' % index,
+             'route': ObjectId(), 'service': ObjectId(),
+             'direction': ObjectId(), 'shapes': [ObjectId(), ObjectId()],
+             'headsign': 'CENTRO'}
+            for index in range(count)]
+
+
+def _raw_stop_times(count):
+    return [{'_id': ObjectId(), 'trip': ObjectId(), 'stop': ObjectId(),
+             'stop_sequence': index % 40,
+             'arrival_time': datetime(2014, 1, 17, 6, 0),
+             'departure_time': datetime(2014, 1, 17, 6, 1)}
+            for index in range(count)]
+
+
+class Command(BaseCommand):
+    help = BENCH_HYDRATION_HELP
+    option_list = BaseCommand.option_list + (
+        make_option('--count', type='int', dest='count', default=100000,
+                    help='Documents hydrated per measurement'),
+    )
+
+    def handle(self, *args, **options):
+        count = options['count']
+        cases = [
+            ('Stop', Stop, records.StopRecord, _raw_stops(count)),
+            ('Trip', Trip, records.TripRecord, _raw_trips(count)),
+            ('StopTime', StopTime, records.StopTimeRecord,
+             _raw_stop_times(count)),
+        ]
+        for (name, model_class, record_class, rows) in cases:
+            documents = min(timeit.repeat(
+                lambda: [model_class._from_son(row) for row in rows],
+                number=1, repeat=3))
+            slotted = min(timeit.repeat(
+                lambda: [record_class.from_raw(row) for row in rows],
+                number=1, repeat=3))
+            self.stdout.write(RESULT % (name, documents, slotted,
+                                        documents / slotted, count))
@@ -0,0 +1,51 @@
+from datetime import datetime
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from service import tiles
+from service.models import DEFAULT_FEED
+
+BUILD_TILES_HELP = 'Pre-generate GeoJSON tiles of the stops and shapes ' \
+                   'of a feed into an MBTiles file, the one the tile view ' \
+                   'serves for that feed by default'
+STARTING_BUILD = 'Building tiles [%s-%s] of feed [%s] into [%s] at [%s]\n'
+FINISHED = 'Built [%s] tiles at [%s]\n'
+ERROR_ARGS = 'Expected at most one output file, got [%s]'
+ERROR_ZOOM = 'Invalid zoom range [%s-%s]'
+
+
+class Command(BaseCommand):
+    args = '[output]'
+    help = BUILD_TILES_HELP
+    option_list = BaseCommand.option_list + (
+        make_option('--min-zoom', type='int', dest='min_zoom', default=10,
+                    help='Smallest zoom level to build'),
+        make_option('--max-zoom', type='int', dest='max_zoom', default=16,
+                    help='Largest zoom level to build'),
+        make_option('--processes', type='int', dest='processes',
+                    default=None, help='Worker processes, one per CPU '
+                                       'by default'),
+        make_option('--feed', dest='feed', default=DEFAULT_FEED,
+                    help='Feed namespace to build tiles of'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) > 1:
+            raise CommandError(ERROR_ARGS % ' '.join(args))
+        feed = options.get('feed') or DEFAULT_FEED
+        try:
+            output = args[0] if args else tiles.tiles_path(feed)
+        except ValueError as error:
+            raise CommandError(str(error))
+        min_zoom = options['min_zoom']
+        max_zoom = options['max_zoom']
+        if min_zoom < 0 or min_zoom > max_zoom:
+            raise CommandError(ERROR_ZOOM % (min_zoom, max_zoom))
+        self._log(STARTING_BUILD % (min_zoom, max_zoom, feed, output,
+                                    str(datetime.now())))
+        count = tiles.generate(output, min_zoom, max_zoom,
+                               processes=options['processes'], feed=feed)
+        self._log(FINISHED % (count, str(datetime.now())))
+
+    def _log(self, message):
+        self.stdout.write(message)
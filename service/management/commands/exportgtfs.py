@@ -0,0 +1,38 @@
+from datetime import datetime
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from service import export
+from service.models import DEFAULT_FEED
+
+EXPORT_GTFS_HELP = 'Export a feed as a GTFS zip archive'
+STARTING_EXPORT = 'Exporting feed [%s] into [%s] at [%s]\n'
+EXPORTED_FILE = '  %s: %s rows\n'
+FINISHED = 'Exported [%s] at [%s]\n'
+
+
+class Command(BaseCommand):
+    args = 'output.zip'
+    help = EXPORT_GTFS_HELP
+    option_list = BaseCommand.option_list + (
+        make_option('--feed', dest='feed', default=DEFAULT_FEED,
+                    help='Feed namespace to export'),
+        make_option('--processes', type='int', dest='processes',
+                    default=None, help='Worker processes, one per CPU '
+                                       'by default'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Usage: exportgtfs %s' % self.args)
+        output = args[0]
+        feed = options['feed']
+        self._log(STARTING_EXPORT % (feed, output, str(datetime.now())))
+        counts = export.export(output, feed, processes=options['processes'])
+        for gtfs_file in export.GTFS_FILES:
+            self._log(EXPORTED_FILE % (gtfs_file.filename,
+                                       counts[gtfs_file.filename]))
+        self._log(FINISHED % (output, str(datetime.now())))
+
+    def _log(self, message):
+        self.stdout.write(message)
@@ -1,22 +1,134 @@
-import os
+import subprocess
+import sys
 import loadpartialgtfs
+from threading import Thread
 from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from optparse import make_option
+from service import stages
+from service.identity import uses_gtfs_ids
+from service.models import DEFAULT_FEED
+from service.models import FeedVersion
+from service.models import drop_legacy_indexes
 
 
-IMPORT_GTFS_HELP = 'Import all the gtfs data from the specified directories'
+IMPORT_GTFS_HELP = 'Import all the gtfs data from the specified directories. ' \
+                   'Several feeds given as feed=dir are loaded concurrently.'
+FEED_VERSION = 'Feed version [%s] loaded at [%s]\n'
+DROPPED_INDEX = 'Dropped legacy index [%s]\n'
+COMMAND_FAILED = 'Command [%s] failed with exit code [%s]\n'
+ERROR_DUPLICATE_FEED = 'Feed [%s] given more than once'
+ERROR_FAILED = 'Feed version left unchanged, [%s] command(s) failed'
 
 
 class Command(BaseCommand):
-    args = 'dir'
+    args = 'dir | feed=dir [feed=dir ...]'
     help = IMPORT_GTFS_HELP
+    option_list = BaseCommand.option_list + (
+        make_option('--feed', dest='feed', default=DEFAULT_FEED,
+                    help='Feed namespace of a directory given without one'),
+        make_option('--max-rss', type='int', dest='max_rss', default=None,
+                    help='Megabytes of resident memory shared by the parser '
+                         'processes running at once'),
+    )
 
     def handle(self, *args, **options):
+        feeds = []
+        for arg in args:
+            (feed, root_dir) = arg.split('=', 1) if '=' in arg \
+                else (options.get('feed') or DEFAULT_FEED, arg)
+            if feed in [name for (name, _) in feeds]:
+                raise CommandError(ERROR_DUPLICATE_FEED % feed)
+            feeds.append((feed, root_dir))
+
+        # parser processes running at once share the memory budget
+        max_rss = None
+        if options.get('max_rss'):
+            processes = sum(len(self._parser_chains(feed))
+                            for (feed, _) in feeds)
+            max_rss = max(1, options['max_rss'] // processes)
+
+        # databases loaded before feed namespaces still enforce dataset
+        # unique ids, which would reject any feed but the first
+        for name in drop_legacy_indexes():
+            self.stdout.write(DROPPED_INDEX % name)
+
+        # feeds only share the referential collections, read-only while
+        # loading, so each one loads on its own
+        failures = []
+        workers = [Thread(target=self._load_feed,
+                          args=(feed, root_dir, max_rss, failures))
+                   for (feed, root_dir) in feeds]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        # a partial load must not invalidate what the previous one derived
+        for (command, code) in failures:
+            self.stderr.write(COMMAND_FAILED % (' '.join(command), code))
+        if failures:
+            raise CommandError(ERROR_FAILED % len(failures))
+
+        # invalidates everything derived from the previous load
+        feed_version = FeedVersion.bump()
+        self.stdout.write(FEED_VERSION % (feed_version.version,
+                                          feed_version.loaded_at))
+
+    @staticmethod
+    def _parser_chains(feed):
+        """Parsers grouped in chains run one after another, the chains
+        themselves running concurrently."""
+        parser_ids = list(loadpartialgtfs.PARSER_CLASSES)
+        if not uses_gtfs_ids(feed):
+            return [parser_ids]
+        # references are computed from GTFS ids, so files no longer wait for
+        # the ones they refer to, except trips which list their shape points
+        return [[parser_id] for parser_id in parser_ids
+                if parser_id not in ('shapes', 'trips')] + \
+            [['shapes', 'trips']]
+
+    @staticmethod
+    def _run(command, failures):
+        """Runs a manage.py `command`, recording it in `failures` when it
+        exits with an error. Returns whether it succeeded."""
+        command = [sys.executable, 'manage.py'] + command
+        code = subprocess.call(command)
+        if code != 0:
+            failures.append((command, code))
+        return code == 0
+
+    @staticmethod
+    def _run_parsers(feed, root_dir, parser_ids, max_rss, failures):
         # create different process for each parser in
         # order to reduce memory consumption
-        root_dir = args[0]
-        for parser_id in loadpartialgtfs.PARSER_CLASSES:
-            # cmd = 'python manage.py loadpartialgtfs %s %s' % (root_dir, parser_id)
-            cmd = 'python -m memory_profiler manage.py loadpartialgtfs %s %s' \
-                  % (root_dir, parser_id)
+        for parser_id in parser_ids:
+            command = ['loadpartialgtfs', root_dir, parser_id,
+                       '--feed=%s' % feed]
+            if max_rss:
+                command.append('--max-rss=%d' % max_rss)
+            # the next parsers of the chain refer to this one's documents
+            if not Command._run(command, failures):
+                return
+
+    @staticmethod
+    def _load_feed(feed, root_dir, max_rss, failures):
+        """Loads `feed`, appending the commands that failed to `failures`,
+        shared by the feeds loading concurrently."""
+        feed_failures = []
+        workers = [Thread(target=Command._run_parsers,
+                          args=(feed, root_dir, parser_ids, max_rss,
+                                feed_failures))
+                   for parser_ids in Command._parser_chains(feed)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
 
-            os.system(cmd)
+        # stages derive data from every file of the feed
+        if not feed_failures:
+            for stage_id in stages.STAGE_CLASSES:
+                if not Command._run(['runstage', stage_id,
+                                     '--feed=%s' % feed], feed_failures):
+                    break
+        failures.extend(feed_failures)
@@ -1,20 +1,31 @@
 import os
 from csv import DictReader
 from datetime import datetime
+from django.conf import settings
 from django.core.management.base import BaseCommand
 from django.core.management.base import CommandError
+from optparse import make_option
 from service import parsers
+from service.extsort import ExternalSorter
+from service.memory import MEGABYTE
+from service.memory import MemoryBudget
+from service.models import DEFAULT_FEED
+from service.models import FeedVersion
 from collections import OrderedDict
-from memory_profiler import profile
 
 IMPORT_GTFS_HELP = 'Import all the gtfs data from the specified directories'
 FINISHED = 'Loading finished at [%s]\n'
 LOADED_DIRECTORY = 'Loaded directory [%s] at [%s]\n'
-LOADING_DIRECTORY = 'Loading directory [%s]\n'
+LOADING_DIRECTORY = 'Loading directory [%s] into feed [%s]\n'
 STARTING_LOADER = 'Starting loader at [%s]\n'
 LOADING_FILE = 'Loading file [%s]'
 LOADED_FROM = '[%s] loaded from [%s]\n'
+BUILT_STAGE = 'Built [%s] %s\n'
 STILL_IN_PROGRESS = '\tLoading [%s] lines from [%s], still in progress...\n'
+SORTED_IN_RUNS = 'Sorted [%s] in [%s] runs spilled to disk\n'
+MEMORY_BUDGET = 'Peak RSS [%d MB] for a budget of [%d MB], throttled [%s] ' \
+                'times\n'
+THROTTLED = '\tThrottled %s\n'
 WARNING_PROPERLY_NOT_LOADED = 'Warning file [%s] not found or ' \
                               'properly not loaded.\n'
 ERROR_FILE_IS_REQUIRED = 'Could not load [%s] data properly, failed at line ' \
@@ -28,24 +39,57 @@ PARSER_CLASSES = OrderedDict([
     ('shapes', parsers.ShapesParser),
     ('trips', parsers.TripsParser),
     ('stop_times', parsers.StopTimesParser),
+    ('frequencies', parsers.FrequenciesParser),
     ('calendar', parsers.CalendarParser),
     ('calendar_dates', parsers.CalendarDatesParser),
+    ('fare_attributes', parsers.FareAttributesParser),
+    ('fare_rules', parsers.FareRulesParser),
 ])
 
 
 class Command(BaseCommand):
     args = 'dir'
     help = IMPORT_GTFS_HELP
+    option_list = BaseCommand.option_list + (
+        make_option('--stages', action='store_true', dest='stages',
+                    default=False,
+                    help='Rebuild the stages derived from this file'),
+        make_option('--feed', dest='feed', default=DEFAULT_FEED,
+                    help='Feed namespace the documents are loaded into'),
+        make_option('--sort-memory', type='int', dest='sort_memory',
+                    default=settings.LOADER_SORT_MEMORY,
+                    help='Megabytes of lines sorted in memory before '
+                         'spilling to disk'),
+        make_option('--max-rss', type='int', dest='max_rss', default=None,
+                    help='Megabytes of resident memory the loader adapts '
+                         'its caches and sort runs to'),
+    )
 
-    @profile
     def handle(self, *args, **options):
         self._log(STARTING_LOADER % str(datetime.now()))
         root_dir, parser_id = args
 
-        self._log(LOADING_DIRECTORY % root_dir)
+        feed = options.get('feed') or DEFAULT_FEED
+        self._log(LOADING_DIRECTORY % (root_dir, feed))
         parser_class = PARSER_CLASSES[parser_id]
-        parser = parser_class()
+        parser = parser_class(feed=feed)
+        self.sort_memory = options['sort_memory'] * MEGABYTE
+        self.budget = None
+        if options.get('max_rss'):
+            self.budget = MemoryBudget(options['max_rss'] * MEGABYTE)
+            self.budget.register(parser, 'cache_size', minimum=100)
         self._load(root_dir, parser)
+        if self.budget is not None:
+            self._report_budget()
+
+        if options.get('stages'):
+            # stages bring numpy and every builder along, only loaded when
+            # asked for
+            from service import stages
+            for stage_id in stages.DEPENDENT_STAGES.get(parser_id, []):
+                stage = stages.STAGE_CLASSES[stage_id]()
+                self._log(BUILT_STAGE % (stage.run(feed), stage.description))
+            FeedVersion.bump()
 
         self._log(LOADED_DIRECTORY % (root_dir, str(datetime.now())))
         self._log(FINISHED % (str(datetime.now())))
@@ -72,7 +116,16 @@ class Command(BaseCommand):
         count = 0
         self._log(LOADING_FILE % location)
         with open(location, 'rb') as source:
-            reader = DictReader(source)
+            reader = self._metered(DictReader(source))
+            sorter = None
+            if parser.order is not None:
+                sorter = ExternalSorter(parser.order, self.sort_memory)
+                if self.budget is not None:
+                    self.budget.register(sorter, 'memory_budget',
+                                         minimum=MEGABYTE)
+                # the parsing of sorted lines is metered apart, the lines
+                # being counted once already
+                reader = self._metered(sorter.sort(reader), sorted_lines=True)
             for line in reader:
                 # parse line
                 parser.parse(line)
@@ -81,7 +134,28 @@ class Command(BaseCommand):
                 count += 1
                 if count % 10000 == 0:
                     self._log(STILL_IN_PROGRESS % (count, location))
+        if sorter is not None and sorter.runs:
+            self._log(SORTED_IN_RUNS % (location, sorter.runs))
         return count
 
+    def _metered(self, lines, sorted_lines=False):
+        if self.budget is None:
+            return lines
+        return self._ticking(lines, self.budget.tick_sorted if sorted_lines
+                             else self.budget.tick)
+
+    def _ticking(self, lines, tick):
+        for line in lines:
+            tick()
+            yield line
+
+    def _report_budget(self):
+        self.budget.check()
+        self._log(MEMORY_BUDGET % (self.budget.peak_rss / MEGABYTE,
+                                   self.budget.max_rss / MEGABYTE,
+                                   len(self.budget.throttlings)))
+        for throttling in self.budget.throttlings:
+            self._log(THROTTLED % throttling)
+
     def _log(self, message):
         self.stdout.write(message)
\ No newline at end of file
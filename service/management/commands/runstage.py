@@ -0,0 +1,38 @@
+from datetime import datetime
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from optparse import make_option
+from service import stages
+from service.models import DEFAULT_FEED
+
+RUN_STAGE_HELP = 'Run a single load-time stage over the loaded gtfs data'
+STARTING_STAGE = 'Starting stage [%s] of feed [%s] at [%s]\n'
+FINISHED = 'Built [%s] %s at [%s]\n'
+ERROR_UNKNOWN_STAGE = 'Unknown stage [%s], expected one of: %s'
+
+
+class Command(BaseCommand):
+    args = 'stage'
+    help = RUN_STAGE_HELP
+    option_list = BaseCommand.option_list + (
+        make_option('--feed', dest='feed', default=DEFAULT_FEED,
+                    help='Feed namespace the stage is built for'),
+    )
+
+    def handle(self, *args, **options):
+        stage_id = args[0]
+        if stage_id not in stages.STAGE_CLASSES:
+            raise CommandError(ERROR_UNKNOWN_STAGE % (
+                stage_id, ', '.join(stages.STAGE_CLASSES)))
+
+        feed = options.get('feed') or DEFAULT_FEED
+        self._log(STARTING_STAGE % (stage_id, feed, str(datetime.now())))
+        stage = stages.STAGE_CLASSES[stage_id]()
+        try:
+            count = stage.run(feed)
+        except stages.StageException as stage_error:
+            raise CommandError(str(stage_error))
+        self._log(FINISHED % (count, stage.description, str(datetime.now())))
+
+    def _log(self, message):
+        self.stdout.write(message)
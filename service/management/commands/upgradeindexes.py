@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from service.models import drop_legacy_indexes
+
+UPGRADE_INDEXES_HELP = 'Drop the unique indexes of the documents predating ' \
+                       'feed namespaces and create the per feed ones'
+DROPPED = 'Dropped index [%s]\n'
+UP_TO_DATE = 'No legacy index left\n'
+
+
+class Command(BaseCommand):
+    help = UPGRADE_INDEXES_HELP
+
+    def handle(self, *args, **options):
+        dropped = drop_legacy_indexes()
+        for name in dropped:
+            self.stdout.write(DROPPED % name)
+        if not dropped:
+            self.stdout.write(UP_TO_DATE)
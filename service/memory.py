@@ -0,0 +1,130 @@
+""" Memory budget of a loading process.
+
+:py:class:`MemoryBudget` samples the resident set size of the process every
+few lines with psutil. Above most of the budget, it halves the capacities
+registered with it (parser caches, in-memory sort runs) and collects
+garbage; once memory is back well under the budget, capacities grow again
+up to their initial value. Every reduction is kept as a throttling event
+for the load report.
+
+Files parsed in sorted order go through the budget twice, once read from
+disk and once read back from the sorter. Both passes sample memory, but
+they are counted apart so line numbers stay those of the file.
+
+"""
+import gc
+
+# lines loaded between two samples of the resident set size
+CHECK_INTERVAL = 1000
+
+# fractions of the budget above which capacities shrink, and below which
+# they grow back
+HIGH_WATERMARK = 0.9
+LOW_WATERMARK = 0.6
+
+MEGABYTE = 1024 * 1024
+
+
+class Capacity(object):
+    """An attribute of `target` the budget resizes between `minimum` and
+    its initial value."""
+
+    def __init__(self, target, attribute, minimum):
+        self.target = target
+        self.attribute = attribute
+        self.minimum = minimum
+        self.initial = self.value
+
+    @property
+    def name(self):
+        return '%s.%s' % (type(self.target).__name__, self.attribute)
+
+    @property
+    def value(self):
+        return getattr(self.target, self.attribute)
+
+    @value.setter
+    def value(self, value):
+        setattr(self.target, self.attribute, value)
+
+
+class Throttling(object):
+    def __init__(self, line, rss, name, before, after, sorted_line=0):
+        self.line = line
+        self.rss = rss
+        self.name = name
+        self.before = before
+        self.after = after
+        self.sorted_line = sorted_line
+
+    def __str__(self):
+        position = 'line [%s]' % self.line
+        if self.sorted_line:
+            position += ', sorted line [%s]' % self.sorted_line
+        return '[%s] reduced from [%s] to [%s] at %s, RSS [%d MB]' \
+            % (self.name, self.before, self.after, position,
+               self.rss / MEGABYTE)
+
+
+class MemoryBudget(object):
+    def __init__(self, max_rss, check_interval=CHECK_INTERVAL):
+        self.max_rss = max_rss
+        self.check_interval = check_interval
+        self.capacities = []
+        self.throttlings = []
+        self.peak_rss = 0
+        # lines read from the file, and read back from a sorter
+        self.lines = 0
+        self.sorted_lines = 0
+        self._ticks = 0
+        self._throttled_rss = 0
+        # imported here, loaders without a budget start faster
+        import psutil
+        self._process = psutil.Process()
+
+    def register(self, target, attribute, minimum=1):
+        self.capacities.append(Capacity(target, attribute, minimum))
+
+    def tick(self):
+        """Counts a loaded line, adapting capacities every few lines."""
+        self.lines += 1
+        self._sample()
+
+    def tick_sorted(self):
+        """Counts a line read back from a sorter."""
+        self.sorted_lines += 1
+        self._sample()
+
+    def _sample(self):
+        self._ticks += 1
+        if self._ticks % self.check_interval == 0:
+            self.check()
+
+    def check(self):
+        rss = self._process.memory_info().rss
+        self.peak_rss = max(self.peak_rss, rss)
+        if rss > self.max_rss * HIGH_WATERMARK:
+            # freed memory mostly stays with the process, so capacities only
+            # shrink again if memory kept growing since the last time
+            if rss > self._throttled_rss:
+                self._shrink(rss)
+                self._throttled_rss = rss
+        elif rss < self.max_rss * LOW_WATERMARK:
+            self._grow()
+            self._throttled_rss = 0
+
+    def _shrink(self, rss):
+        for capacity in self.capacities:
+            before = capacity.value
+            after = max(capacity.minimum, before // 2)
+            if after < before:
+                capacity.value = after
+                self.throttlings.append(Throttling(
+                    self.lines, rss, capacity.name, before, after,
+                    self.sorted_lines))
+        gc.collect()
+
+    def _grow(self):
+        for capacity in self.capacities:
+            if capacity.value < capacity.initial:
+                capacity.value = min(capacity.initial, capacity.value * 2)
@@ -6,6 +6,7 @@ when possible relations are taken into account, e.g. a :py:class:`Route` class
 has a `trips` attribute, with a list of trips for the specific route.
 
 """
+from datetime import datetime
 import mongoengine as models
 
 
@@ -16,6 +17,19 @@ class GtfsModel(object):
         setattr(self, param, value)
 
 
+# feed namespace of the documents loaded without a --feed option
+DEFAULT_FEED = 'default'
+
+
+class FeedDocument(models.Document):
+    # feed:
+    # Namespace of the feed the document was loaded from. GTFS ids are only
+    # unique within a feed, so several feeds can share one database.
+    feed = models.StringField(max_length=64, default=DEFAULT_FEED)
+
+    meta = {'abstract': True}
+
+
 class WheelchairAccessible(models.Document, GtfsModel):
     """Referential data"""
 
@@ -31,7 +45,7 @@ class WheelchairAccessible(models.Document, GtfsModel):
     name = models.StringField(max_length=255)
 
 
-class Agency(models.Document, GtfsModel):
+class Agency(FeedDocument, GtfsModel):
     # agency_id Optional:
     # The agency_id field is an ID that uniquely identifies a transit agency. A
     # transit feed may represent data from more than one agency. The agency_id
@@ -104,20 +118,22 @@ class Agency(models.Document, GtfsModel):
                other.fare_url == self.fare_url
 
 
-class Zone(models.Document, GtfsModel):
+class Zone(FeedDocument, GtfsModel):
     # zone_id Optional:
     # The zone_id field defines the fare zone for a stop ID. Zone IDs are
     # required if you want to provide fare information using fare_rules.txt.
     # If this stop ID represents a station, the zone ID is ignored.
-    zone_id = models.StringField(max_length=255, unique=True)
+    zone_id = models.StringField(max_length=255)
+
+    meta = {'indexes': [{'fields': ('feed', 'zone_id'), 'unique': True}]}
 
 
-class Stop(models.Document, GtfsModel):
+class Stop(FeedDocument, GtfsModel):
     # stop_id Required:
     # The stop_id field contains an ID that uniquely identifies a stop or
     # station. Multiple routes may use the same stop. The stop_id is dataset
     # unique.
-    stop_id = models.StringField(max_length=255, unique=True)
+    stop_id = models.StringField(max_length=255)
 
     # stop_code Optional:
     # The stop_code field contains short text or a number that uniquely
@@ -217,6 +233,8 @@ class Stop(models.Document, GtfsModel):
 
     geopoint = models.GeoPointField()
 
+    meta = {'indexes': [{'fields': ('feed', 'stop_id'), 'unique': True}]}
+
     def __eq__(self, other):
         return other.stop_id == self.stop_id and \
                other.code == self.code and \
@@ -251,11 +269,11 @@ class RouteType(models.Document, GtfsModel):
     value = models.IntField(unique=True)
 
 
-class Route(models.Document, GtfsModel):
+class Route(FeedDocument, GtfsModel):
     # route_id Required:
     # The route_id field contains an ID that uniquely identifies a route. The
     # route_id is dataset unique.
-    route_id = models.StringField(max_length=255, unique=True)
+    route_id = models.StringField(max_length=255)
 
     # agency_id Optional:
     # The agency_id field defines an agency for the specified route. This value
@@ -346,6 +364,8 @@ class Route(models.Document, GtfsModel):
     # screen.
     text_color = models.StringField(max_length=6, default="000000")
 
+    meta = {'indexes': [{'fields': ('feed', 'route_id'), 'unique': True}]}
+
     def __eq__(self, other):
         return other.route_id == self.route_id and \
                other.agency == self.agency and \
@@ -358,12 +378,14 @@ class Route(models.Document, GtfsModel):
                other.text_color == self.text_color
 
 
-class Service(models.Document, GtfsModel):
+class Service(FeedDocument, GtfsModel):
     # service_id Required:
     # The service_id contains an ID that uniquely identifies a set of dates
     # when service is available for one or more routes. This value is
     # referenced from the calendar.txt or calendar_dates.txt file.
-    service_id = models.StringField(max_length=255, unique=True)
+    service_id = models.StringField(max_length=255)
+
+    meta = {'indexes': [{'fields': ('feed', 'service_id'), 'unique': True}]}
 
 
 class Direction(models.Document, GtfsModel):
@@ -393,17 +415,19 @@ class Direction(models.Document, GtfsModel):
     value = models.IntField(unique=True)
 
 
-class Block(models.Document, GtfsModel):
+class Block(FeedDocument, GtfsModel):
     # block_id Optional:
     # The block_id field identifies the block to which the trip belongs. A block
     # consists of two or more sequential trips made using the same vehicle,
     # where a passenger can transfer from one trip to the next just by
     # staying in the vehicle. The block_id must be referenced by two or more
     # trips in trips.txt.
-    block_id = models.StringField(max_length=255, unique=True)
+    block_id = models.StringField(max_length=255)
 
+    meta = {'indexes': [{'fields': ('feed', 'block_id'), 'unique': True}]}
 
-class Shape(models.Document, GtfsModel):
+
+class Shape(FeedDocument, GtfsModel):
     # shape_id Required:
     # The shape_id field contains an ID that uniquely identifies a shape.
     shape_id = models.StringField(max_length=255)
@@ -460,9 +484,11 @@ class Shape(models.Document, GtfsModel):
     # A_shp,37.65863,-122.30839,11
     geopoint = models.GeoPointField()
 
+    meta = {'indexes': [('feed', 'shape_id', 'pt_sequence')]}
+
     @staticmethod
-    def all_by_id(shape_id):
-        return Shape.objects.filter(shape_id=shape_id)
+    def all_by_id(shape_id, feed=DEFAULT_FEED):
+        return Shape.objects.filter(feed=feed, shape_id=shape_id)
 
     def __eq__(self, other):
         return other.shape_id == self.shape_id and \
@@ -471,11 +497,52 @@ class Shape(models.Document, GtfsModel):
                other.dist_traveled == self.dist_traveled
 
 
-class Trip(models.Document, GtfsModel):
+class ShapeLevel(models.EmbeddedDocument):
+    """Derived data"""
+
+    # zoom:
+    # Smallest map zoom level this level of detail is meant for.
+    zoom = models.IntField()
+
+    # tolerance:
+    # Douglas-Peucker tolerance, in degrees, used to simplify the shape.
+    tolerance = models.FloatField()
+
+    # polyline:
+    # Simplified shape points in the encoded polyline format.
+    polyline = models.StringField()
+
+    # points:
+    # Number of points left after simplification.
+    points = models.IntField()
+
+
+class ShapeGeometry(FeedDocument, GtfsModel):
+    """Derived data"""
+
+    # shape_id:
+    # The shape_id of the Shape points this geometry was built from.
+    shape_id = models.StringField(max_length=255)
+
+    # levels:
+    # Simplified geometries, sorted by increasing zoom.
+    levels = models.ListField(models.EmbeddedDocumentField(ShapeLevel))
+
+    meta = {'indexes': [{'fields': ('feed', 'shape_id'), 'unique': True}]}
+
+    def level_for(self, zoom):
+        chosen = self.levels[0]
+        for level in self.levels:
+            if level.zoom <= zoom:
+                chosen = level
+        return chosen
+
+
+class Trip(FeedDocument, GtfsModel):
     # trip_id Required:
     # The trip_id field contains an ID that identifies a trip. The trip_id is
     # dataset unique.
-    trip_id = models.StringField(max_length=255, unique=True)
+    trip_id = models.StringField(max_length=255)
 
     # route_id Required:
     # The route_id field contains an ID that uniquely identifies a route. This
@@ -555,6 +622,14 @@ class Trip(models.Document, GtfsModel):
     # limited/express  designations.
     short_name = models.StringField(max_length=255)
 
+    # trip_time Optional, not part of GTFS:
+    # The trip_time field contains the planned duration of the trip in
+    # minutes, as published by some agencies (br-poa) that do not ship
+    # stop_times.txt.
+    trip_time = models.IntField()
+
+    meta = {'indexes': [{'fields': ('feed', 'trip_id'), 'unique': True}]}
+
     def has_shape(self, other_shape):
         return self.shapes.all() \
             .filter(shape_id=other_shape.shape_id,
@@ -586,7 +661,7 @@ class DropOffType(models.Document, GtfsModel):
     value = models.IntField()
 
 
-class StopTime(models.Document, GtfsModel):
+class StopTime(FeedDocument, GtfsModel):
     # trip_id Required:
     # The trip_id field contains an ID that identifies a trip. This value is
     # referenced from the trips.txt file.
@@ -623,7 +698,10 @@ class StopTime(models.Document, GtfsModel):
     # 2:15:00 a.m. on the following day, the stop times would be 22:30:00 and
     #  26:15:00. Entering those stop times as 22:30:00 and 02:15:00
     # would not produce the desired results.
-    arrival_time = models.DateTimeField()
+    #
+    # Stored as seconds since the start of the service day, see
+    # service/times.py, and left empty on stops that are not time points.
+    arrival_time = models.IntField()
 
     # departure_time Required:
     # The departure_time specifies the departure time from a specific stop
@@ -656,7 +734,7 @@ class StopTime(models.Document, GtfsModel):
     # at 2:15:00 a.m. on the following day, the stop times would be 22:30:00
     # and 26:15:00. Entering those stop times as 22:30:00 and 02:15:00
     # would not produce the desired results.
-    departure_time = models.DateTimeField()
+    departure_time = models.IntField()
 
     # stop_id Required:
     # The stop_id field contains an ID that uniquely identifies a stop. Multiple
@@ -733,6 +811,8 @@ class StopTime(models.Document, GtfsModel):
     # that are used for this field in the shapes.txt file.
     shape_dist_traveled = models.FloatField()
 
+    meta = {'indexes': [('trip', 'stop_sequence')]}
+
     def __eq__(self, other):
         return other.trip == self.trip and \
                other.arrival_time == self.arrival_time and \
@@ -745,7 +825,142 @@ class StopTime(models.Document, GtfsModel):
                other.shape_dist_traveled == self.shape_dist_traveled
 
 
-class Calendar(models.Document, GtfsModel):
+class TripPattern(FeedDocument, GtfsModel):
+    """Derived data"""
+
+    # generation:
+    # The pattern build the entry belongs to, see PatternGeneration.
+    generation = models.ObjectIdField()
+
+    # pattern_id:
+    # Stable id derived from the route, the direction and the ordered stop
+    # ids shared by every trip of the pattern.
+    pattern_id = models.StringField(max_length=255)
+
+    route = models.ReferenceField(Route)
+
+    direction = models.ReferenceField(Direction)
+
+    # stops:
+    # The ordered stops visited by every trip of the pattern, stored once.
+    stops = models.ListField(models.ReferenceField(Stop))
+
+    # duration:
+    # Longest time, in seconds, any trip of the pattern takes from its first
+    # departure to its last arrival.
+    duration = models.IntField()
+
+    meta = {'indexes': [{'fields': ('feed', 'generation', 'pattern_id'),
+                         'unique': True},
+                        'route']}
+
+
+class PatternTrip(FeedDocument, GtfsModel):
+    """Derived data"""
+
+    # generation:
+    # The pattern build the entry belongs to, see PatternGeneration.
+    generation = models.ObjectIdField()
+
+    trip = models.ReferenceField(Trip)
+
+    pattern = models.ReferenceField(TripPattern)
+
+    service = models.ReferenceField(Service)
+
+    # start:
+    # Departure from the first stop, in seconds since the start of the
+    # service day.
+    start = models.IntField()
+
+    # times:
+    # Arrival and departure at each stop of the pattern, interleaved
+    # (a0, d0, a1, d1, ...) and delta encoded: each value is the number of
+    # seconds since the previous one, the first one since start.
+    times = models.ListField(models.IntField())
+
+    # headway:
+    # Set on frequency-based trips, whose runs go on long after start.
+    headway = models.BooleanField()
+
+    meta = {'indexes': [{'fields': ('feed', 'generation', 'trip'),
+                         'unique': True},
+                        ('pattern', 'start')]}
+
+
+class PatternGeneration(FeedDocument, GtfsModel):
+    """Bookkeeping data"""
+
+    # generation:
+    # The generation of the TripPattern and PatternTrip entries of the feed
+    # served to readers. Entries of other generations are still being built
+    # or about to be removed.
+    generation = models.ObjectIdField()
+
+    meta = {'indexes': [{'fields': ('feed',), 'unique': True}]}
+
+    @staticmethod
+    def current(feed=DEFAULT_FEED):
+        """The pattern generation of `feed` served to readers, None for
+        entries built before generations."""
+        row = PatternGeneration._get_collection().find_one(
+            {'feed': feed}, {'generation': True})
+        return row['generation'] if row else None
+
+
+class AdjacencyGeneration(FeedDocument, GtfsModel):
+    """Bookkeeping data"""
+
+    # generation:
+    # The generation of the RouteStops and StopRoutes entries of the feed
+    # served to readers. Entries of other generations are still being built
+    # or about to be removed.
+    generation = models.ObjectIdField()
+
+    meta = {'indexes': [{'fields': ('feed',), 'unique': True}]}
+
+
+class RouteStops(FeedDocument, GtfsModel):
+    """Derived data"""
+
+    # generation:
+    # The adjacency build the entry belongs to, see AdjacencyGeneration.
+    generation = models.ObjectIdField()
+
+    route_id = models.StringField(max_length=255)
+
+    # direction:
+    # The direction_id of the trips, None when the feed does not set it.
+    direction = models.IntField()
+
+    # stops:
+    # The stop_ids served by the route in this direction, in travel order.
+    stops = models.ListField(models.StringField(max_length=255))
+
+    meta = {'indexes': [{'fields': ('feed', 'generation', 'route_id',
+                                    'direction'),
+                         'unique': True}]}
+
+
+class StopRoutes(FeedDocument, GtfsModel):
+    """Derived data"""
+
+    # generation:
+    # The adjacency build the entry belongs to, see AdjacencyGeneration.
+    generation = models.ObjectIdField()
+
+    stop_id = models.StringField(max_length=255)
+
+    # routes:
+    # The route_ids serving the stop, keyed by direction_id ('' when the
+    # feed does not set it).
+    routes = models.DictField()
+
+    meta = {'indexes': [{'fields': ('feed', 'generation', 'stop_id'),
+                         'unique': True}]}
+
+
+class Calendar(FeedDocument, GtfsModel):
     # service_id Required:
     # The service_id contains an ID that uniquely identifies a set of dates
     # when service is available for one or more routes. Each service_id value
@@ -804,7 +1019,7 @@ class ExceptionType(models.Document, GtfsModel):
     value = models.IntField()
 
 
-class CalendarDate(models.Document, GtfsModel):
+class CalendarDate(FeedDocument, GtfsModel):
     # service_id Required:
     # The service_id contains an ID that uniquely identifies a set of dates
     # when a service exception is available for one or more routes. Each
@@ -847,8 +1062,10 @@ class CalendarDate(models.Document, GtfsModel):
                other.exception_type == self.exception_type
 
 
-class Fare(models.Document, GtfsModel):
-    fare_id = models.StringField(max_length=255, unique=True)
+class Fare(FeedDocument, GtfsModel):
+    fare_id = models.StringField(max_length=255)
+
+    meta = {'indexes': [{'fields': ('feed', 'fare_id'), 'unique': True}]}
 
 
 class PaymentMethod(models.Document, GtfsModel):
@@ -856,7 +1073,7 @@ class PaymentMethod(models.Document, GtfsModel):
     vale = models.IntField()
 
 
-class FareAttribute(models.Document, GtfsModel):
+class FareAttribute(FeedDocument, GtfsModel):
     # fare_id Required:
     # The fare_id field contains an ID that uniquely identifies a fare class.
     # The fare_id is dataset unique.
@@ -901,7 +1118,7 @@ class FareAttribute(models.Document, GtfsModel):
     transfer_duration = models.IntField()
 
 
-class FareRule(models.Document, GtfsModel):
+class FareRule(FeedDocument, GtfsModel):
     # fare_id Required:
     # The fare_id field contains an ID that uniquely identifies a fare class.
     # This value is referenced from the fare_attributes.txt file.
@@ -962,7 +1179,7 @@ class FareRule(models.Document, GtfsModel):
     contains = models.ReferenceField(Zone)
 
 
-class Frequency(models.Document, GtfsModel):
+class Frequency(FeedDocument, GtfsModel):
     # trip_id Required:
     # The trip_id contains an ID that identifies a trip on which the specified
     # frequency of service applies. Trip IDs are referenced from the trips.txt
@@ -977,7 +1194,10 @@ class Frequency(models.Document, GtfsModel):
     # occurring after midnight, enter the time as a value greater than
     # 24:00:00 in HH:MM:SS local time for the day on which the trip schedule
     # begins. E.g. 25:35:00.
-    start_time = models.DateTimeField()
+    #
+    # Stored as seconds since the start of the service day so that times
+    # past midnight are kept, see service/times.py.
+    start_time = models.IntField()
 
     # end_time Required:
     # The end_time field indicates the time at which service changes to a
@@ -987,7 +1207,9 @@ class Frequency(models.Document, GtfsModel):
     # the service date. For times occurring after midnight, enter the time as
     # a value greater than 24:00:00 in HH:MM:SS local time for the day on which
     # the trip schedule begins. E.g. 25:35:00.
-    end_time = models.DateTimeField()
+    #
+    # Stored as seconds since the start of the service day, like start_time.
+    end_time = models.IntField()
 
     # headway_secs Required:
     # The headway_secs field indicates the time between departures from the
@@ -1024,8 +1246,17 @@ class Frequency(models.Document, GtfsModel):
     # desired trip start time + headway_secs.
     exact_times = models.IntField()
 
+    meta = {'indexes': ['trip']}
+
+    def __eq__(self, other):
+        return other.trip == self.trip and \
+               other.start_time == self.start_time and \
+               other.end_time == self.end_time and \
+               other.headway_secs == self.headway_secs and \
+               other.exact_times == self.exact_times
+
 
-class Transfer(models.Document, GtfsModel):
+class Transfer(FeedDocument, GtfsModel):
     # from_stop_id Required:
     # The from_stop_id field contains a stop ID that identifies a stop or
     # station where a connection between routes begins. Stop IDs are referenced
@@ -1069,3 +1300,72 @@ class Transfer(models.Document, GtfsModel):
     # route. The min_transfer_time value must be entered in seconds,
     # and must be a non-negative integer.
     min_transfer_time = models.IntField()
+
+    # walking_distance:
+    # Derived data, only set on the transfers built by the walking transfers
+    # stage: the estimated walking distance in meters between both stops.
+    walking_distance = models.FloatField()
+
+    meta = {'indexes': ['from_stop', 'to_stop', 'feed']}
+
+
+class FeedVersion(models.Document, GtfsModel):
+    """Bookkeeping data"""
+
+    # version:
+    # Monotonic counter bumped every time a feed load completes. Anything
+    # derived from the schedule (e.g. cached API responses) is valid for a
+    # single version only.
+    version = models.IntField(unique=True)
+
+    # loaded_at:
+    # When the load that produced this version finished.
+    loaded_at = models.DateTimeField()
+
+    meta = {'ordering': ['-version']}
+
+    @staticmethod
+    def current():
+        latest = FeedVersion.objects.only('version').first()
+        return latest.version if latest else 0
+
+    @staticmethod
+    def bump():
+        # feeds loading concurrently may race for the same version
+        while True:
+            feed_version = FeedVersion(version=FeedVersion.current() + 1,
+                                       loaded_at=datetime.now())
+            try:
+                feed_version.save()
+                return feed_version
+            except models.NotUniqueError:
+                continue
+
+
+# Unique indexes of earlier releases, created on single fields before
+# documents were namespaced by feed. Left in place they reject the documents
+# of any feed but the first, so they are dropped before loading (see
+# drop_legacy_indexes).
+LEGACY_INDEXES = (
+    (Zone, 'zone_id_1'),
+    (Stop, 'stop_id_1'),
+    (Route, 'route_id_1'),
+    (Service, 'service_id_1'),
+    (Block, 'block_id_1'),
+    (Trip, 'trip_id_1'),
+    (Fare, 'fare_id_1'),
+)
+
+
+def drop_legacy_indexes():
+    """Drops the :py:data:`LEGACY_INDEXES` still present and creates the
+    per feed indexes replacing them. Returns the `collection.index` names
+    dropped."""
+    dropped = []
+    for (document, name) in LEGACY_INDEXES:
+        collection = document._get_collection()
+        if name in collection.index_information():
+            collection.drop_index(name)
+            dropped.append('%s.%s' % (collection.name, name))
+        document.ensure_indexes()
+    return dropped
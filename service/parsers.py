@@ -1,6 +1,36 @@
-from datetime import time
+from collections import OrderedDict
 from datetime import date
-from service.models import *
+from mongoengine import signals
+from service.identity import natural_id
+from service.identity import reference
+from service.identity import uses_gtfs_ids
+from service.models import Agency
+from service.models import Block
+from service.models import Calendar
+from service.models import CalendarDate
+from service.models import DEFAULT_FEED
+from service.models import Direction
+from service.models import DropOffType
+from service.models import ExceptionType
+from service.models import Fare
+from service.models import FareAttribute
+from service.models import FareRule
+from service.models import Frequency
+from service.models import PaymentMethod
+from service.models import PickupType
+from service.models import Route
+from service.models import RouteType
+from service.models import Service
+from service.models import Shape
+from service.models import Stop
+from service.models import StopTime
+from service.models import Trip
+from service.models import WheelchairAccessible
+from service.models import Zone
+from service.times import parse_time
+
+# documents remembered by each parser, see BaseParser._lookup
+CACHE_SIZE = 10000
 
 
 class ParserException(Exception):
@@ -14,14 +44,83 @@ class ParserException(Exception):
 
 
 class BaseParser(object):
-    def __init__(self, filename, optional=False):
+    # key the lines are sorted by before being parsed, None to keep the file
+    # order, see service.extsort
+    order = None
+
+    def __init__(self, filename, optional=False, feed=DEFAULT_FEED):
         self.filename = filename
         self.optional = optional
+        self.feed = feed
+        self.gtfs_ids = uses_gtfs_ids(feed)
+        self.cache_size = CACHE_SIZE
+        self._cache = OrderedDict()
 
     def parse(self, line):
         raise ParserException('Parser methods not implemented.')
 
+    def _remember(self, key, document):
+        self._cache[key] = document
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return document
+
+    def _lookup(self, model_class, **params):
+        """Gets a document, remembering the most recent ones.
+
+        Referential and parent documents are otherwise queried once per line,
+        and the shared referential collections become a contention point
+        when several feeds load at once.
+        """
+        key = (model_class, tuple(sorted(params.items())))
+        if key in self._cache:
+            return self._cache[key]
+        return self._remember(key, model_class.objects.get(**params))
+
+    def _lookup_or_create(self, model_class, **params):
+        key = (model_class, tuple(sorted(params.items())))
+        if key in self._cache:
+            return self._cache[key]
+        (document, created) = model_class.objects.get_or_create(**params)
+        return self._remember(key, document)
+
+    def _reference(self, model_class, **params):
+        """Gets the document of this feed with the given GTFS id, or only a
+        reference to it when the feed ids derive from GTFS ids."""
+        if self.gtfs_ids:
+            return reference(self.feed, model_class, *params.values())
+        return self._lookup(model_class, feed=self.feed, **params)
+
+    def _reference_or_create(self, model_class, **params):
+        if self.gtfs_ids:
+            key = (model_class, tuple(sorted(params.items())))
+            if key in self._cache:
+                return self._cache[key]
+            self._upsert(model_class, params)
+            return self._remember(key, reference(self.feed, model_class,
+                                                 *params.values()))
+        return self._lookup_or_create(model_class, feed=self.feed, **params)
+
+    def _upsert(self, model_class, values):
+        """Replaces the document with the id derived from `values`, which
+        makes loading a file again idempotent."""
+        entity = model_class(feed=self.feed, **values)
+        entity.id = natural_id(self.feed, model_class, values)
+        entity.validate()
+        result = model_class._get_collection().update(
+            {'_id': entity.id}, entity.to_mongo(), upsert=True)
+        created = not (result or {}).get('updatedExisting')
+        entity._created = False
+        signals.post_save.send(model_class, document=entity, created=created)
+        return entity, created
+
     def _create(self, model_class, mandatory, optional=None):
+        if self.gtfs_ids:
+            values = dict(mandatory)
+            values.update((key, value) for (key, value)
+                          in (optional or {}).iteritems() if value)
+            return self._upsert(model_class, values)
+        mandatory = dict(mandatory, feed=self.feed)
         (entity, created) = model_class.objects.get_or_create(**mandatory)
         if optional:
             self._update(entity, optional)
@@ -45,8 +144,8 @@ class BaseParser(object):
 
 
 class AgencyParser(BaseParser):
-    def __init__(self):
-        BaseParser.__init__(self, 'agency.txt')
+    def __init__(self, feed=DEFAULT_FEED):
+        BaseParser.__init__(self, 'agency.txt', feed=feed)
 
     def parse(self, line):
         mandatory = {
@@ -64,8 +163,8 @@ class AgencyParser(BaseParser):
 
 
 class CalendarParser(BaseParser):
-    def __init__(self):
-        BaseParser.__init__(self, 'calendar.txt')
+    def __init__(self, feed=DEFAULT_FEED):
+        BaseParser.__init__(self, 'calendar.txt', feed=feed)
 
     def _parse_start(self, line):
         temp = self.field(line, 'start_date')
@@ -80,7 +179,7 @@ class CalendarParser(BaseParser):
     def _parse_service(self, line):
         try:
             service_id = self.field(line, 'service_id')
-            service = Service.objects.get(service_id=service_id)
+            service = self._reference(Service, service_id=service_id)
         except Service.DoesNotExist as e:
             raise ParserException.for_args(e.args)
         return service
@@ -102,13 +201,14 @@ class CalendarParser(BaseParser):
 
 
 class CalendarDatesParser(BaseParser):
-    def __init__(self):
-        BaseParser.__init__(self, 'calendar_dates.txt', optional=True)
+    def __init__(self, feed=DEFAULT_FEED):
+        BaseParser.__init__(self, 'calendar_dates.txt', optional=True,
+                            feed=feed)
 
     def _parse_exception(self, line):
         try:
             type_id = self.field(line, 'exception_type')
-            exception_type = ExceptionType.objects.get(value=type_id)
+            exception_type = self._lookup(ExceptionType, value=type_id)
         except ExceptionType.DoesNotExist as e:
             raise ParserException.for_args(e.args)
         return exception_type
@@ -116,7 +216,7 @@ class CalendarDatesParser(BaseParser):
     def _parse_service(self, line):
         try:
             service_id = self.field(line, 'service_id')
-            service = Service.objects.get(service_id=service_id)
+            service = self._reference(Service, service_id=service_id)
         except Service.DoesNotExist as e:
             raise ParserException.for_args(e.args)
         return service
@@ -135,15 +235,142 @@ class CalendarDatesParser(BaseParser):
         return self._create(CalendarDate, mandatory)
 
 
+class FareAttributesParser(BaseParser):
+    def __init__(self, feed=DEFAULT_FEED):
+        BaseParser.__init__(self, 'fare_attributes.txt', optional=True,
+                            feed=feed)
+
+    def _parse_fare(self, line):
+        fare_id = self.field(line, 'fare_id')
+        return self._reference_or_create(Fare, fare_id=fare_id)
+
+    def _parse_price(self, line):
+        try:
+            return float(self.field(line, 'price'))
+        except ValueError as e:
+            raise ParserException.for_args(e.args)
+
+    def _parse_payment_method(self, line):
+        try:
+            value = self.field(line, 'payment_method')
+            payment_method = self._lookup(PaymentMethod, vale=value)
+        except PaymentMethod.DoesNotExist as e:
+            raise ParserException.for_args(e.args)
+        return payment_method
+
+    def _parse_integer(self, line, field):
+        # an empty transfers field means unlimited transfers
+        value = self.field(line, field, optional=True)
+        if value is None:
+            return None
+        try:
+            return int(value)
+        except ValueError as e:
+            raise ParserException.for_args(e.args)
+
+    def parse(self, line):
+        mandatory = {
+            'fare': self._parse_fare(line),
+            'price': self._parse_price(line),
+            'currency': self.field(line, 'currency_type'),
+            'payment_method': self._parse_payment_method(line),
+            'transfers': self._parse_integer(line, 'transfers'),
+        }
+        optional = {
+            'transfer_duration': self._parse_integer(line,
+                                                     'transfer_duration'),
+        }
+        return self._create(FareAttribute, mandatory, optional)
+
+
+class FareRulesParser(BaseParser):
+    def __init__(self, feed=DEFAULT_FEED):
+        BaseParser.__init__(self, 'fare_rules.txt', optional=True, feed=feed)
+
+    def _parse_fare(self, line):
+        fare_id = self.field(line, 'fare_id')
+        return self._reference_or_create(Fare, fare_id=fare_id)
+
+    def _parse_route(self, line):
+        route = None
+        if self.field(line, 'route_id', optional=True):
+            try:
+                route_id = self.field(line, 'route_id')
+                route = self._reference(Route, route_id=route_id)
+            except Route.DoesNotExist as e:
+                raise ParserException.for_args(e.args)
+        return route
+
+    def _parse_zone(self, line, field):
+        zone = None
+        if self.field(line, field, optional=True):
+            zone_id = self.field(line, field)
+            zone = self._reference_or_create(Zone, zone_id=zone_id)
+        return zone
+
+    def parse(self, line):
+        # every field tells the rules of a fare apart
+        mandatory = {
+            'fare': self._parse_fare(line),
+            'route': self._parse_route(line),
+            'origin': self._parse_zone(line, 'origin_id'),
+            'destination': self._parse_zone(line, 'destination_id'),
+            'contains': self._parse_zone(line, 'contains_id'),
+        }
+        return self._create(FareRule, mandatory)
+
+
+class FrequenciesParser(BaseParser):
+    def __init__(self, feed=DEFAULT_FEED):
+        BaseParser.__init__(self, 'frequencies.txt', optional=True,
+                            feed=feed)
+
+    def _parse_trip(self, line):
+        try:
+            trip = self._reference(Trip, trip_id=self.field(line, 'trip_id'))
+        except Trip.DoesNotExist as e:
+            raise ParserException.for_args(e.args)
+        return trip
+
+    def _parse_time(self, line, field):
+        try:
+            seconds = parse_time(self.field(line, field))
+        except ValueError as e:
+            raise ParserException.for_args(e.args)
+        return seconds
+
+    def _parse_headway(self, line):
+        try:
+            headway = int(self.field(line, 'headway_secs'))
+        except ValueError as e:
+            raise ParserException.for_args(e.args)
+        if headway <= 0:
+            raise ParserException.for_message(
+                'Headway must be positive, got %s' % headway)
+        return headway
+
+    def parse(self, line):
+        mandatory = {
+            'trip': self._parse_trip(line),
+            'start_time': self._parse_time(line, 'start_time'),
+            'end_time': self._parse_time(line, 'end_time'),
+            'headway_secs': self._parse_headway(line),
+        }
+        optional = {
+            'exact_times': self.field(line, 'exact_times', optional=True),
+        }
+        return self._create(Frequency, mandatory, optional)
+
+
 class RoutesParser(BaseParser):
-    def __init__(self):
-        BaseParser.__init__(self, 'routes.txt')
+    def __init__(self, feed=DEFAULT_FEED):
+        BaseParser.__init__(self, 'routes.txt', feed=feed)
 
     def _parse_route_type(self, line):
         route_type = None
         try:
             route_type_id = self.field(line, 'route_type')
-            route_type = RouteType.objects.get(value=route_type_id)
+            route_type = self._lookup(RouteType, value=route_type_id)
         except RouteType.DoesNotExist as e:
             raise ParserException.for_args(e.args)
         return route_type
@@ -153,7 +380,7 @@ class RoutesParser(BaseParser):
         if self.field(line, 'agency_id', optional=True):
             try:
                 agency_id = self.field(line, 'agency_id', optional=True)
-                agency = Agency.objects.get(agency_id=agency_id)
+                agency = self._reference(Agency, agency_id=agency_id)
             except Agency.DoesNotExist as e:
                 raise ParserException.for_args(e.args)
                 # raise ParserException('No agency with id %s '
@@ -181,8 +408,8 @@ class RoutesParser(BaseParser):
 
 
 class ShapesParser(BaseParser):
-    def __init__(self):
-        BaseParser.__init__(self, 'shapes.txt', optional=True)
+    def __init__(self, feed=DEFAULT_FEED):
+        BaseParser.__init__(self, 'shapes.txt', optional=True, feed=feed)
 
     def parse(self, line):
         geopoint = [
@@ -200,52 +427,67 @@ class ShapesParser(BaseParser):
         return self._create(Shape, mandatory, optional)
 
 
+def _stop_time_order(line):
+    sequence = line.get('stop_sequence')
+    try:
+        sequence = int(sequence)
+    except (TypeError, ValueError):
+        pass
+    return line.get('trip_id'), sequence
+
+
 class StopTimesParser(BaseParser):
-    def __init__(self):
-        BaseParser.__init__(self, 'stop_times.txt')
+    # the stop times of a trip are parsed together and in stop order,
+    # whatever the order of the file
+    order = staticmethod(_stop_time_order)
+
+    def __init__(self, feed=DEFAULT_FEED):
+        BaseParser.__init__(self, 'stop_times.txt', feed=feed)
 
     def _parse_drop_off(self, line):
         drop_off_type = None
         if self.field(line, 'drop_off_type', optional=True):
             try:
                 drop_off_type = self.field(line, 'drop_off_type')
-                drop_off_type = DropOffType.objects.get(value=drop_off_type)
+                drop_off_type = self._lookup(DropOffType,
+                                             value=drop_off_type)
             except DropOffType.DoesNotExist:
                 # except DropOffType.DoesNotExist, e:
                 # raise ParserException(e.message)
                 pass
         return drop_off_type
 
+    def _parse_time(self, line, field):
+        # untimed stops keep no time, see service.interpolation
+        if self.field(line, field, optional=True) is None:
+            return None
+        try:
+            seconds = parse_time(self.field(line, field))
+        except ValueError as e:
+            raise ParserException.for_args(e.args)
+        return seconds
+
+    def _parse_shape_distance(self, line):
+        distance = self.field(line, 'shape_dist_traveled', optional=True)
+        if distance is None:
+            return None
+        try:
+            return float(distance)
+        except ValueError as e:
+            raise ParserException.for_args(e.args)
+
     def _parse_arrival(self, line):
-        if self.field(line, 'arrival_time', optional=True) is None:
-            (hour, minute, sec) = 0, 0, 0
-        else:
-            field = self.field(line, 'arrival_time')
-            try:
-                (hour, minute, sec) = map(int, field.split(':'))
-            except ValueError as e:
-                raise ParserException.for_args(e.args)
-        arrival_time = time(hour % 24, minute % 60, sec % 60)
-        return arrival_time
+        return self._parse_time(line, 'arrival_time')
 
     def _parse_departure(self, line):
-        if self.field(line, 'departure_time', optional=True) is None:
-            (hour, minute, sec) = 0, 0, 0
-        else:
-            field = self.field(line, 'departure_time')
-            try:
-                (hour, minute, sec) = map(int, field.split(':'))
-            except ValueError as e:
-                raise ParserException.for_args(e.args)
-        departure_time = time(hour % 24, minute % 60, sec % 60)
-        return departure_time
+        return self._parse_time(line, 'departure_time')
 
     def _parse_pickup(self, line):
         pickup_type = None
         if self.field(line, 'pickup_type', optional=True):
             try:
                 pickup_type = self.field(line, 'pickup_type')
-                pickup_type = PickupType.objects.get(value=pickup_type)
+                pickup_type = self._lookup(PickupType, value=pickup_type)
             except PickupType.DoesNotExist:
                 pass
                 # except PickupType.DoesNotExist, e:
@@ -254,21 +496,19 @@ class StopTimesParser(BaseParser):
 
     def _parse_trip(self, line):
         try:
-            trip = Trip.objects.get(trip_id=self.field(line, 'trip_id'))
+            trip = self._reference(Trip, trip_id=self.field(line, 'trip_id'))
         except Trip.DoesNotExist as e:
             raise ParserException.for_args(e.args)
         return trip
 
     def _parse_stop(self, line):
         try:
-            stop = Stop.objects.get(stop_id=self.field(line, 'stop_id'))
+            stop = self._reference(Stop, stop_id=self.field(line, 'stop_id'))
         except Stop.DoesNotExist as e:
             raise ParserException.for_args(e.args)
         return stop
 
     def parse(self, line):
-        # workaround here to prevent script from failing when there is no
-        # arrival time or departure time fields.
         mandatory = {
             'trip': self._parse_trip(line),
             'stop': self._parse_stop(line),
@@ -279,20 +519,21 @@ class StopTimesParser(BaseParser):
         optional = {
             'pickup_type': self._parse_pickup(line),
             'drop_off_type': self._parse_drop_off(line),
+            'shape_dist_traveled': self._parse_shape_distance(line),
         }
         return self._create(StopTime, mandatory, optional)
 
 
 class StopsParser(BaseParser):
-    def __init__(self):
-        BaseParser.__init__(self, 'stops.txt')
+    def __init__(self, feed=DEFAULT_FEED):
+        BaseParser.__init__(self, 'stops.txt', feed=feed)
 
     def _parse_parent(self, line):
         parent_station = None
         if self.field(line, 'parent_station', optional=True):
             try:
                 parent_id = self.field(line, 'parent_station', optional=True)
-                parent_station = Stop.objects.get(stop_id=parent_id)
+                parent_station = self._reference(Stop, stop_id=parent_id)
             except Stop.DoesNotExist:
                 # except Stop.DoesNotExist, e:
                 # raise ParserException.for_args(e.args)
@@ -303,14 +544,15 @@ class StopsParser(BaseParser):
         zone = None
         if self.field(line, 'zone_id', optional=True):
             zone_id = self.field(line, 'zone_id')
-            (zone, created) = Zone.objects.get_or_create(zone_id=zone_id)
+            zone = self._reference_or_create(Zone, zone_id=zone_id)
         return zone
 
     def _parse_wheelchair(self, line):
         wheelchair = None
         if self.field(line, 'wheelchair_boarding', optional=True):
             wheelchair = self.field(line, 'wheelchair_boarding')
-            wheelchair = WheelchairAccessible.objects.get(value=wheelchair)
+            wheelchair = self._lookup(WheelchairAccessible,
+                                      value=wheelchair)
         return wheelchair
 
     def parse(self, line):
@@ -335,40 +577,62 @@ class StopsParser(BaseParser):
 
 
 class TripsParser(BaseParser):
-    def __init__(self):
-        BaseParser.__init__(self, 'trips.txt')
+    def __init__(self, feed=DEFAULT_FEED):
+        BaseParser.__init__(self, 'trips.txt', feed=feed)
 
     def _parse_directions(self, line):
         direction = None
         if self.field(line, 'direction_id', optional=True):
             direction_id = self.field(line, 'direction_id')
-            direction = Direction.objects.get(value=direction_id)
+            direction = self._lookup(Direction, value=direction_id)
         return direction
 
     def _parse_wheelchair(self, line):
         wheelchair = None
         if self.field(line, 'wheelchair_accessible', optional=True):
             wheelchair = self.field(line, 'wheelchair_accessible')
-            wheelchair = WheelchairAccessible.objects.get(value=wheelchair)
+            wheelchair = self._lookup(WheelchairAccessible,
+                                      value=wheelchair)
         return wheelchair
 
     def _parse_block(self, line):
         block = None
         if self.field(line, 'block_id', optional=True):
             block_id = self.field(line, 'block_id')
-            (block, c) = Block.objects.get_or_create(block_id=block_id)
+            block = self._reference_or_create(Block, block_id=block_id)
         return block
 
     def _parse_service(self, line):
         service_id = self.field(line, 'service_id')
-        service = Service.objects.get_or_create(service_id=service_id)[0]
+        service = self._reference_or_create(Service, service_id=service_id)
         return service
 
     def _parse_route(self, line):
         route_id = self.field(line, 'route_id')
-        route = Route.objects.get(route_id=route_id)
+        route = self._reference(Route, route_id=route_id)
         return route
 
+    def _parse_trip_time(self, line):
+        trip_time = self.field(line, 'trip_time', optional=True)
+        if trip_time is None:
+            return None
+        try:
+            return int(trip_time)
+        except ValueError as e:
+            raise ParserException.for_args(e.args)
+
+    def _parse_shapes(self, line):
+        shapes = None
+        if self.field(line, 'shape_id', optional=True):
+            shape_id = self.field(line, 'shape_id')
+            key = (Shape, shape_id)
+            if key in self._cache:
+                return self._cache[key]
+            shapes = self._remember(key, list(
+                Shape.all_by_id(shape_id, self.feed)
+                .order_by('pt_sequence').only('id')))
+        return shapes
+
     def parse(self, line):
         mandatory = {
             'route': self._parse_route(line),
@@ -381,12 +645,16 @@ class TripsParser(BaseParser):
             'direction': self._parse_directions(line),
             'block': self._parse_block(line),
             'wheelchair': self._parse_wheelchair(line),
+            'trip_time': self._parse_trip_time(line),
         }
+        if self.gtfs_ids:
+            # written along with the trip, its document being replaced
+            optional['shapes'] = self._parse_shapes(line)
         (entity, created) = self._create(Trip, mandatory, optional)
 
-        if self.field(line, 'shape_id', optional=True):
+        if not self.gtfs_ids and self.field(line, 'shape_id', optional=True):
             shape_id = self.field(line, 'shape_id')
-            for shape in Shape.all_by_id(shape_id):
+            for shape in Shape.all_by_id(shape_id, self.feed):
                 if not entity.has_shape(shape):
                     entity.shapes.add(shape)
             entity.save()
@@ -0,0 +1,297 @@
+""" Trip patterns.
+
+Thousands of trips visit exactly the same ordered stops. A pattern stores
+that stop list once (:py:class:`service.models.TripPattern`) and each trip
+becomes a pattern id plus a delta-encoded vector of its times
+(:py:class:`service.models.PatternTrip`), so routing and timetable queries
+can work pattern by pattern instead of stop time by stop time.
+
+As with the stop and route adjacency, every build writes its entries under a
+new generation id and then points the feed's
+:py:class:`service.models.PatternGeneration` at it, so readers never see a
+half built feed. The previous generation is kept until the next build.
+
+"""
+import hashlib
+from heapq import merge
+from itertools import groupby
+from bson import DBRef
+from bson import ObjectId
+from service.frequencies import HeadwayTrip
+from service.frequencies import periods_of
+from service.models import DEFAULT_FEED
+from service.models import Direction
+from service.models import PatternGeneration
+from service.models import PatternTrip
+from service.models import Route
+from service.models import Stop
+from service.models import StopTime
+from service.models import Trip
+from service.models import TripPattern
+from service.realtime import DEPARTURE
+from service.realtime import overlay
+from service.times import monotonic
+from service.times import seconds_of
+from service.versioned import VersionedByFeed
+
+BATCH_SIZE = 1000
+
+
+def _ref_id(value):
+    return value.id if isinstance(value, DBRef) else value
+
+
+def encode_times(times, start=None):
+    """Delta encodes absolute `times` from `start`, the first time by
+    default, returns `(start, deltas)`."""
+    if start is None:
+        start = times[0] if times else 0
+    deltas = []
+    previous = start
+    for value in times:
+        deltas.append(value - previous)
+        previous = value
+    return start, deltas
+
+
+def decode_times(start, deltas):
+    times = []
+    value = start
+    for delta in deltas:
+        value += delta
+        times.append(value)
+    return times
+
+
+def stop_times_of(rows):
+    """Interleaved `(a0, d0, a1, d1, ...)` seconds of a trip's stop times.
+
+    Missing times take the closest preceding known one, so the vector stays
+    monotonic.
+    """
+    times = []
+    for row in rows:
+        times.append(seconds_of(row.get('arrival_time')))
+        times.append(seconds_of(row.get('departure_time')))
+    times = monotonic(times)
+    known = [value for value in times if value is not None]
+    previous = known[0] if known else 0
+    for (index, value) in enumerate(times):
+        if value is None:
+            times[index] = previous
+        previous = times[index]
+    return times
+
+
+def pattern_id_for(route_id, direction, stop_ids):
+    digest = hashlib.sha1(u'|'.join(stop_ids).encode('utf-8')).hexdigest()
+    return '%s:%s:%s' % (route_id, direction if direction is not None else '',
+                         digest[:12])
+
+
+def _trip_stop_times(feed=DEFAULT_FEED):
+    """Yields `(trip, rows)` with the stop times of each trip in order."""
+    cursor = StopTime._get_collection() \
+        .find({'feed': feed},
+              {'trip': True, 'stop': True, 'stop_sequence': True,
+               'arrival_time': True, 'departure_time': True}) \
+        .sort([('trip', 1), ('stop_sequence', 1)])
+    for (trip, rows) in groupby(cursor, lambda row: _ref_id(row['trip'])):
+        yield trip, list(rows)
+
+
+def _switch(feed, generation):
+    previous = PatternGeneration.current(feed)
+    PatternGeneration._get_collection().update(
+        {'feed': feed}, {'$set': {'generation': generation}}, upsert=True)
+    # also drops the leftovers of builds that failed before their switch
+    for model_class in (TripPattern, PatternTrip):
+        model_class._get_collection().remove(
+            {'feed': feed, 'generation': {'$nin': [generation, previous]}})
+
+
+def build_patterns(feed=DEFAULT_FEED):
+    trips = dict((trip['_id'], trip) for trip in Trip._get_collection().find(
+        {'feed': feed}, {'route': True, 'direction': True, 'service': True}))
+    route_ids = dict((route['_id'], route['route_id']) for route in
+                     Route._get_collection().find({'feed': feed},
+                                                  {'route_id': True}))
+    stop_ids = dict((stop['_id'], stop['stop_id']) for stop in
+                    Stop._get_collection().find({'feed': feed},
+                                                {'stop_id': True}))
+    directions = dict((direction['_id'], direction['value']) for direction in
+                      Direction._get_collection().find({}, {'value': True}))
+    headways = set(periods_of(feed=feed))
+
+    generation = ObjectId()
+    patterns = {}
+    batch = []
+    for (trip_id, rows) in _trip_stop_times(feed):
+        trip = trips.get(trip_id)
+        if trip is None:
+            continue
+        route = _ref_id(trip.get('route'))
+        direction = _ref_id(trip.get('direction'))
+        stops = [_ref_id(row['stop']) for row in rows]
+        key = (route, direction, tuple(stops))
+
+        times = stop_times_of(rows)
+        # trips start with their departure from the first stop
+        (start, deltas) = encode_times(times, times[1])
+        if key not in patterns:
+            patterns[key] = {
+                '_id': ObjectId(),
+                'feed': feed,
+                'generation': generation,
+                'pattern_id': pattern_id_for(
+                    route_ids.get(route, ''), directions.get(direction),
+                    [stop_ids.get(stop, str(stop)) for stop in stops]),
+                'route': route,
+                'direction': direction,
+                'stops': stops,
+                'duration': 0,
+            }
+        pattern = patterns[key]
+        pattern['duration'] = max(pattern['duration'], times[-1] - start)
+
+        batch.append({'feed': feed, 'generation': generation,
+                      'trip': trip_id,
+                      'pattern': pattern['_id'],
+                      'service': _ref_id(trip.get('service')),
+                      'start': start, 'times': deltas,
+                      'headway': trip_id in headways})
+        if len(batch) == BATCH_SIZE:
+            PatternTrip._get_collection().insert(batch)
+            batch = []
+    if batch:
+        PatternTrip._get_collection().insert(batch)
+
+    rows = list(patterns.values())
+    for index in range(0, len(rows), BATCH_SIZE):
+        TripPattern._get_collection().insert(rows[index:index + BATCH_SIZE])
+    _switch(feed, generation)
+    return len(rows)
+
+
+_generations = VersionedByFeed(
+    lambda feed: {'generation': PatternGeneration.current(feed)})
+
+
+def _find_pattern(pattern_id, feed):
+    """The `pattern_id` entry of the current generation of `feed`."""
+    holder = _generations.holder(feed)
+    generation = holder.get()['generation']
+    pattern = TripPattern._get_collection().find_one(
+        {'feed': feed, 'generation': generation, 'pattern_id': pattern_id})
+    if pattern is None:
+        # the patterns may have been rebuilt without a new feed version
+        latest = PatternGeneration.current(feed)
+        if latest != generation:
+            holder.value = {'generation': latest}
+            pattern = TripPattern._get_collection().find_one(
+                {'feed': feed, 'generation': latest,
+                 'pattern_id': pattern_id})
+    return pattern
+
+
+def _headway_departures(trip, headway, stop_index, after):
+    for (_, departure) in headway.departures_at(stop_index, after,
+                                                float('inf')):
+        yield departure, trip
+
+
+class PatternTimetable(object):
+    """The trips of one pattern, decoded, sorted by start.
+
+    `headways` maps the frequency-based trips of the pattern to their
+    :py:class:`service.frequencies.HeadwayTrip`; those are expanded only as
+    far as a query reads.
+    """
+
+    def __init__(self, pattern, trips, headways=None):
+        self.pattern = pattern
+        self.trips = sorted(trips, key=lambda trip: trip[1])
+        self.headways = headways or {}
+
+    def departures(self, stop_index, after, services=None, limit=None,
+                   overlay=None):
+        """Yields `(trip, departure)` at the `stop_index`-th stop of the
+        pattern, leaving at or after `after`, in departure order.
+
+        With a realtime `overlay`, departures are the predicted ones and
+        cancelled trips or skipped stops are left out. Runs of
+        frequency-based trips keep their scheduled departures.
+        """
+        departures = []
+        runs = []
+        for (trip, start, times, service) in self.trips:
+            if services is not None and service not in services:
+                continue
+            if trip in self.headways:
+                runs.append(_headway_departures(trip, self.headways[trip],
+                                                stop_index, after))
+                continue
+            departure = times[2 * stop_index + 1]
+            delays = overlay.delays(trip) if overlay else None
+            if delays is not None:
+                departure = delays.adjust(stop_index, DEPARTURE, departure)
+                if departure is None:
+                    continue
+            if departure >= after:
+                departures.append((departure, trip))
+        departures.sort()
+        count = 0
+        for (departure, trip) in merge(departures, *runs):
+            yield trip, departure
+            count += 1
+            if limit is not None and count == limit:
+                return
+
+    @staticmethod
+    def load(pattern_id, after=None, feed=DEFAULT_FEED):
+        """Loads the trips of `pattern_id`.
+
+        With `after`, only trips that can still be running at that time are
+        read, using the (pattern, start) index and the pattern duration.
+        Frequency-based trips, flagged as such by the build, are always read,
+        their runs going on long after the first one.
+        """
+        pattern = _find_pattern(pattern_id, feed)
+        if pattern is None:
+            return None
+        spec = {'pattern': pattern['_id']}
+        if after is not None:
+            spec['$or'] = [{'start': {'$gte': after - pattern['duration']}},
+                           {'headway': True}]
+        rows = list(PatternTrip._get_collection().find(spec))
+        trips = [(row['trip'], row['start'],
+                  decode_times(row['start'], row['times']),
+                  _ref_id(row.get('service')))
+                 for row in rows]
+        # only the periods of the pattern's frequency-based trips are read
+        headway_trips = [row['trip'] for row in rows if row.get('headway')]
+        periods = periods_of(headway_trips, feed) if headway_trips else {}
+        headways = dict(
+            (trip, HeadwayTrip.from_times(trip, periods[trip],
+                                          pattern['stops'], times))
+            for (trip, _, times, _) in trips if trip in periods)
+        return PatternTimetable(pattern, trips, headways)
+
+
+def trips_after(pattern_id, after, stop_index=0, services=None, limit=None,
+                feed=DEFAULT_FEED):
+    """Trips of `pattern_id` leaving its `stop_index`-th stop at or after
+    `after` seconds, as `(trip, departure)` pairs, with realtime updates
+    applied.
+
+    Raises ValueError when the pattern has no `stop_index`-th stop.
+    """
+    current = overlay(feed)
+    timetable = PatternTimetable.load(pattern_id, after - current.max_delay,
+                                      feed)
+    if timetable is None:
+        return []
+    if not 0 <= stop_index < len(timetable.pattern['stops']):
+        raise ValueError('Invalid stop_index [%s]' % stop_index)
+    return list(timetable.departures(stop_index, after, services, limit,
+                                     current))
@@ -0,0 +1,261 @@
+""" Schedule-based vehicle positions.
+
+Answers "where should every vehicle be at time t" from the timetable alone,
+as a fallback when real-time data is down. For a service day, the trips
+running that day are kept sorted by start time, so the trips in progress at
+an instant are found with two binary searches bounded by the longest trip
+duration. Each trip position is then interpolated with numpy: stop times
+give the distance travelled along the path, the path gives the point.
+
+A pattern path follows the trip shape when its stop times carry
+`shape_dist_traveled`, and the straight lines between its stops otherwise.
+
+Frequency-based trips are kept as templates: only the runs in progress at
+the requested instant are generated, from the template times shifted to
+each run start.
+
+"""
+from datetime import timedelta
+from itertools import groupby
+import numpy
+from bson import DBRef
+from service.calendars import services_on
+from service.frequencies import HeadwayTrip
+from service.frequencies import periods_of
+from service.geometry import haversine
+from service.models import DEFAULT_FEED
+from service.models import PatternGeneration
+from service.models import PatternTrip
+from service.models import Shape
+from service.models import Stop
+from service.models import StopTime
+from service.models import Trip
+from service.models import TripPattern
+from service.patterns import decode_times
+from service.times import DAY
+from service.versioned import VersionedByFeed
+
+# service days kept in memory
+CACHED_DAYS = 4
+
+
+def _ref_id(value):
+    return value.id if isinstance(value, DBRef) else value
+
+
+class TripPath(object):
+    """A polyline with the distance of each stop along it."""
+
+    def __init__(self, lats, lons, cumulative, stop_distances):
+        self.lats = numpy.asarray(lats, dtype=float)
+        self.lons = numpy.asarray(lons, dtype=float)
+        self.cumulative = numpy.asarray(cumulative, dtype=float)
+        # interleaved like the trip times: (s0, s0, s1, s1, ...)
+        self.distances = numpy.repeat(
+            numpy.asarray(stop_distances, dtype=float), 2)
+
+    def locate(self, times, instant):
+        distance = numpy.interp(instant, times, self.distances)
+        return (float(numpy.interp(distance, self.cumulative, self.lats)),
+                float(numpy.interp(distance, self.cumulative, self.lons)))
+
+    @staticmethod
+    def cumulative_of(lats, lons):
+        lats = numpy.asarray(lats, dtype=float)
+        lons = numpy.asarray(lons, dtype=float)
+        steps = haversine(lats[:-1], lons[:-1], lats[1:], lons[1:])
+        return numpy.concatenate([[0.0], numpy.cumsum(steps)])
+
+    @staticmethod
+    def for_stops(points):
+        (lats, lons) = zip(*points)
+        cumulative = TripPath.cumulative_of(lats, lons)
+        return TripPath(lats, lons, cumulative, cumulative)
+
+    @staticmethod
+    def for_shape(rows, stop_distances):
+        lats = [row['geopoint'][0] for row in rows]
+        lons = [row['geopoint'][1] for row in rows]
+        distances = [row.get('dist_traveled') for row in rows]
+        if all(distance is not None for distance in distances):
+            cumulative = distances
+        else:
+            cumulative = TripPath.cumulative_of(lats, lons)
+        return TripPath(lats, lons, cumulative, stop_distances)
+
+
+class Timetable(object):
+    """Trips with their times and paths, for every service."""
+
+    def __init__(self, trips, paths, headways=None):
+        # (trip_id, service, pattern, times) tuples, times as numpy arrays
+        self.trips = trips
+        self.paths = paths
+        # (trip_id, service, pattern, times, HeadwayTrip) of the
+        # frequency-based trips, times relative to the run start
+        self.headways = headways or []
+
+    @staticmethod
+    def _shape_paths(first_trips, feed=DEFAULT_FEED):
+        """Shape-based paths of the patterns whose representative trip has
+        shape_dist_traveled on every stop time."""
+        trips = dict((trip['_id'], trip) for trip in
+                     Trip._get_collection().find(
+                         {'feed': feed,
+                          '_id': {'$in': list(first_trips.values())}},
+                         {'shapes': True}))
+        shape_points = [_ref_id(trip['shapes'][0]) for trip in trips.values()
+                        if trip.get('shapes')]
+        shape_ids = dict((row['_id'], row['shape_id']) for row in
+                         Shape._get_collection().find(
+                             {'feed': feed, '_id': {'$in': shape_points}},
+                             {'shape_id': True}))
+
+        distances = {}
+        cursor = StopTime._get_collection() \
+            .find({'feed': feed,
+                   'trip': {'$in': list(first_trips.values())}},
+                  {'trip': True, 'shape_dist_traveled': True,
+                   'stop_sequence': True}) \
+            .sort([('trip', 1), ('stop_sequence', 1)])
+        for (trip, rows) in groupby(cursor, lambda row: _ref_id(row['trip'])):
+            values = [row.get('shape_dist_traveled') for row in rows]
+            if all(value is not None for value in values):
+                distances[trip] = values
+
+        wanted = {}
+        for (pattern, trip) in first_trips.items():
+            shapes = trips.get(trip, {}).get('shapes')
+            if trip in distances and shapes and \
+                    _ref_id(shapes[0]) in shape_ids:
+                wanted[pattern] = (shape_ids[_ref_id(shapes[0])],
+                                   distances[trip])
+        if not wanted:
+            return {}
+
+        rows_by_shape = {}
+        cursor = Shape._get_collection() \
+            .find({'feed': feed, 'shape_id': {'$in': list(set(
+                shape_id for (shape_id, _) in wanted.values()))}},
+                {'shape_id': True, 'geopoint': True, 'dist_traveled': True}) \
+            .sort([('shape_id', 1), ('pt_sequence', 1)])
+        for (shape_id, rows) in groupby(cursor, lambda row: row['shape_id']):
+            rows_by_shape[shape_id] = list(rows)
+
+        return dict((pattern, TripPath.for_shape(rows_by_shape[shape_id],
+                                                 stop_distances))
+                    for (pattern, (shape_id, stop_distances))
+                    in wanted.items() if shape_id in rows_by_shape)
+
+    @staticmethod
+    def build(feed=DEFAULT_FEED):
+        spec = {'feed': feed}
+        stops = dict((stop['_id'], stop['geopoint']) for stop in
+                     Stop._get_collection().find(spec, {'geopoint': True})
+                     if stop.get('geopoint'))
+        trip_ids = dict((trip['_id'], trip['trip_id']) for trip in
+                        Trip._get_collection().find(spec, {'trip_id': True}))
+
+        periods = periods_of(feed=feed)
+
+        trips = []
+        headways = []
+        first_trips = {}
+        generation = {'feed': feed,
+                      'generation': PatternGeneration.current(feed)}
+        for row in PatternTrip._get_collection().find(generation):
+            pattern = _ref_id(row['pattern'])
+            trip = _ref_id(row['trip'])
+            first_trips.setdefault(pattern, trip)
+            times = decode_times(row['start'], row['times'])
+            if trip in periods:
+                # runs are located with the relative times, only their
+                # starts are needed from the template
+                headways.append((
+                    trip_ids.get(trip), _ref_id(row.get('service')), pattern,
+                    numpy.array(times) - times[1],
+                    HeadwayTrip(trip_ids.get(trip), periods[trip], [])))
+                continue
+            trips.append((trip_ids.get(trip), _ref_id(row.get('service')),
+                          pattern, numpy.array(times)))
+
+        paths = Timetable._shape_paths(first_trips, feed)
+        for pattern in TripPattern._get_collection().find(generation,
+                                                          {'stops': True}):
+            points = [stops.get(_ref_id(stop)) for stop in pattern['stops']]
+            if pattern['_id'] not in paths and all(points):
+                paths[pattern['_id']] = TripPath.for_stops(points)
+        return Timetable(trips, paths, headways)
+
+
+class ServiceDay(object):
+    """The trips running on one service day, sorted by start time."""
+
+    def __init__(self, timetable, services):
+        trips = sorted((trip for trip in timetable.trips
+                        if trip[1] in services and trip[2] in timetable.paths),
+                       key=lambda trip: trip[3][0])
+        self.paths = timetable.paths
+        self.trips = trips
+        self.starts = numpy.array([trip[3][0] for trip in trips])
+        self.ends = numpy.array([trip[3][-1] for trip in trips])
+        self.longest = int((self.ends - self.starts).max()) if trips else 0
+        self.headways = [headway for headway in timetable.headways
+                         if headway[1] in services
+                         and headway[2] in timetable.paths]
+
+    def active(self, instant):
+        """Indexes of the trips in progress at `instant` seconds."""
+        first = numpy.searchsorted(self.starts, instant - self.longest)
+        last = numpy.searchsorted(self.starts, instant, side='right')
+        candidates = numpy.arange(first, last)
+        return candidates[self.ends[candidates] >= instant]
+
+    def positions(self, instant):
+        """`(trip_id, lat, lon)` of every trip in progress at `instant`."""
+        result = []
+        for index in self.active(instant):
+            (trip_id, service, pattern, times) = self.trips[index]
+            (lat, lon) = self.paths[pattern].locate(times, instant)
+            result.append((trip_id, lat, lon))
+        for (trip_id, service, pattern, times, headway) in self.headways:
+            for start in headway.starts(instant - times[-1],
+                                        instant - times[0] + 1):
+                (lat, lon) = self.paths[pattern].locate(times + start,
+                                                        instant)
+                result.append((trip_id, lat, lon))
+        return result
+
+
+class PositionEngine(object):
+    def __init__(self, timetable, feed=DEFAULT_FEED):
+        self.timetable = timetable
+        self.feed = feed
+        self.days = {}
+
+    def service_day(self, day):
+        if day not in self.days:
+            if len(self.days) >= CACHED_DAYS:
+                self.days.pop(min(self.days))
+            self.days[day] = ServiceDay(self.timetable,
+                                        services_on(day, self.feed))
+        return self.days[day]
+
+    def positions(self, moment):
+        """Positions at `moment`, a naive local datetime.
+
+        Trips of the previous service day still running past midnight are
+        included.
+        """
+        day = moment.date()
+        instant = moment.hour * 3600 + moment.minute * 60 + moment.second
+        return self.service_day(day).positions(instant) + \
+            self.service_day(day - timedelta(days=1)).positions(instant + DAY)
+
+
+_engines = VersionedByFeed(
+    lambda feed: PositionEngine(Timetable.build(feed), feed))
+
+
+def vehicle_positions(moment, feed=DEFAULT_FEED):
+    return _engines.get(feed).positions(moment)
@@ -0,0 +1,225 @@
+""" Origin-destination trip search.
+
+Every stop has a posting list of the trips calling at it: parallel arrays of
+trip number, position in the trip, arrival and departure seconds, sorted by
+trip number. Trips going from A to B are found by a linear merge of the
+posting lists of A and B, keeping the trips that reach A before B, leave A
+after the requested time and belong to a service running that day.
+
+Frequency-based trips have posting lists of their own, holding the times of
+their template run. Their matches are expanded into the runs leaving after
+the requested time, no more than the number of trips asked for.
+
+"""
+from array import array
+from itertools import islice
+from bson import DBRef
+from service.calendars import services_on
+from service.frequencies import HeadwayTrip
+from service.frequencies import periods_of
+from service.models import DEFAULT_FEED
+from service.models import PatternGeneration
+from service.models import PatternTrip
+from service.models import Stop
+from service.models import Trip
+from service.models import TripPattern
+from service.patterns import decode_times
+from service.realtime import ARRIVAL
+from service.realtime import DEPARTURE
+from service.realtime import overlay
+from service.versioned import VersionedByFeed
+
+DEFAULT_LIMIT = 20
+
+
+def _ref_id(value):
+    return value.id if isinstance(value, DBRef) else value
+
+
+class Postings(object):
+    __slots__ = ('trips', 'positions', 'arrivals', 'departures')
+
+    def __init__(self):
+        self.trips = array('i')
+        self.positions = array('i')
+        self.arrivals = array('i')
+        self.departures = array('i')
+
+    def append(self, trip, position, arrival, departure):
+        self.trips.append(trip)
+        self.positions.append(position)
+        self.arrivals.append(arrival)
+        self.departures.append(departure)
+
+    def __len__(self):
+        return len(self.trips)
+
+
+def _runs(postings, start):
+    """End of the run of entries sharing the trip at `start`."""
+    end = start + 1
+    while end < len(postings) and \
+            postings.trips[end] == postings.trips[start]:
+        end += 1
+    return end
+
+
+def intersect(origin, destination, after=0):
+    """Merges two posting lists.
+
+    Yields `(trip, departure, arrival, origin position, destination
+    position)` for every trip calling at the origin before the destination,
+    leaving the origin at or after `after`. A trip
+    visiting a stop more than once uses its first eligible origin visit and
+    its first destination visit after it.
+    """
+    (i, j) = (0, 0)
+    while i < len(origin) and j < len(destination):
+        (a, b) = (origin.trips[i], destination.trips[j])
+        if a < b:
+            i += 1
+        elif a > b:
+            j += 1
+        else:
+            (i_end, j_end) = (_runs(origin, i), _runs(destination, j))
+            match = None
+            for k in range(i, i_end):
+                if origin.departures[k] < after:
+                    continue
+                for m in range(j, j_end):
+                    if destination.positions[m] > origin.positions[k]:
+                        match = (a, origin.departures[k],
+                                 destination.arrivals[m],
+                                 origin.positions[k], destination.positions[m])
+                        break
+                if match:
+                    break
+            if match:
+                yield match
+            (i, j) = (i_end, j_end)
+
+
+class TripIndex(object):
+    def __init__(self):
+        self.postings = {}
+        self.headway_postings = {}
+        # per trip number
+        self.trip_ids = []
+        self.services = []
+        self.headways = {}
+
+    def add_trip(self, trip_id, service, stop_ids, times, periods=None):
+        """Indexes a trip, `periods` being the `(start_time, end_time,
+        headway_secs)` of a frequency-based one."""
+        trip = len(self.trip_ids)
+        self.trip_ids.append(trip_id)
+        self.services.append(service)
+        lists = self.postings
+        if periods:
+            self.headways[trip] = HeadwayTrip.from_times(trip_id, periods,
+                                                         stop_ids, times)
+            lists = self.headway_postings
+        for (position, stop_id) in enumerate(stop_ids):
+            postings = lists.get(stop_id)
+            if postings is None:
+                postings = lists[stop_id] = Postings()
+            postings.append(trip, position, times[2 * position],
+                            times[2 * position + 1])
+
+    def between(self, origin, destination, after=0, services=None,
+                limit=DEFAULT_LIMIT, overlay=None):
+        """Trips from stop_id `origin` to stop_id `destination`, as
+        `(trip_id, departure, arrival)` in departure order.
+
+        With a realtime `overlay`, times are the predicted ones and cancelled
+        trips or skipped stops are left out. Runs of frequency-based trips
+        keep their scheduled times.
+        """
+        matches = self._headway_matches(origin, destination, after, services,
+                                        limit)
+        if origin not in self.postings or destination not in self.postings:
+            return [(self.trip_ids[trip], departure, arrival)
+                    for (departure, arrival, trip) in sorted(matches)[:limit]]
+        slack = overlay.max_delay if overlay else 0
+        for (trip, departure, arrival, origin_position, destination_position) \
+                in intersect(self.postings[origin], self.postings[destination],
+                             after - slack):
+            if services is not None and self.services[trip] not in services:
+                continue
+            delays = overlay.delays(self.trip_ids[trip]) if overlay else None
+            if delays is not None:
+                departure = delays.adjust(origin_position, DEPARTURE,
+                                          departure)
+                arrival = delays.adjust(destination_position, ARRIVAL,
+                                        arrival)
+                if departure is None or arrival is None:
+                    continue
+            if departure >= after:
+                matches.append((departure, arrival, trip))
+        matches.sort()
+        return [(self.trip_ids[trip], departure, arrival)
+                for (departure, arrival, trip) in matches[:limit]]
+
+    def _headway_matches(self, origin, destination, after, services, limit):
+        """`(departure, arrival, trip)` of the first `limit` runs of each
+        frequency-based trip from `origin` to `destination`."""
+        if origin not in self.headway_postings or \
+                destination not in self.headway_postings:
+            return []
+        matches = []
+        for (trip, _, _, origin_position, destination_position) in intersect(
+                self.headway_postings[origin],
+                self.headway_postings[destination]):
+            if services is not None and self.services[trip] not in services:
+                continue
+            headway = self.headways[trip]
+            ride = headway.offsets[destination_position][1] - \
+                headway.offsets[origin_position][2]
+            for (_, departure) in islice(
+                    headway.departures_at(origin_position, after,
+                                          float('inf')), limit):
+                matches.append((departure, departure + ride, trip))
+        return matches
+
+    @staticmethod
+    def build(feed=DEFAULT_FEED):
+        spec = {'feed': feed}
+        generation = {'feed': feed,
+                      'generation': PatternGeneration.current(feed)}
+        stop_ids = dict((stop['_id'], stop['stop_id']) for stop in
+                        Stop._get_collection().find(spec, {'stop_id': True}))
+        trip_ids = dict((trip['_id'], trip['trip_id']) for trip in
+                        Trip._get_collection().find(spec, {'trip_id': True}))
+        patterns = dict(
+            (pattern['_id'], [stop_ids.get(_ref_id(stop))
+                              for stop in pattern['stops']])
+            for pattern in TripPattern._get_collection().find(
+                generation, {'stops': True}))
+
+        periods = periods_of(feed=feed)
+
+        index = TripIndex()
+        cursor = PatternTrip._get_collection().find(generation) \
+            .sort('trip', 1)
+        for row in cursor:
+            pattern_stops = patterns.get(_ref_id(row['pattern']))
+            if pattern_stops is None:
+                continue
+            index.add_trip(trip_ids.get(_ref_id(row['trip'])),
+                           _ref_id(row.get('service')), pattern_stops,
+                           decode_times(row['start'], row['times']),
+                           periods.get(_ref_id(row['trip'])))
+        return index
+
+
+_indexes = VersionedByFeed(TripIndex.build)
+
+
+def trips_between(origin, destination, day, after=0, limit=DEFAULT_LIMIT,
+                  feed=DEFAULT_FEED):
+    """Trips of `feed` running on `day` from stop_id `origin` to stop_id
+    `destination`, leaving at or after `after` seconds, with realtime
+    updates applied."""
+    return _indexes.get(feed).between(origin, destination, after,
+                                      services_on(day, feed), limit,
+                                      overlay(feed))
@@ -0,0 +1,99 @@
+""" Batched reference resolution over raw documents.
+
+Touching a `ReferenceField` on a list of documents issues one query per
+reference per document. The helpers here read raw documents instead, collect
+the referenced ids across the whole result set and resolve every referenced
+collection with a single `$in` query, replacing the ids by the referenced raw
+documents. Queries are scoped to a feed; the joins need no scope of their
+own, documents being referenced by their globally unique `_id`.
+
+"""
+from contextlib import contextmanager
+from bson import DBRef
+from mongoengine.context_managers import query_counter
+from service.models import DEFAULT_FEED
+from service.models import Direction
+from service.models import Route
+from service.models import Service
+from service.models import Shape
+from service.models import Trip
+
+TOO_MANY_QUERIES = 'Expected at most [%s] queries, [%s] were issued'
+
+
+class Join(object):
+    """Replaces the ids held by `field` with documents of `model_class`."""
+
+    def __init__(self, field, model_class, fields=None):
+        self.field = field
+        self.model_class = model_class
+        self.fields = fields
+
+    def fetch(self, ids):
+        projection = dict((field, True) for field in self.fields) \
+            if self.fields else None
+        cursor = self.model_class._get_collection().find(
+            {'_id': {'$in': list(ids)}}, projection)
+        return dict((document['_id'], document) for document in cursor)
+
+
+TRIP_JOINS = (
+    Join('route', Route),
+    Join('service', Service),
+    Join('direction', Direction),
+    Join('shapes', Shape, ('shape_id', 'pt_sequence', 'geopoint')),
+)
+
+
+def _ref_id(value):
+    return value.id if isinstance(value, DBRef) else value
+
+
+def resolve(rows, joins):
+    """Resolves `joins` over the raw documents in `rows`, in place.
+
+    Issues one query per join whatever the number of rows. Dangling
+    references resolve to None.
+    """
+    for join in joins:
+        ids = set()
+        for row in rows:
+            value = row.get(join.field)
+            if isinstance(value, list):
+                ids.update(_ref_id(item) for item in value)
+            elif value is not None:
+                ids.add(_ref_id(value))
+        if not ids:
+            continue
+
+        documents = join.fetch(ids)
+        for row in rows:
+            value = row.get(join.field)
+            if isinstance(value, list):
+                row[join.field] = [documents.get(_ref_id(item))
+                                   for item in value]
+            elif value is not None:
+                row[join.field] = documents.get(_ref_id(value))
+    return rows
+
+
+def trips_with_references(spec=None, limit=0, joins=TRIP_JOINS,
+                          feed=DEFAULT_FEED):
+    """Raw trips of `feed` matching `spec`, with their references
+    pre-joined."""
+    rows = list(Trip._get_collection().find(dict(spec or {}, feed=feed))
+                .limit(limit))
+    return resolve(rows, joins)
+
+
+@contextmanager
+def assert_max_queries(limit):
+    """Fails when the enclosed block issues more than `limit` queries.
+
+    Relies on the database profiler, see mongoengine's `query_counter`.
+    """
+    with query_counter() as counter:
+        yield
+        count = int(counter)
+    if count > limit:
+        raise AssertionError(TOO_MANY_QUERIES % (limit, count))
@@ -0,0 +1,445 @@
+""" GTFS-Realtime trip updates.
+
+TripUpdate feeds are parsed into plain objects and resolved against the
+scheduled timetable into an :py:class:`Overlay`: per trip, the delay of every
+updated stop, sorted by position in the trip. The overlay is a delta layer,
+stop times stay untouched, and departure queries ask it to adjust the
+scheduled times they computed. Applying a feed builds a new overlay and swaps
+it in, so readers never see a half-applied update.
+
+Feeds are read with the official `gtfs-realtime-bindings` package.
+
+"""
+import calendar
+import logging
+import threading
+import time
+from bisect import bisect_right
+from datetime import datetime
+from functools import partial
+from urllib2 import urlopen
+import pytz
+from bson import DBRef
+from django.conf import settings
+from google.transit import gtfs_realtime_pb2
+from service.models import Agency
+from service.models import DEFAULT_FEED
+from service.models import PatternGeneration
+from service.models import PatternTrip
+from service.models import Stop
+from service.models import StopTime
+from service.models import Trip
+from service.models import TripPattern
+from service.versioned import Versioned
+
+logger = logging.getLogger(__name__)
+
+# seconds between two reads of REALTIME_TRIP_UPDATES
+DEFAULT_REFRESH_INTERVAL = 30
+# seconds a read of a REALTIME_TRIP_UPDATES URL may take
+DEFAULT_FETCH_TIMEOUT = 10
+
+# FeedHeader.incrementality
+FULL_DATASET = 0
+DIFFERENTIAL = 1
+
+# TripDescriptor.schedule_relationship
+CANCELED = 3
+
+# StopTimeUpdate.schedule_relationship
+SKIPPED = 1
+NO_DATA = 2
+
+# slots of the interleaved trip times
+ARRIVAL = 0
+DEPARTURE = 1
+
+
+class RealtimeException(Exception):
+    pass
+
+
+def _ref_id(value):
+    return value.id if isinstance(value, DBRef) else value
+
+
+class StopUpdate(object):
+    __slots__ = ('stop_sequence', 'stop_id', 'arrival', 'departure',
+                 'relationship')
+
+    def __init__(self, stop_sequence=None, stop_id=None, arrival=None,
+                 departure=None, relationship=0):
+        self.stop_sequence = stop_sequence
+        self.stop_id = stop_id
+        # (delay, time) pairs, either may be None
+        self.arrival = arrival
+        self.departure = departure
+        self.relationship = relationship
+
+
+class TripUpdate(object):
+    __slots__ = ('trip_id', 'start_date', 'relationship', 'delay', 'stops')
+
+    def __init__(self, trip_id, start_date=None, relationship=0, delay=None,
+                 stops=None):
+        self.trip_id = trip_id
+        self.start_date = start_date
+        self.relationship = relationship
+        self.delay = delay
+        self.stops = stops or []
+
+
+class FeedMessage(object):
+    def __init__(self, timestamp, incrementality, updates, deleted):
+        self.timestamp = timestamp
+        self.incrementality = incrementality
+        self.updates = updates
+        # trip_ids of the deleted entities
+        self.deleted = deleted
+
+
+def _bindings_event(message, name):
+    if not message.HasField(name):
+        return None
+    event = getattr(message, name)
+    return (event.delay if event.HasField('delay') else None,
+            event.time if event.HasField('time') else None)
+
+
+def _read_bindings(data):
+    message = gtfs_realtime_pb2.FeedMessage()
+    message.ParseFromString(bytes(data))
+    (updates, deleted) = ([], [])
+    for entity in message.entity:
+        if not entity.HasField('trip_update') or \
+                not entity.trip_update.trip.HasField('trip_id'):
+            continue
+        trip_update = entity.trip_update
+        trip = trip_update.trip
+        if entity.is_deleted:
+            deleted.append(trip.trip_id)
+            continue
+        updates.append(TripUpdate(
+            trip.trip_id,
+            trip.start_date if trip.HasField('start_date') else None,
+            trip.schedule_relationship,
+            trip_update.delay if trip_update.HasField('delay') else None,
+            [StopUpdate(
+                stop.stop_sequence if stop.HasField('stop_sequence') else None,
+                stop.stop_id if stop.HasField('stop_id') else None,
+                _bindings_event(stop, 'arrival'),
+                _bindings_event(stop, 'departure'),
+                stop.schedule_relationship)
+             for stop in trip_update.stop_time_update]))
+    header = message.header
+    timestamp = header.timestamp if header.HasField('timestamp') else None
+    return FeedMessage(timestamp, header.incrementality, updates, deleted)
+
+
+def parse_feed(data):
+    """Parses the bytes of a GTFS-Realtime FeedMessage."""
+    try:
+        return _read_bindings(data)
+    except Exception as error:
+        raise RealtimeException('Invalid GTFS-Realtime feed: %s' % error)
+
+
+class TripSchedule(object):
+    """Stops and scheduled times of every trip, used to resolve updates."""
+
+    def __init__(self, trips, patterns, timezone=None):
+        # trip_id -> (_id, pattern _id, start, deltas)
+        self.trips = trips
+        # pattern _id -> stop_ids
+        self.patterns = patterns
+        # agency_timezone, the service days are counted in
+        self.timezone = timezone or settings.TIME_ZONE
+        # pattern _id -> {stop_id: position}, computed on demand
+        self.positions = {}
+        # trip_id -> stop_sequence values, read on demand
+        self.sequences = {}
+
+    def stops(self, trip_id):
+        """Position of the first visit of each stop_id of the trip."""
+        pattern = self.trips[trip_id][1]
+        if pattern not in self.positions:
+            positions = {}
+            for (position, stop_id) in enumerate(
+                    self.patterns.get(pattern, ())):
+                positions.setdefault(stop_id, position)
+            self.positions[pattern] = positions
+        return self.positions[pattern]
+
+    def times(self, trip_id):
+        (_, _, start, deltas) = self.trips[trip_id]
+        times = []
+        value = start
+        for delta in deltas:
+            value += delta
+            times.append(value)
+        return times
+
+    def load_sequences(self, trip_ids):
+        missing = dict((self.trips[trip_id][0], trip_id) for trip_id
+                       in trip_ids if trip_id not in self.sequences)
+        if not missing:
+            return
+        for trip_id in missing.values():
+            self.sequences[trip_id] = []
+        cursor = StopTime._get_collection() \
+            .find({'trip': {'$in': list(missing)}},
+                  {'trip': True, 'stop_sequence': True}) \
+            .sort([('trip', 1), ('stop_sequence', 1)])
+        for row in cursor:
+            self.sequences[missing[_ref_id(row['trip'])]].append(
+                row['stop_sequence'])
+
+    @staticmethod
+    def build(feed=DEFAULT_FEED):
+        spec = {'feed': feed}
+        generation = {'feed': feed,
+                      'generation': PatternGeneration.current(feed)}
+        stop_ids = dict((stop['_id'], stop['stop_id']) for stop in
+                        Stop._get_collection().find(spec, {'stop_id': True}))
+        trip_ids = dict((trip['_id'], trip['trip_id']) for trip in
+                        Trip._get_collection().find(spec, {'trip_id': True}))
+        patterns = dict(
+            (pattern['_id'], tuple(stop_ids.get(_ref_id(stop))
+                                   for stop in pattern['stops']))
+            for pattern in TripPattern._get_collection().find(
+                generation, {'stops': True}))
+        trips = {}
+        for row in PatternTrip._get_collection().find(generation):
+            trip = _ref_id(row['trip'])
+            if trip in trip_ids:
+                trips[trip_ids[trip]] = (trip, _ref_id(row['pattern']),
+                                         row['start'], row['times'])
+        agency = Agency._get_collection().find_one(
+            {'feed': feed, 'timezone': {'$nin': [None, '']}},
+            {'timezone': True})
+        return TripSchedule(trips, patterns,
+                            agency['timezone'] if agency else None)
+
+
+def _midnight(start_date, timezone):
+    """Epoch seconds the times of the service day count from, in the
+    `timezone` name.
+
+    That is noon minus 12h, as GTFS defines it, midnight but on the days
+    daylight saving time starts or ends.
+    """
+    zone = pytz.timezone(timezone)
+    day = datetime.strptime(start_date, '%Y%m%d').date() if start_date \
+        else datetime.now(zone).date()
+    noon = zone.localize(datetime(day.year, day.month, day.day, 12))
+    return calendar.timegm(noon.utctimetuple()) - 12 * 60 * 60
+
+
+class TripDelays(object):
+    """Resolved delays of one trip, by position in the trip."""
+    __slots__ = ('cancelled', 'delay', 'positions', 'events')
+
+    def __init__(self, cancelled=False, delay=None, positions=None,
+                 events=None):
+        self.cancelled = cancelled
+        # trip level delay, applying until the first stop update
+        self.delay = delay
+        self.positions = positions or []
+        # (arrival delay, departure delay, relationship) per position
+        self.events = events or []
+
+    def delays(self):
+        values = [self.delay] + [delay for (arrival, departure, _)
+                                 in self.events
+                                 for delay in (arrival, departure)]
+        return [value for value in values if value is not None]
+
+    def adjust(self, position, slot, scheduled):
+        """Realtime seconds of a scheduled time, None when not served."""
+        if self.cancelled:
+            return None
+        index = bisect_right(self.positions, position) - 1
+        if index < 0:
+            return scheduled + (self.delay or 0)
+        (arrival, departure, relationship) = self.events[index]
+        if relationship == NO_DATA:
+            return scheduled
+        if self.positions[index] == position:
+            if relationship == SKIPPED:
+                return None
+            delay = arrival if slot == ARRIVAL else departure
+            if delay is None:
+                delay = departure if slot == ARRIVAL else arrival
+        else:
+            # delays propagate downstream until the next update
+            delay = departure if departure is not None else arrival
+        return scheduled + (delay or 0)
+
+    @staticmethod
+    def resolve(update, schedule):
+        """Resolves `update` against the trip schedule, None for trips that
+        are not scheduled."""
+        if update.trip_id not in schedule.trips:
+            return None
+        if update.relationship == CANCELED:
+            return TripDelays(cancelled=True)
+
+        stops = schedule.stops(update.trip_id)
+        sequences = schedule.sequences.get(update.trip_id, ())
+        times = None
+        midnight = None
+        resolved = {}
+        for stop in update.stops:
+            position = None
+            if stop.stop_sequence is not None and \
+                    stop.stop_sequence in sequences:
+                position = sequences.index(stop.stop_sequence)
+            if position is None and stop.stop_id is not None:
+                position = stops.get(stop.stop_id)
+            if position is None:
+                continue
+            (arrival, departure) = (stop.arrival, stop.departure)
+            arrival_delay = arrival[0] if arrival else None
+            departure_delay = departure[0] if departure else None
+            if (arrival_delay is None and arrival and arrival[1]) or \
+                    (departure_delay is None and departure and departure[1]):
+                # absolute predictions, relative to the scheduled time
+                if times is None:
+                    times = schedule.times(update.trip_id)
+                    midnight = _midnight(update.start_date,
+                                         schedule.timezone)
+                if arrival_delay is None and arrival and arrival[1]:
+                    arrival_delay = int(arrival[1] - midnight -
+                                        times[2 * position + ARRIVAL])
+                if departure_delay is None and departure and departure[1]:
+                    departure_delay = int(departure[1] - midnight -
+                                          times[2 * position + DEPARTURE])
+            resolved[position] = (arrival_delay, departure_delay,
+                                  stop.relationship)
+
+        positions = sorted(resolved)
+        return TripDelays(delay=update.delay, positions=positions,
+                          events=[resolved[position]
+                                  for position in positions])
+
+
+class Overlay(object):
+    def __init__(self, trips=None, timestamp=None, object_ids=None):
+        # trip_id -> TripDelays
+        self.trips = trips or {}
+        self.timestamp = timestamp
+        # trip _id -> trip_id, for queries working on documents
+        self.object_ids = object_ids or {}
+        # largest delay, queries widen their time window by it
+        self.max_delay = max([0] + [delay for delays in self.trips.values()
+                                    for delay in delays.delays()])
+
+    def delays(self, trip):
+        """Delays of a trip, by trip_id or by document _id."""
+        return self.trips.get(self.object_ids.get(trip, trip))
+
+    def __len__(self):
+        return len(self.trips)
+
+    def merge(self, message, schedule):
+        """A new overlay with the `message` updates applied on top of this
+        one."""
+        needing_sequences = [update.trip_id for update in message.updates
+                             if update.trip_id in schedule.trips and
+                             any(stop.stop_sequence is not None
+                                 for stop in update.stops)]
+        schedule.load_sequences(needing_sequences)
+
+        trips = dict(self.trips) if message.incrementality == DIFFERENTIAL \
+            else {}
+        for trip_id in message.deleted:
+            trips.pop(trip_id, None)
+        for update in message.updates:
+            delays = TripDelays.resolve(update, schedule)
+            if delays is not None:
+                trips[update.trip_id] = delays
+        object_ids = dict((schedule.trips[trip_id][0], trip_id)
+                          for trip_id in trips if trip_id in schedule.trips)
+        return Overlay(trips, message.timestamp, object_ids)
+
+
+class RealtimeFeed(object):
+    """The overlay of the configured trip updates source.
+
+    `source` is a file path or an URL, read again every `refresh_interval`
+    seconds. Reads happen in a background thread started on access, so
+    requests never wait for the source and keep getting the last good
+    overlay meanwhile. A failing read keeps the previous overlay.
+    """
+
+    def __init__(self, source=None, refresh_interval=DEFAULT_REFRESH_INTERVAL,
+                 feed=DEFAULT_FEED, fetch_timeout=DEFAULT_FETCH_TIMEOUT):
+        self.source = source
+        self.refresh_interval = refresh_interval
+        self.fetch_timeout = fetch_timeout
+        # the feed namespace whose trips are updated
+        self.feed = feed
+        self.overlay = Overlay()
+        self.schedule = Versioned(partial(TripSchedule.build, feed))
+        self.read_at = 0
+        self.refresher = None
+        self._lock = threading.Lock()
+
+    def apply(self, data):
+        self.overlay = self.overlay.merge(parse_feed(data),
+                                          self.schedule.get())
+        return self.overlay
+
+    def _read(self):
+        if '://' in self.source:
+            response = urlopen(self.source, timeout=self.fetch_timeout)
+            try:
+                return response.read()
+            finally:
+                response.close()
+        with open(self.source, 'rb') as feed_file:
+            return feed_file.read()
+
+    def refresh(self):
+        try:
+            self.apply(self._read())
+        except (IOError, RealtimeException) as error:
+            logger.warning('Could not read trip updates [%s]: %s',
+                           self.source, error)
+        except Exception:
+            logger.exception('Could not apply trip updates [%s]',
+                             self.source)
+
+    def get(self):
+        now = time.time()
+        if self.source and now - self.read_at > self.refresh_interval:
+            with self._lock:
+                if now - self.read_at > self.refresh_interval and \
+                        (self.refresher is None or
+                         not self.refresher.is_alive()):
+                    self.read_at = now
+                    self.refresher = threading.Thread(target=self.refresh,
+                                                      name='trip-updates')
+                    self.refresher.daemon = True
+                    self.refresher.start()
+        return self.overlay
+
+
+trip_updates = RealtimeFeed(
+    source=getattr(settings, 'REALTIME_TRIP_UPDATES', None),
+    refresh_interval=getattr(settings, 'REALTIME_REFRESH_INTERVAL',
+                             DEFAULT_REFRESH_INTERVAL),
+    feed=getattr(settings, 'REALTIME_FEED', DEFAULT_FEED),
+    fetch_timeout=getattr(settings, 'REALTIME_FETCH_TIMEOUT',
+                          DEFAULT_FETCH_TIMEOUT),
+)
+
+EMPTY_OVERLAY = Overlay()
+
+
+def overlay(feed=DEFAULT_FEED):
+    """The current realtime overlay of `feed`, empty without a configured
+    source."""
+    if feed != trip_updates.feed:
+        return EMPTY_OVERLAY
+    return trip_updates.get()
@@ -0,0 +1,151 @@
+""" Read-only records built straight from raw documents.
+
+Hydrating mongoengine documents (field conversion, change tracking, lazy
+references) dominates the CPU time of read-heavy endpoints. Records are
+plain `__slots__` objects filled from the raw pymongo documents, with a
+projection restricted to the fields they hold. References are kept as ids.
+Reads are scoped to a feed, the default one unless told otherwise.
+
+"""
+from service.models import Calendar
+from service.models import DEFAULT_FEED
+from service.models import Route
+from service.models import Stop
+from service.models import StopTime
+from service.models import Trip
+
+BATCH_SIZE = 1000
+
+
+class Record(object):
+    __slots__ = ()
+
+    model_class = None
+
+    # (attribute, raw document key) pairs, in slot order
+    fields = ()
+
+    def __init__(self, *values):
+        for (slot, value) in zip(self.__slots__, values):
+            setattr(self, slot, value)
+
+    @classmethod
+    def from_raw(cls, row):
+        record = cls.__new__(cls)
+        for (slot, key) in cls.fields:
+            setattr(record, slot, row.get(key))
+        return record
+
+    @classmethod
+    def projection(cls):
+        return dict((key, True) for (_, key) in cls.fields)
+
+    @classmethod
+    def find(cls, spec=None, feed=DEFAULT_FEED):
+        cursor = cls.model_class._get_collection() \
+            .find(dict(spec or {}, feed=feed), cls.projection()) \
+            .batch_size(BATCH_SIZE)
+        return [cls.from_raw(row) for row in cursor]
+
+    def as_dict(self):
+        return dict((slot, getattr(self, slot)) for slot in self.__slots__)
+
+    def __eq__(self, other):
+        return type(other) is type(self) and \
+            all(getattr(other, slot) == getattr(self, slot)
+                for slot in self.__slots__)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__, ', '.join(
+            '%s=%r' % (slot, getattr(self, slot)) for slot in self.__slots__))
+
+
+class StopRecord(Record):
+    __slots__ = ('id', 'stop_id', 'code', 'name', 'desc', 'zone',
+                 'location_type', 'parent_station', 'wheelchair', 'lat', 'lon')
+
+    model_class = Stop
+    fields = (
+        ('id', '_id'),
+        ('stop_id', 'stop_id'),
+        ('code', 'code'),
+        ('name', 'name'),
+        ('desc', 'desc'),
+        ('zone', 'zone'),
+        ('location_type', 'location_type'),
+        ('parent_station', 'parent_station'),
+        ('wheelchair', 'wheelchair'),
+    )
+
+    @classmethod
+    def from_raw(cls, row):
+        record = super(StopRecord, cls).from_raw(row)
+        (record.lat, record.lon) = row.get('geopoint') or (None, None)
+        return record
+
+    @classmethod
+    def projection(cls):
+        projection = super(StopRecord, cls).projection()
+        projection['geopoint'] = True
+        return projection
+
+
+class RouteRecord(Record):
+    __slots__ = ('id', 'route_id', 'agency', 'short_name', 'long_name',
+                 'desc', 'route_type', 'url', 'color', 'text_color')
+
+    model_class = Route
+    fields = tuple((slot, '_id' if slot == 'id' else slot)
+                   for slot in __slots__)
+
+
+class TripRecord(Record):
+    __slots__ = ('id', 'trip_id', 'route', 'service', 'headsign',
+                 'direction', 'block', 'shapes', 'wheelchair', 'short_name')
+
+    model_class = Trip
+    fields = tuple((slot, '_id' if slot == 'id' else slot)
+                   for slot in __slots__)
+
+
+class StopTimeRecord(Record):
+    __slots__ = ('id', 'trip', 'stop', 'stop_sequence', 'arrival_time',
+                 'departure_time', 'headsign', 'pickup_type', 'drop_off_type',
+                 'shape_dist_traveled')
+
+    model_class = StopTime
+    fields = tuple((slot, '_id' if slot == 'id' else slot)
+                   for slot in __slots__)
+
+
+class CalendarRecord(Record):
+    __slots__ = ('id', 'service', 'monday', 'tuesday', 'wednesday',
+                 'thursday', 'friday', 'saturday', 'sunday', 'start_date',
+                 'end_date')
+
+    model_class = Calendar
+    fields = tuple((slot, '_id' if slot == 'id' else slot)
+                   for slot in __slots__)
+
+
+def stops(spec=None, feed=DEFAULT_FEED):
+    return StopRecord.find(spec, feed)
+
+
+def routes(spec=None, feed=DEFAULT_FEED):
+    return RouteRecord.find(spec, feed)
+
+
+def trips(spec=None, feed=DEFAULT_FEED):
+    return TripRecord.find(spec, feed)
+
+
+def stop_times(spec=None, feed=DEFAULT_FEED):
+    return StopTimeRecord.find(spec, feed)
+
+
+def calendars(spec=None, feed=DEFAULT_FEED):
+    return CalendarRecord.find(spec, feed)
@@ -0,0 +1,143 @@
+""" In-memory autocomplete index over stop names and codes.
+
+Names are matched accent and case insensitively on token prefixes, so
+"cristiano kra" finds "CRISTIANO KRAEMER 87". Every token prefix maps to a
+posting list kept sorted by a static rank (shorter names first), which lets a
+query stop as soon as it has enough results instead of ranking every match.
+
+"""
+import unicodedata
+from bisect import insort
+from mongoengine import signals
+from service.models import DEFAULT_FEED
+from service.models import Stop
+from service.versioned import VersionedByFeed
+
+DEFAULT_LIMIT = 10
+
+
+def normalize(text):
+    if not text:
+        return u''
+    if isinstance(text, bytes):
+        text = text.decode('utf-8')
+    decomposed = unicodedata.normalize('NFKD', text)
+    stripped = u''.join(char for char in decomposed
+                        if not unicodedata.combining(char))
+    return u''.join(char if char.isalnum() else u' '
+                    for char in stripped.lower())
+
+
+def _prefixes(token):
+    return [token[:length] for length in range(1, len(token) + 1)]
+
+
+class StopIndex(object):
+    def __init__(self):
+        self._stops = {}
+        # prefixes of the first name token and of the code
+        self._leading = {}
+        # prefixes of any name token, as sorted postings and as sets
+        self._anywhere = {}
+        self._anywhere_sets = {}
+
+    def __len__(self):
+        return len(self._stops)
+
+    def _keys(self, name, code):
+        tokens = normalize(name).split()
+        leading = set(_prefixes(tokens[0])) if tokens else set()
+        leading.update(_prefixes(normalize(code).replace(u' ', u'')))
+        anywhere = set()
+        for token in tokens:
+            anywhere.update(_prefixes(token))
+        return leading, anywhere
+
+    def add(self, stop_id, name, code=None):
+        if stop_id in self._stops:
+            self.remove(stop_id)
+        rank = (len(name or u''), normalize(name), stop_id)
+        (leading, anywhere) = self._keys(name, code)
+        self._stops[stop_id] = (rank, name, code, leading, anywhere)
+        for prefix in leading:
+            insort(self._leading.setdefault(prefix, []), (rank, stop_id))
+        for prefix in anywhere:
+            insort(self._anywhere.setdefault(prefix, []), (rank, stop_id))
+            self._anywhere_sets.setdefault(prefix, set()).add(stop_id)
+
+    def remove(self, stop_id):
+        entry = self._stops.pop(stop_id, None)
+        if entry is None:
+            return
+        (rank, name, code, leading, anywhere) = entry
+        for prefix in leading:
+            self._leading[prefix].remove((rank, stop_id))
+        for prefix in anywhere:
+            self._anywhere[prefix].remove((rank, stop_id))
+            self._anywhere_sets[prefix].discard(stop_id)
+
+    def search(self, query, limit=DEFAULT_LIMIT):
+        """Returns up to `limit` `(stop_id, name, code)` matching `query`.
+
+        Stops whose name (or code) starts with the first query token come
+        first, then stops having it anywhere in their name. Every other
+        query token must prefix some token of the name.
+        """
+        tokens = normalize(query).split()
+        if not tokens or limit <= 0:
+            return []
+        others = [self._anywhere_sets.get(token, ()) for token in tokens[1:]]
+        if not all(others):
+            return []
+
+        results = []
+        seen = set()
+        for postings in (self._leading.get(tokens[0], ()),
+                         self._anywhere.get(tokens[0], ())):
+            for (rank, stop_id) in postings:
+                if stop_id in seen:
+                    continue
+                if all(stop_id in other for other in others):
+                    seen.add(stop_id)
+                    (rank, name, code) = self._stops[stop_id][:3]
+                    results.append((stop_id, name, code))
+                    if len(results) == limit:
+                        return results
+        return results
+
+    @staticmethod
+    def build(feed=DEFAULT_FEED):
+        index = StopIndex()
+        cursor = Stop._get_collection().find(
+            {'feed': feed}, {'stop_id': True, 'name': True, 'code': True})
+        for row in cursor:
+            index.add(row['stop_id'], row.get('name'), row.get('code'))
+        return index
+
+
+_indexes = VersionedByFeed(StopIndex.build)
+
+
+def _built_index(feed):
+    holder = _indexes.feeds.get(feed)
+    return holder.value if holder is not None else None
+
+
+def _stop_saved(sender, document, **kwargs):
+    index = _built_index(document.feed)
+    if index is not None:
+        index.add(document.stop_id, document.name, document.code)
+
+
+def _stop_deleted(sender, document, **kwargs):
+    index = _built_index(document.feed)
+    if index is not None:
+        index.remove(document.stop_id)
+
+
+signals.post_save.connect(_stop_saved, sender=Stop)
+signals.post_delete.connect(_stop_deleted, sender=Stop)
+
+
+def autocomplete(query, limit=DEFAULT_LIMIT, feed=DEFAULT_FEED):
+    return _indexes.get(feed).search(query, limit)
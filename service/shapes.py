@@ -0,0 +1,163 @@
+""" Multi-resolution shape geometries.
+
+shapes.txt stores one :py:class:`service.models.Shape` document per point.
+Map clients only need as much detail as the zoom they render at, so each
+shape is simplified once per zoom level and stored as an encoded polyline in
+a single :py:class:`service.models.ShapeGeometry` document.
+
+Stop times missing their shape_dist_traveled get it by snapping the stops
+of their trip onto its shape, once for all the trips sharing the same stops
+and shape.
+
+"""
+from itertools import groupby
+from bson.dbref import DBRef
+from service.geometry import encode_polyline
+from service.geometry import shape_distances
+from service.geometry import simplify
+from service.geometry import snap_to_shape
+from service.models import DEFAULT_FEED
+from service.models import Shape
+from service.models import ShapeGeometry
+from service.models import ShapeLevel
+from service.models import Stop
+from service.models import StopTime
+from service.models import Trip
+
+# zoom levels a simplified geometry is built for, the last one is detailed
+# enough for street level maps
+ZOOM_LEVELS = (8, 11, 14, 17)
+
+BATCH_SIZE = 500
+UPDATE_BATCH_SIZE = 5000
+
+
+def _ref_id(value):
+    return value.id if isinstance(value, DBRef) else value
+
+
+def tolerance_for(zoom):
+    # half of a 256px tile pixel, in degrees
+    return 360.0 / (256 * 2 ** zoom) / 2
+
+
+def build_levels(points):
+    levels = []
+    for zoom in ZOOM_LEVELS:
+        tolerance = tolerance_for(zoom)
+        simplified = simplify(points, tolerance)
+        levels.append(ShapeLevel(zoom=zoom,
+                                 tolerance=tolerance,
+                                 polyline=encode_polyline(simplified),
+                                 points=len(simplified)))
+    return levels
+
+
+def shape_points(feed=DEFAULT_FEED):
+    """Yields `(shape_id, points)` for every shape of `feed`, points in
+    sequence."""
+    cursor = Shape._get_collection() \
+        .find({'feed': feed}, {'shape_id': True, 'geopoint': True}) \
+        .sort([('shape_id', 1), ('pt_sequence', 1)])
+    for (shape_id, rows) in groupby(cursor, lambda row: row['shape_id']):
+        yield shape_id, [tuple(row['geopoint']) for row in rows]
+
+
+def build_geometries(feed=DEFAULT_FEED):
+    ShapeGeometry._get_collection().remove({'feed': feed})
+    count = 0
+    batch = []
+    for (shape_id, points) in shape_points(feed):
+        batch.append(ShapeGeometry(feed=feed, shape_id=shape_id,
+                                   levels=build_levels(points)))
+        if len(batch) == BATCH_SIZE:
+            ShapeGeometry.objects.insert(batch, load_bulk=False)
+            batch = []
+        count += 1
+    if batch:
+        ShapeGeometry.objects.insert(batch, load_bulk=False)
+    return count
+
+
+def _trip_shapes(feed):
+    """Maps the trips of `feed` to the shape_id of their shape."""
+    first_points = dict(
+        (trip['_id'], _ref_id(trip['shapes'][0])) for trip in
+        Trip._get_collection().find({'feed': feed},
+                                    {'shapes': {'$slice': 1}})
+        if trip.get('shapes'))
+    shape_ids = dict((row['_id'], row['shape_id']) for row in
+                     Shape._get_collection().find(
+                         {'_id': {'$in': list(set(first_points.values()))}},
+                         {'shape_id': True}))
+    return dict((trip, shape_ids[point])
+                for (trip, point) in first_points.items()
+                if point in shape_ids)
+
+
+def _shape_path(feed, shape_id):
+    """Points of a shape and their distances, in the shape units when every
+    point has one, in meters otherwise."""
+    rows = list(Shape._get_collection()
+                .find({'feed': feed, 'shape_id': shape_id},
+                      {'geopoint': True, 'dist_traveled': True})
+                .sort('pt_sequence', 1))
+    points = [tuple(row['geopoint']) for row in rows]
+    distances = [row.get('dist_traveled') for row in rows]
+    if any(distance is None for distance in distances):
+        distances = shape_distances(points)
+    return points, distances
+
+
+def build_stop_distances(feed=DEFAULT_FEED):
+    """Fills the missing shape_dist_traveled of the stop times of `feed`,
+    returns how many were filled."""
+    geopoints = dict((stop['_id'], tuple(stop['geopoint'])) for stop in
+                     Stop._get_collection().find({'feed': feed},
+                                                 {'geopoint': True})
+                     if stop.get('geopoint'))
+    trip_shapes = _trip_shapes(feed)
+    paths = {}
+    # snapped distances per (stops, shape)
+    snapped = {}
+
+    collection = StopTime._get_collection()
+    cursor = collection \
+        .find({'feed': feed},
+              {'trip': True, 'stop': True, 'shape_dist_traveled': True}) \
+        .sort([('trip', 1), ('stop_sequence', 1)])
+    count = 0
+    bulk = collection.initialize_unordered_bulk_op()
+    pending = 0
+    for (trip, rows) in groupby(cursor, lambda row: _ref_id(row['trip'])):
+        rows = list(rows)
+        shape_id = trip_shapes.get(trip)
+        if shape_id is None or all(row.get('shape_dist_traveled') is not None
+                                   for row in rows):
+            continue
+        stops = tuple(_ref_id(row.get('stop')) for row in rows)
+        if not all(stop in geopoints for stop in stops):
+            continue
+
+        key = (stops, shape_id)
+        if key not in snapped:
+            if shape_id not in paths:
+                paths[shape_id] = _shape_path(feed, shape_id)
+            (points, distances) = paths[shape_id]
+            snapped[key] = snap_to_shape(
+                points, [geopoints[stop] for stop in stops], distances)
+
+        for (row, distance) in zip(rows, snapped[key]):
+            if row.get('shape_dist_traveled') is None:
+                bulk.find({'_id': row['_id']}).update(
+                    {'$set': {'shape_dist_traveled':
+                              round(float(distance), 2)}})
+                pending += 1
+                count += 1
+        if pending >= UPDATE_BATCH_SIZE:
+            bulk.execute()
+            bulk = collection.initialize_unordered_bulk_op()
+            pending = 0
+    if pending:
+        bulk.execute()
+    return count
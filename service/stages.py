@@ -0,0 +1,95 @@
+""" Load-time stages.
+
+Stages derive data from documents already loaded by the parsers. They run
+after every parser, in the order of :py:data:`STAGE_CLASSES`, each one in
+its own `runstage` process. A stage only reads and replaces the documents
+of one feed, so feeds can be loaded concurrently.
+
+"""
+from collections import OrderedDict
+from service import adjacency
+from service import interpolation
+from service import patterns
+from service import shapes
+from service import transfers
+from service.models import DEFAULT_FEED
+
+
+class StageException(Exception):
+    pass
+
+
+class BaseStage(object):
+    def __init__(self, description):
+        self.description = description
+
+    def run(self, feed=DEFAULT_FEED):
+        raise StageException('Stage methods not implemented.')
+
+
+class StopDistancesStage(BaseStage):
+    def __init__(self):
+        BaseStage.__init__(self, 'stop distances along shapes')
+
+    def run(self, feed=DEFAULT_FEED):
+        return shapes.build_stop_distances(feed)
+
+
+class StopTimeInterpolationStage(BaseStage):
+    def __init__(self):
+        BaseStage.__init__(self, 'interpolated stop times')
+
+    def run(self, feed=DEFAULT_FEED):
+        return interpolation.interpolate_stop_times(feed)
+
+
+class ShapeGeometriesStage(BaseStage):
+    def __init__(self):
+        BaseStage.__init__(self, 'simplified shape geometries')
+
+    def run(self, feed=DEFAULT_FEED):
+        return shapes.build_geometries(feed)
+
+
+class WalkingTransfersStage(BaseStage):
+    def __init__(self):
+        BaseStage.__init__(self, 'walking transfers')
+
+    def run(self, feed=DEFAULT_FEED):
+        return transfers.build_transfers(feed)
+
+
+class TripPatternsStage(BaseStage):
+    def __init__(self):
+        BaseStage.__init__(self, 'trip patterns')
+
+    def run(self, feed=DEFAULT_FEED):
+        return patterns.build_patterns(feed)
+
+
+class RouteAdjacencyStage(BaseStage):
+    def __init__(self):
+        BaseStage.__init__(self, 'stop and route adjacency entries')
+
+    def run(self, feed=DEFAULT_FEED):
+        return adjacency.build_adjacency(feed)
+
+
+STAGE_CLASSES = OrderedDict([
+    ('stop_distances', StopDistancesStage),
+    ('stop_time_interpolation', StopTimeInterpolationStage),
+    ('shape_geometries', ShapeGeometriesStage),
+    ('walking_transfers', WalkingTransfersStage),
+    ('trip_patterns', TripPatternsStage),
+    ('route_adjacency', RouteAdjacencyStage),
+])
+
+# stages to rerun when a single file is reloaded on its own
+DEPENDENT_STAGES = {
+    'stops': ['walking_transfers', 'route_adjacency'],
+    'shapes': ['stop_distances', 'shape_geometries'],
+    'trips': ['stop_distances', 'trip_patterns', 'route_adjacency'],
+    'frequencies': ['trip_patterns'],
+    'stop_times': ['stop_distances', 'stop_time_interpolation',
+                   'trip_patterns', 'route_adjacency'],
+}
@@ -0,0 +1,28 @@
+from django.test import TestCase
+from service.adjacency import *
+
+
+class MergeSequencesTest(TestCase):
+    def test_longest_sequence_gives_order(self):
+        actual = merge_sequences([['B', 'C'], ['A', 'B', 'C', 'D']])
+        self.assertEqual(actual, ['A', 'B', 'C', 'D'])
+
+    def test_extra_stops_follow_their_predecessor(self):
+        actual = merge_sequences([['A', 'B', 'C'], ['A', 'X', 'C']])
+        self.assertEqual(actual, ['A', 'X', 'B', 'C'])
+
+
+class AdjacencyTest(TestCase):
+    def test_both_directions_are_built(self):
+        patterns = [
+            ('T1', 0, ['A', 'B', 'C']),
+            ('T1', 1, ['C', 'B', 'A']),
+            ('180', 0, ['B', 'D']),
+            ('T1', 0, ['A', 'B']),
+        ]
+        (route_stops, stop_routes) = adjacency(patterns)
+
+        self.assertEqual(route_stops[('T1', 0)], ['A', 'B', 'C'])
+        self.assertEqual(route_stops[('T1', 1)], ['C', 'B', 'A'])
+        self.assertEqual(stop_routes['B'], {'0': ['180', 'T1'], '1': ['T1']})
+        self.assertEqual(stop_routes['D'], {'0': ['180']})
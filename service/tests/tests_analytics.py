@@ -0,0 +1,69 @@
+import numpy
+from django.test import TestCase
+from service.analytics import *
+
+NAN = numpy.nan
+
+
+class RouteMetricsTest(TestCase):
+    def setUp(self):
+        # route 0 runs both ways every 20 minutes from 6:00, route 1 has no
+        # stop times and only a trip_time, route 2 does not run at all
+        self.timetable = Timetable(
+            route_ids=['A', 'B', 'C'],
+            service_ids=['WEEK', 'SUNDAY'],
+            routes=[0, 0, 0, 0, 1, 1],
+            directions=[0, 0, 0, 1, NO_DIRECTION, NO_DIRECTION],
+            services=[0, 0, 0, 0, 0, 1],
+            starts=[21600, 22800, 24000, 22000, NAN, NAN],
+            durations=[1800, 1800, 2400, 1800, 3180, 3180],
+        )
+
+    def test_metrics_of_routes_with_stop_times(self):
+        metric = self.timetable.route_metrics()[0]
+        self.assertEqual(metric['route_id'], 'A')
+        self.assertEqual(metric['trips'], 4)
+        self.assertEqual(metric['trips_per_hour'][6], 4)
+        self.assertEqual(metric['average_headway'], 1200)
+        self.assertEqual(metric['first_departure'], 21600)
+        self.assertEqual(metric['last_arrival'], 26400)
+        self.assertEqual(metric['span'], 4800)
+        self.assertEqual(metric['vehicle_hours'], 2.17)
+
+    def test_trips_without_stop_times_only_count_their_trip_time(self):
+        metric = self.timetable.route_metrics()[1]
+        self.assertEqual(metric['route_id'], 'B')
+        self.assertEqual(metric['trips'], 2)
+        self.assertEqual(sum(metric['trips_per_hour']), 0)
+        self.assertIsNone(metric['average_headway'])
+        self.assertIsNone(metric['span'])
+        self.assertEqual(metric['vehicle_hours'], 1.77)
+
+    def test_routes_without_runs_are_left_out(self):
+        self.assertEqual([metric['route_id'] for metric
+                          in self.timetable.route_metrics()], ['A', 'B'])
+
+    def test_runs_of_inactive_services_are_left_out(self):
+        timetable = self.timetable.running(set(['SUNDAY']))
+        self.assertEqual(len(timetable), 1)
+        self.assertEqual(timetable.route_metrics()[0]['trips'], 1)
+
+    def test_departures_and_arrivals_are_formatted(self):
+        metric = formatted(self.timetable.route_metrics()[0])
+        self.assertEqual(metric['first_departure'], '06:00:00')
+        self.assertEqual(metric['last_arrival'], '07:20:00')
+
+
+class HeadwaysTest(TestCase):
+    def test_headways_do_not_mix_directions(self):
+        headways = average_headways(numpy.array([0, 0, 0, 0]),
+                                    numpy.array([0, 1, 0, 1]),
+                                    numpy.array([0.0, 60.0, 600.0, 660.0]), 1)
+        self.assertEqual(headways.tolist(), [600.0])
+
+    def test_single_departures_have_no_headway(self):
+        headways = average_headways(numpy.array([0, 1, 1]),
+                                    numpy.array([0, 0, 0]),
+                                    numpy.array([0.0, 0.0, 300.0]), 2)
+        self.assertTrue(numpy.isnan(headways[0]))
+        self.assertEqual(headways[1], 300.0)
@@ -0,0 +1,28 @@
+from datetime import date
+from datetime import datetime
+from django.test import TestCase
+from service.calendars import *
+
+
+class ActiveServicesTest(TestCase):
+    def setUp(self):
+        week = dict((weekday, '1') for weekday in WEEKDAYS[:5])
+        weekend = dict((weekday, '1') for weekday in WEEKDAYS[5:])
+        week.update(service='FULLW', start_date=datetime(2007, 1, 1),
+                    end_date=datetime(2010, 12, 31))
+        weekend.update(service='WE', start_date=datetime(2007, 1, 1),
+                       end_date=datetime(2010, 12, 31))
+        self.calendars = [week, weekend]
+
+    def test_services_follow_weekdays(self):
+        actual = active_services(date(2007, 6, 2), self.calendars, {})
+        self.assertEqual(actual, set(['WE']))
+
+    def test_services_outside_range_are_inactive(self):
+        actual = active_services(date(2011, 6, 1), self.calendars, {})
+        self.assertEqual(actual, set())
+
+    def test_exceptions_add_and_remove_services(self):
+        exceptions = {'FULLW': SERVICE_REMOVED, 'EXTRA': SERVICE_ADDED}
+        actual = active_services(date(2007, 6, 4), self.calendars, exceptions)
+        self.assertEqual(actual, set(['EXTRA']))
@@ -0,0 +1,66 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import zipfile
+from datetime import datetime
+from django.test import TestCase
+from service.export import *
+
+
+class GtfsFileTest(TestCase):
+    def setUp(self):
+        self.stops = Reference(Stop, 'stop_id')
+        self.stops.values = {'s1': 'A'}
+        self.subject = GtfsFile('stop_times.txt', StopTime, [
+            ('trip_id', 'trip_id', None),
+            ('arrival_time', 'arrival_time', gtfs_time),
+            ('stop_id', 'stop', self.stops),
+            ('stop_lat', 'geopoint', latitude),
+            ('stop_headsign', 'headsign', None),
+        ], sort=[('_id', 1)])
+
+    def test_row_formats_gtfs_values(self):
+        row = self.subject.row({
+            'trip_id': 'T1',
+            'arrival_time': datetime(1900, 1, 1, 7, 5),
+            'stop': 's1',
+            'geopoint': [-30.1, -51.2],
+            'headsign': u'Centro Hist\xf3rico',
+        })
+        self.assertEqual(row, ['T1', '07:05:00', 'A', '-30.1',
+                               'Centro Hist\xc3\xb3rico'])
+
+    def test_missing_values_are_empty(self):
+        row = self.subject.row({'trip_id': 'T1', 'stop': 'unknown'})
+        self.assertEqual(row, ['T1', '', '', '', ''])
+
+
+class WriteArchiveTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.source = os.path.join(self.directory, 'stops.csv')
+        with open(self.source, 'wb') as output:
+            output.write('stop_id,stop_name\r\nA,Centro\r\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _digest(self, name):
+        path = os.path.join(self.directory, name)
+        write_archive(path, [('stops.txt', self.source)])
+        with open(path, 'rb') as archive:
+            return hashlib.sha1(archive.read()).hexdigest()
+
+    def test_archives_are_byte_identical(self):
+        first = self._digest('first.zip')
+        os.utime(self.source, None)
+        self.assertEqual(self._digest('second.zip'), first)
+
+    def test_entries_have_fixed_timestamp(self):
+        self._digest('feed.zip')
+        archive = zipfile.ZipFile(os.path.join(self.directory, 'feed.zip'))
+        self.assertEqual(archive.getinfo('stops.txt').date_time,
+                         ZIP_DATE_TIME)
+        self.assertEqual(archive.read('stops.txt'),
+                         'stop_id,stop_name\r\nA,Centro\r\n')
@@ -0,0 +1,45 @@
+import os
+import shutil
+import tempfile
+from django.test import TestCase
+from service.extsort import *
+
+
+class ExternalSortTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.rows = [{'trip_id': trip_id, 'stop_sequence': str(sequence)}
+                     for sequence in range(3)
+                     for trip_id in ('T3', 'T1', 'T2')]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _trip_id(self, row):
+        return row['trip_id']
+
+    def test_sort_in_memory(self):
+        subject = ExternalSorter(self._trip_id, directory=self.directory)
+        actual = list(subject.sort(iter(self.rows)))
+        self.assertEqual([row['trip_id'] for row in actual],
+                         ['T1'] * 3 + ['T2'] * 3 + ['T3'] * 3)
+        self.assertEqual(subject.runs, 0)
+
+    def test_sort_spills_runs_and_removes_them(self):
+        subject = ExternalSorter(self._trip_id, memory_budget=1,
+                                 directory=self.directory)
+        actual = list(subject.sort(iter(self.rows)))
+        self.assertEqual(actual, sorted(self.rows, key=self._trip_id))
+        self.assertEqual(subject.runs, len(self.rows))
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_sorted_groups(self):
+        groups = sorted_groups(
+            reversed(self.rows), self._trip_id,
+            order=lambda row: int(row['stop_sequence']),
+            memory_budget=1000, directory=self.directory)
+        self.assertEqual(
+            [(trip_id, [row['stop_sequence'] for row in rows])
+             for (trip_id, rows) in groups],
+            [('T1', ['0', '1', '2']), ('T2', ['0', '1', '2']),
+             ('T3', ['0', '1', '2'])])
@@ -0,0 +1,74 @@
+from django.test import TestCase
+from service.fares import *
+
+
+class FareTableTest(TestCase):
+    def setUp(self):
+        self.subject = FareTable(
+            fares=[
+                FareClass('local', 1.75, 'USD', transfers=0),
+                FareClass('zonal', 3.50, 'USD', transfers=1,
+                          transfer_duration=3600),
+                FareClass('express', 5.00, 'USD', transfers=0),
+                FareClass('grt', 2.00, 'USD', transfers=0),
+            ],
+            rules=[
+                ('local', ANY, '1', '1', ANY),
+                ('zonal', ANY, ANY, ANY, ANY),
+                ('express', 'EXP', ANY, ANY, ANY),
+                ('grt', 'GRT', ANY, ANY, '5'),
+                ('grt', 'GRT', ANY, ANY, '6'),
+            ],
+            stop_zones={'A': '1', 'B': '1', 'C': '2', 'D': '5', 'E': '6'},
+        )
+
+    def test_cheapest_fare_of_the_zones_comes_first(self):
+        fares = self.subject.fares_of(Leg('10', '1', '1'))
+        self.assertEqual([fare.fare_id for fare in fares],
+                         ['local', 'zonal'])
+
+    def test_unnamed_zones_only_take_wildcard_rules(self):
+        fares = self.subject.fares_of(Leg('10', '1', '9'))
+        self.assertEqual([fare.fare_id for fare in fares], ['zonal'])
+
+    def test_route_rules_only_hold_on_their_route(self):
+        self.assertEqual([fare.fare_id for fare in
+                          self.subject.fares_of(Leg('EXP', '2', '2'))],
+                         ['zonal', 'express'])
+        self.assertNotIn('express', [fare.fare_id for fare in
+                                     self.subject.fares_of(Leg('10', '2',
+                                                               '2'))])
+
+    def test_contains_rules_need_every_zone(self):
+        leg = self.subject.leg('GRT', 'D', 'E', stops=['D', 'E'])
+        self.assertEqual(self.subject.fares_of(leg)[0].fare_id, 'grt')
+        leg = self.subject.leg('GRT', 'D', 'C', stops=['D', 'E', 'C'])
+        self.assertEqual([fare.fare_id for fare in
+                          self.subject.fares_of(leg)], ['zonal'])
+
+    def test_fares_without_rules_hold_everywhere(self):
+        table = FareTable([FareClass('tarifa', 2.80, 'BRL', transfers=0)],
+                          [])
+        self.assertEqual(table.price([Leg('T1', ANY, ANY)]), 2.80)
+
+    def test_journeys_transfer_on_the_same_ticket(self):
+        legs = [Leg('10', '1', '2', departure=0),
+                Leg('20', '2', '3', departure=1800)]
+        self.assertEqual(self.subject.price(legs), 3.50)
+
+    def test_transfers_expire(self):
+        legs = [Leg('10', '1', '2', departure=0),
+                Leg('20', '2', '3', departure=7200)]
+        self.assertEqual(self.subject.price(legs), 7.00)
+
+    def test_transfers_are_limited(self):
+        legs = [Leg('10', '1', '2', departure=0),
+                Leg('20', '2', '3', departure=600),
+                Leg('30', '3', '4', departure=1200)]
+        self.assertEqual([ticket.fare_id for ticket
+                          in self.subject.tickets(legs)], ['zonal', 'zonal'])
+
+    def test_journeys_with_a_leg_without_fare_have_no_price(self):
+        table = FareTable([FareClass('express', 5.00)],
+                          [('express', 'EXP', ANY, ANY, ANY)])
+        self.assertIsNone(table.price([Leg('10', ANY, ANY)]))
@@ -0,0 +1,65 @@
+from datetime import datetime
+from django.test import TestCase
+from service.frequencies import *
+from service.frequencies import _offsets
+from service.times import parse_time
+
+
+class HeadwayTripTest(TestCase):
+    def setUp(self):
+        offsets = [('A', 0, 0), ('B', 300, 360), ('C', 900, 900)]
+        periods = [
+            (parse_time('6:00:00'), parse_time('7:00:00'), 1800),
+            (parse_time('7:00:00'), parse_time('8:00:00'), 1200),
+        ]
+        self.subject = HeadwayTrip('STBA', periods, offsets)
+
+    def test_starts_are_generated_inside_window(self):
+        actual = list(self.subject.starts(parse_time('6:10:00'),
+                                          parse_time('7:30:00')))
+        expected = [parse_time('6:30:00'), parse_time('7:00:00'),
+                    parse_time('7:20:00')]
+        self.assertEqual(actual, expected)
+
+    def test_starts_stop_at_period_end(self):
+        actual = list(self.subject.starts(parse_time('7:50:00'),
+                                          parse_time('23:00:00')))
+        self.assertEqual(actual, [])
+
+    def test_departures_at_stop_include_offset(self):
+        actual = list(self.subject.departures_at(1, parse_time('6:00:00'),
+                                                 parse_time('6:40:00')))
+        expected = [(parse_time('6:00:00'), parse_time('6:06:00')),
+                    (parse_time('6:30:00'), parse_time('6:36:00'))]
+        self.assertEqual(actual, expected)
+
+    def test_instances_are_concrete_trips(self):
+        (start, stop_times) = next(self.subject.instances(
+            parse_time('6:00:00'), parse_time('6:01:00')))
+        self.assertEqual(start, parse_time('6:00:00'))
+        self.assertEqual(stop_times[-1],
+                         ('C', parse_time('6:15:00'), parse_time('6:15:00')))
+
+
+class OffsetsTest(TestCase):
+    def test_offsets_start_at_the_first_known_time(self):
+        rows = [
+            {'stop': 'A', 'stop_sequence': 1, 'arrival_time': None,
+             'departure_time': None},
+            {'stop': 'B', 'stop_sequence': 2,
+             'arrival_time': datetime(2014, 1, 1, 6, 5),
+             'departure_time': datetime(2014, 1, 1, 6, 6)},
+            {'stop': 'C', 'stop_sequence': 3, 'arrival_time': None,
+             'departure_time': None},
+        ]
+        self.assertEqual(_offsets(rows), [('A', 0, 0), ('B', 0, 60),
+                                          ('C', 60, 60)])
+
+    def test_trips_without_times_have_no_offsets(self):
+        rows = [{'stop': 'A', 'stop_sequence': 1}]
+        self.assertIsNone(_offsets(rows))
+
+    def test_templates_can_be_made_from_pattern_times(self):
+        trip = HeadwayTrip.from_times('F1', [], ['A', 'B'],
+                                      [21500, 21600, 21900, 21960])
+        self.assertEqual(trip.offsets, [('A', -100, 0), ('B', 300, 360)])
@@ -0,0 +1,62 @@
+from django.test import TestCase
+from service.geometry import *
+
+
+class PolylineTest(TestCase):
+    def test_polyline_can_be_encoded(self):
+        points = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+        actual = encode_polyline(points)
+        self.assertEqual(actual, '_p~iF~ps|U_ulLnnqC_mqNvxq`@')
+
+    def test_polyline_can_be_decoded(self):
+        actual = decode_polyline('_p~iF~ps|U_ulLnnqC_mqNvxq`@')
+        expected = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+        self.assertEqual(actual, expected)
+
+
+class SimplifyTest(TestCase):
+    def test_simplify_drops_collinear_points(self):
+        points = [(-30.0, -51.0), (-30.0, -51.1), (-30.0, -51.2)]
+        actual = simplify(points, 0.0001)
+        self.assertEqual(actual, [(-30.0, -51.0), (-30.0, -51.2)])
+
+    def test_simplify_keeps_points_beyond_tolerance(self):
+        points = [(-30.0, -51.0), (-30.1, -51.1), (-30.0, -51.2)]
+        actual = simplify(points, 0.0001)
+        self.assertEqual(actual, points)
+
+    def test_simplify_keeps_short_shapes(self):
+        points = [(-30.0, -51.0), (-30.1, -51.1)]
+        self.assertEqual(simplify(points, 1), points)
+
+
+class SnapToShapeTest(TestCase):
+    def setUp(self):
+        # an out and back shape along both sides of the same street
+        self.points = [(-30.0, -51.0), (-30.0, -51.01), (-29.9998, -51.01),
+                       (-29.9998, -51.0)]
+        self.distances = [0.0, 1.0, 1.1, 2.1]
+
+    def test_stops_are_snapped_in_travel_order(self):
+        stops = [(-30.0001, -51.002), (-30.0001, -51.008),
+                 (-29.9997, -51.008), (-29.9997, -51.002)]
+        actual = snap_to_shape(self.points, stops, self.distances)
+        self.assertEqual([round(value, 1) for value in actual],
+                         [0.2, 0.8, 1.3, 1.9])
+
+    def test_stops_on_a_shared_stretch_keep_their_order(self):
+        stops = [(-30.0001, -51.008), (-29.9999, -51.002)]
+        actual = snap_to_shape(self.points[:2] + self.points[:1], stops,
+                               [0.0, 1.0, 2.0])
+        self.assertLess(actual[0], actual[1])
+        self.assertAlmostEqual(actual[1], 1.8)
+
+    def test_distances_default_to_meters(self):
+        actual = snap_to_shape(self.points[:2], [(-30.0, -51.005)])
+        self.assertAlmostEqual(actual[0], 481.6, delta=1.0)
+
+    def test_distances_never_decrease(self):
+        stops = [(-30.0, -51.005), (-30.0, -51.004)]
+        actual = snap_to_shape(self.points[:2], stops, self.distances[:2])
+        self.assertAlmostEqual(actual[0], 0.5)
+        self.assertEqual(actual[1], actual[0])
@@ -0,0 +1,30 @@
+from bson.dbref import DBRef
+from django.test import TestCase
+from service.identity import *
+
+
+class DocumentIdTest(TestCase):
+    def test_ids_are_deterministic(self):
+        self.assertEqual(document_id('default', Stop, 'S1'),
+                         document_id('default', Stop, u'S1'))
+
+    def test_ids_depend_on_feed_and_entity_type(self):
+        ids = set([document_id('default', Stop, 'S1'),
+                   document_id('other', Stop, 'S1'),
+                   document_id('default', Route, 'S1')])
+        self.assertEqual(len(ids), 3)
+
+    def test_key_parts_are_not_concatenated(self):
+        self.assertNotEqual(document_id('default', Shape, 'A1', '2'),
+                            document_id('default', Shape, 'A', '12'))
+
+    def test_natural_id_follows_references(self):
+        trip = reference('default', Trip, 'T1')
+        self.assertEqual(
+            natural_id('default', StopTime,
+                       {'trip': trip, 'stop_sequence': '3', 'stop': None}),
+            document_id('default', StopTime, trip.id, '3'))
+
+    def test_reference(self):
+        self.assertEqual(reference('default', Trip, 'T1'),
+                         DBRef('trip', document_id('default', Trip, 'T1')))
@@ -0,0 +1,97 @@
+import numpy
+from django.test import TestCase
+from service import interpolation
+from service.interpolation import *
+
+NAN = numpy.nan
+
+
+class InterpolateTest(TestCase):
+    def setUp(self):
+        self.trips = numpy.array([0, 0, 0, 0, 1, 1, 1])
+        self.distances = numpy.array([0.0, 100.0, 300.0, 400.0,
+                                      0.0, 50.0, 50.0])
+        self.arrivals = numpy.array([NAN, NAN, NAN, 1000.0,
+                                     2000.0, NAN, NAN])
+        self.departures = numpy.array([600.0, NAN, NAN, 1000.0,
+                                       2000.0, NAN, NAN])
+
+    def test_untimed_stops_follow_distance(self):
+        (arrivals, departures) = interpolate(self.trips, self.distances,
+                                             self.arrivals, self.departures)
+        self.assertEqual(arrivals[:4].tolist(), [600, 700, 900, 1000])
+        self.assertEqual(departures[:4].tolist(), [600, 700, 900, 1000])
+
+    def test_stops_after_the_last_timed_one_stay_untimed(self):
+        (arrivals, _) = interpolate(self.trips, self.distances,
+                                    self.arrivals, self.departures)
+        self.assertEqual(arrivals[4], 2000)
+        self.assertTrue(numpy.isnan(arrivals[5:]).all())
+
+    def test_same_distance_falls_back_to_positions(self):
+        (arrivals, _) = interpolate([0, 0, 0, 0], [0.0, 0.0, 0.0, 0.0],
+                                    [0.0, NAN, NAN, 90.0],
+                                    [0.0, NAN, NAN, 90.0])
+        self.assertEqual(arrivals.tolist(), [0, 30, 60, 90])
+
+
+class InterpolateJobsTest(TestCase):
+    def setUp(self):
+        self.stops = {'A': (-30.0, -51.0), 'B': (-30.001, -51.0),
+                      'C': (-30.003, -51.0)}
+        self.trips = [
+            [{'_id': 1, 'stop': 'A', 'arrival_time': 600,
+              'departure_time': 600},
+             {'_id': 2, 'stop': 'B'},
+             {'_id': 3, 'stop': 'C', 'arrival_time': 900,
+              'departure_time': 900}],
+            [{'_id': 4, 'stop': 'A', 'arrival_time': 1200,
+              'departure_time': 1260},
+             {'_id': 5, 'stop': 'C'}],
+            [{'_id': 6, 'stop': 'C', 'arrival_time': 1800},
+             {'_id': 7, 'stop': 'B'},
+             {'_id': 8, 'stop': 'A', 'arrival_time': 2100}],
+        ]
+
+    def _filled(self, processes=1):
+        return [(ids, arrivals.tolist(), departures.tolist())
+                for (ids, arrivals, departures) in interpolate_jobs(
+                    trip_jobs(self.trips, self.stops), processes)]
+
+    def test_jobs_hold_whole_trips(self):
+        rows_per_job = interpolation.ROWS_PER_JOB
+        interpolation.ROWS_PER_JOB = 2
+        try:
+            jobs = list(trip_jobs(self.trips, self.stops))
+        finally:
+            interpolation.ROWS_PER_JOB = rows_per_job
+        self.assertEqual([job[0] for job in jobs],
+                         [[1, 2, 3], [4, 5], [6, 7, 8]])
+
+    def test_jobs_give_the_times_of_the_untimed_stops(self):
+        # the last stop of the second trip comes after its last time point
+        self.assertEqual(self._filled(), [
+            ([2, 6, 7, 8], [700.0, 1800.0, 2000.0, 2100.0],
+             [700.0, 1800.0, 2000.0, 2100.0])])
+
+    def test_smaller_jobs_give_the_same_times(self):
+        rows_per_job = interpolation.ROWS_PER_JOB
+        interpolation.ROWS_PER_JOB = 2
+        try:
+            actual = self._filled()
+        finally:
+            interpolation.ROWS_PER_JOB = rows_per_job
+        self.assertEqual([ids for (ids, _, _) in actual],
+                         [[2], [], [6, 7, 8]])
+        self.assertEqual(actual[2][1], [1800.0, 2000.0, 2100.0])
+
+
+class TripDistancesTest(TestCase):
+    def test_shape_distances_are_used_when_complete(self):
+        actual = trip_distances(
+            numpy.array([0, 0, 1, 1]),
+            numpy.array([-30.0, -30.001, -30.0, -30.001]),
+            numpy.array([-51.0, -51.0, -51.0, -51.0]),
+            [0.0, 5.0, NAN, 5.0])
+        self.assertEqual(actual[:2].tolist(), [0.0, 5.0])
+        self.assertAlmostEqual(actual[3] - actual[2], 111.2, delta=0.5)
@@ -0,0 +1,59 @@
+from collections import namedtuple
+from django.test import TestCase
+from service.memory import *
+
+MemoryInfo = namedtuple('MemoryInfo', 'rss')
+
+
+class Parser(object):
+    def __init__(self):
+        self.cache_size = 1000
+
+
+class MemoryBudgetTest(TestCase):
+    def setUp(self):
+        self.parser = Parser()
+        self.subject = MemoryBudget(max_rss=100 * MEGABYTE, check_interval=2)
+        self.subject.register(self.parser, 'cache_size', minimum=300)
+
+    def _sample(self, rss):
+        self.subject._process.memory_info = lambda: MemoryInfo(rss)
+        self.subject.tick()
+        self.subject.tick()
+
+    def test_capacities_shrink_over_budget(self):
+        self._sample(95 * MEGABYTE)
+        self.assertEqual(self.parser.cache_size, 500)
+        self._sample(99 * MEGABYTE)
+        self.assertEqual(self.parser.cache_size, 300)
+        self.assertEqual([str(throttling) for throttling
+                          in self.subject.throttlings],
+                         ['[Parser.cache_size] reduced from [1000] to [500] '
+                          'at line [2], RSS [95 MB]',
+                          '[Parser.cache_size] reduced from [500] to [300] '
+                          'at line [4], RSS [99 MB]'])
+
+    def test_capacities_shrink_only_while_memory_grows(self):
+        self._sample(95 * MEGABYTE)
+        self._sample(94 * MEGABYTE)
+        self.assertEqual(self.parser.cache_size, 500)
+
+    def test_capacities_grow_back_under_budget(self):
+        self._sample(95 * MEGABYTE)
+        self._sample(10 * MEGABYTE)
+        self._sample(10 * MEGABYTE)
+        self.assertEqual(self.parser.cache_size, 1000)
+        self.assertEqual(self.subject.peak_rss, 95 * MEGABYTE)
+
+    def test_sorted_lines_are_counted_apart(self):
+        self.subject._process.memory_info = lambda: MemoryInfo(95 * MEGABYTE)
+        self.subject.tick()
+        self.subject.tick()
+        self.subject.tick_sorted()
+        self.subject._process.memory_info = lambda: MemoryInfo(99 * MEGABYTE)
+        self.subject.tick_sorted()
+        self.assertEqual((self.subject.lines, self.subject.sorted_lines),
+                         (2, 2))
+        self.assertEqual(str(self.subject.throttlings[-1]),
+                         '[Parser.cache_size] reduced from [500] to [300] '
+                         'at line [2], sorted line [2], RSS [99 MB]')
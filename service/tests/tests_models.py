@@ -1,3 +1,20 @@
 from django.test import TestCase
+from service.models import *
 
-# Create your tests here.
+
+class LegacyIndexesTest(TestCase):
+    def setUp(self):
+        self.collection = Stop._get_collection()
+        if 'stop_id_1' not in self.collection.index_information():
+            self.collection.create_index('stop_id', unique=True)
+
+    def test_legacy_indexes_are_replaced_by_per_feed_ones(self):
+        dropped = drop_legacy_indexes()
+        self.assertIn('%s.stop_id_1' % self.collection.name, dropped)
+        indexes = self.collection.index_information()
+        self.assertNotIn('stop_id_1', indexes)
+        self.assertTrue(indexes['feed_1_stop_id_1'].get('unique'))
+
+    def test_upgrades_can_be_repeated(self):
+        drop_legacy_indexes()
+        self.assertEqual(drop_legacy_indexes(), [])
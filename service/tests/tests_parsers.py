@@ -1,4 +1,7 @@
 from django.test import TestCase
+from django.test.utils import override_settings
+from service.identity import document_id
+from service.models import *
 from service.parsers import *
 
 ROOT_DIR = 'service/tests/data/sample-feed'
@@ -251,6 +254,151 @@ class CalendarDatesParserTest(TestCase):
         self.assertRaises(ParserException, self.subject.parse, line)
 
 
+class FareAttributesParserTest(TestCase):
+    def setUp(self):
+        PaymentMethod(name='Fare is paid on board.', vale=0).save()
+        self.subject = FareAttributesParser()
+
+    def test_fare_attributes_can_be_parsed(self):
+        line = {
+            'fare_id': 'tarifa',
+            'price': '2.80',
+            'currency_type': 'BRL',
+            'payment_method': '0',
+            'transfers': '0',
+        }
+        (actual, created) = self.subject.parse(line)
+
+        self.assertEqual(actual.fare, Fare.objects.get(fare_id='tarifa'))
+        self.assertEqual(actual.price, 2.8)
+        self.assertEqual(actual.currency, 'BRL')
+        self.assertEqual(actual.payment_method,
+                         PaymentMethod.objects.get(vale=0))
+        self.assertEqual(actual.transfers, 0)
+
+    def test_fare_attributes_allow_unlimited_transfers(self):
+        line = {
+            'fare_id': 'tarifa',
+            'price': '2.80',
+            'currency_type': 'BRL',
+            'payment_method': '0',
+            'transfers': '',
+            'transfer_duration': '3600',
+        }
+        (actual, created) = self.subject.parse(line)
+        self.assertIsNone(actual.transfers)
+        self.assertEqual(actual.transfer_duration, 3600)
+
+    def test_fare_attributes_detect_invalid_price(self):
+        line = {
+            'fare_id': 'tarifa',
+            'price': 'free',
+            'currency_type': 'BRL',
+            'payment_method': '0',
+        }
+        self.assertRaises(ParserException, self.subject.parse, line)
+
+
+class FareRulesParserTest(TestCase):
+    def setUp(self):
+        RouteType(name='one', description='desc', value=3).save()
+        Route(
+            route_id='AB',
+            short_name='10',
+            long_name='Airport - Bullfrog',
+            route_type=RouteType.objects.get(value=3),
+        ).save()
+        self.subject = FareRulesParser()
+
+    def test_fare_rules_can_be_parsed(self):
+        line = {
+            'fare_id': 'b',
+            'route_id': 'AB',
+            'origin_id': '3',
+            'destination_id': '4',
+        }
+        (actual, created) = self.subject.parse(line)
+
+        self.assertEqual(actual.fare, Fare.objects.get(fare_id='b'))
+        self.assertEqual(actual.route, Route.objects.get(route_id='AB'))
+        self.assertEqual(actual.origin, Zone.objects.get(zone_id='3'))
+        self.assertEqual(actual.destination, Zone.objects.get(zone_id='4'))
+        self.assertIsNone(actual.contains)
+
+    def test_fare_rules_detect_invalid_route(self):
+        line = {
+            'fare_id': 'b',
+            'route_id': 'XX',
+        }
+        self.assertRaises(ParserException, self.subject.parse, line)
+
+
+class FrequenciesParserTest(TestCase):
+    def setUp(self):
+        self.fixture()
+        self.subject = FrequenciesParser()
+
+    def fixture(self):
+        RouteType(name='one', description='desc', value=3).save()
+        Service(service_id='FULLW').save()
+        Route(
+            route_id='AB',
+            short_name='10',
+            long_name='Airport - Bullfrog',
+            route_type=RouteType.objects.get(value=3),
+        ).save()
+        Trip(
+            trip_id='STBA',
+            route=Route.objects.get(route_id='AB'),
+            service=Service.objects.get(service_id='FULLW'),
+        ).save()
+
+    def test_frequencies_can_be_parsed(self):
+        line = {
+            'trip_id': 'STBA',
+            'start_time': '6:00:00',
+            'end_time': '22:00:00',
+            'headway_secs': '1800',
+        }
+        (actual, created) = self.subject.parse(line)
+
+        expected = Frequency(
+            trip=Trip.objects.get(trip_id='STBA'),
+            start_time=6 * 3600,
+            end_time=22 * 3600,
+            headway_secs=1800,
+        )
+        self.assertEqual(actual, expected)
+
+    def test_frequencies_keep_times_past_midnight(self):
+        line = {
+            'trip_id': 'STBA',
+            'start_time': '22:00:00',
+            'end_time': '25:35:00',
+            'headway_secs': '1800',
+        }
+        (actual, created) = self.subject.parse(line)
+        self.assertEqual(actual.end_time, 25 * 3600 + 35 * 60)
+
+    def test_frequencies_detect_invalid_trip(self):
+        line = {
+            'trip_id': 'INVALID',
+            'start_time': '6:00:00',
+            'end_time': '22:00:00',
+            'headway_secs': '1800',
+        }
+        self.assertRaises(ParserException, self.subject.parse, line)
+
+    def test_frequencies_detect_invalid_headway(self):
+        line = {
+            'trip_id': 'STBA',
+            'start_time': '6:00:00',
+            'end_time': '22:00:00',
+            'headway_secs': '0',
+        }
+        self.assertRaises(ParserException, self.subject.parse, line)
+
+
 class RoutesParserTest(TestCase):
     def setUp(self):
         self.fixture()
@@ -542,8 +690,8 @@ class StopTimesParserTest(TestCase):
         expected = StopTime(
             trip=Trip.objects.get(trip_id='STBA'),
             stop=Stop.objects.get(stop_id='STAGECOACH'),
-            arrival_time=time(6 % 24, 0 % 60, 0 % 60),
-            departure_time=time(6 % 24, 0 % 60, 0 % 60),
+            arrival_time=parse_time('6:00:00'),
+            departure_time=parse_time('6:00:00'),
             stop_sequence='1'
         )
         self.assertEqual(actual, expected)
@@ -565,8 +713,8 @@ class StopTimesParserTest(TestCase):
         expected = StopTime(
             trip=Trip.objects.get(trip_id='STBA'),
             stop=Stop.objects.get(stop_id='STAGECOACH'),
-            arrival_time=time(0 % 24, 0 % 60, 0 % 60),
-            departure_time=time(6 % 24, 0 % 60, 0 % 60),
+            arrival_time=None,
+            departure_time=parse_time('6:00:00'),
             stop_sequence='1'
         )
         self.assertEqual(actual, expected)
@@ -588,8 +736,8 @@ class StopTimesParserTest(TestCase):
         expected = StopTime(
             trip=Trip.objects.get(trip_id='STBA'),
             stop=Stop.objects.get(stop_id='STAGECOACH'),
-            arrival_time=time(6 % 24, 0 % 60, 0 % 60),
-            departure_time=time(0 % 24, 0 % 60, 0 % 60),
+            arrival_time=parse_time('6:00:00'),
+            departure_time=None,
             stop_sequence='1'
         )
         self.assertEqual(actual, expected)
@@ -610,8 +758,8 @@ class StopTimesParserTest(TestCase):
         expected = StopTime(
             trip=Trip.objects.get(trip_id='STBA'),
             stop=Stop.objects.get(stop_id='STAGECOACH'),
-            arrival_time=time(6 % 24, 0 % 60, 0 % 60),
-            departure_time=time(6 % 24, 0 % 60, 0 % 60),
+            arrival_time=parse_time('6:00:00'),
+            departure_time=parse_time('6:00:00'),
             stop_sequence='1'
         )
         self.assertEqual(actual, expected)
@@ -632,8 +780,8 @@ class StopTimesParserTest(TestCase):
         expected = StopTime(
             trip=Trip.objects.get(trip_id='STBA'),
             stop=Stop.objects.get(stop_id='STAGECOACH'),
-            arrival_time=time(6 % 24, 0 % 60, 0 % 60),
-            departure_time=time(6 % 24, 0 % 60, 0 % 60),
+            arrival_time=parse_time('6:00:00'),
+            departure_time=parse_time('6:00:00'),
             stop_sequence='1'
         )
         self.assertEqual(actual, expected)
@@ -720,6 +868,44 @@ class StopsParserTest(TestCase):
         )
         self.assertEqual(actual, expected)
 
+    def test_stops_are_namespaced_by_feed(self):
+        line = {
+            'stop_id': 'FUR_CREEK_RES',
+            'stop_lat': '36.425288',
+            'stop_lon': '-117.133162',
+            'stop_name': 'Furnace Creek Resort (Demo)',
+            'zone_id': 'ZONE',
+        }
+        (default, created) = self.subject.parse(line)
+        (other, other_created) = StopsParser(feed='other').parse(line)
+
+        self.assertTrue(other_created)
+        self.assertNotEqual(default.id, other.id)
+        self.assertEqual(other.feed, 'other')
+        self.assertEqual(other.zone.feed, 'other')
+
+    @override_settings(DETERMINISTIC_ID_FEEDS=('other',))
+    def test_stops_ids_derive_from_gtfs_ids(self):
+        line = {
+            'stop_id': 'FUR_CREEK_RES',
+            'stop_lat': '36.425288',
+            'stop_lon': '-117.133162',
+            'stop_name': 'Furnace Creek Resort (Demo)',
+            'zone_id': 'ZONE',
+            'parent_station': 'NOT_LOADED_YET',
+        }
+        subject = StopsParser(feed='other')
+        (actual, created) = subject.parse(line)
+        (again, created_again) = subject.parse(line)
+
+        self.assertTrue(created)
+        self.assertFalse(created_again)
+        self.assertEqual(actual.id,
+                         document_id('other', Stop, 'FUR_CREEK_RES'))
+        self.assertEqual(Stop.objects(feed='other').count(), 1)
+        self.assertEqual(Stop.objects.get(id=actual.id).parent_station.id,
+                         document_id('other', Stop, 'NOT_LOADED_YET'))
+
 
 class TripsParserTest(TestCase):
     def setUp(self):
@@ -778,3 +964,14 @@ class TripsParserTest(TestCase):
             short_name='AB_TEST',
         )
         self.assertEqual(actual, expected)
+
+    def test_trip_time_is_parsed_in_minutes(self):
+        line = {
+            'trip_id': 'AB1',
+            'route_id': 'AB',
+            'service_id': 'FULLW',
+            'trip_time': '53',
+        }
+        (actual, created) = self.subject.parse(line)
+
+        self.assertEqual(actual.trip_time, 53)
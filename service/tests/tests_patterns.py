@@ -0,0 +1,90 @@
+from datetime import datetime
+from django.test import TestCase
+from service.frequencies import HeadwayTrip
+from service.patterns import *
+
+
+class TimesEncodingTest(TestCase):
+    def test_times_can_be_encoded(self):
+        actual = encode_times([21600, 21600, 21900, 21960, 22500, 22500])
+        self.assertEqual(actual, (21600, [0, 0, 300, 60, 540, 0]))
+
+    def test_times_can_be_encoded_from_the_first_departure(self):
+        actual = encode_times([21540, 21600, 21900, 21960], 21600)
+        self.assertEqual(actual, (21600, [-60, 60, 300, 60]))
+        self.assertEqual(decode_times(*actual), [21540, 21600, 21900, 21960])
+
+    def test_times_can_be_decoded(self):
+        actual = decode_times(21600, [0, 0, 300, 60, 540, 0])
+        self.assertEqual(actual, [21600, 21600, 21900, 21960, 22500, 22500])
+
+    def test_stop_times_fill_missing_times(self):
+        rows = [
+            {'arrival_time': datetime(2014, 1, 1, 6, 0),
+             'departure_time': datetime(2014, 1, 1, 6, 0)},
+            {'arrival_time': None, 'departure_time': None},
+            {'arrival_time': datetime(2014, 1, 1, 6, 10),
+             'departure_time': datetime(2014, 1, 1, 6, 11)},
+        ]
+        actual = stop_times_of(rows)
+        self.assertEqual(actual, [21600, 21600, 21600, 21600, 22200, 22260])
+
+    def test_stop_times_keep_trips_past_midnight(self):
+        rows = [
+            {'arrival_time': datetime(2014, 1, 1, 23, 50),
+             'departure_time': datetime(2014, 1, 1, 23, 50)},
+            {'arrival_time': datetime(2014, 1, 1, 0, 10),
+             'departure_time': datetime(2014, 1, 1, 0, 10)},
+        ]
+        actual = stop_times_of(rows)
+        self.assertEqual(actual, [85800, 85800, 87000, 87000])
+
+
+class PatternTimetableTest(TestCase):
+    def setUp(self):
+        trips = [
+            ('T2', 25200, [25200, 25200, 25500, 25560], 'WEEKDAY'),
+            ('T1', 21600, [21600, 21600, 21900, 21960], 'WEEKDAY'),
+            ('T3', 28800, [28800, 28800, 29100, 29160], 'SUNDAY'),
+        ]
+        self.subject = PatternTimetable({'pattern_id': 'AB:0:x'}, trips)
+
+    def test_departures_after_time(self):
+        actual = list(self.subject.departures(1, 22000))
+        self.assertEqual(actual, [('T2', 25560), ('T3', 29160)])
+
+    def test_departures_filter_services(self):
+        actual = list(self.subject.departures(0, 0, services=['WEEKDAY']))
+        self.assertEqual(actual, [('T1', 21600), ('T2', 25200)])
+
+    def test_departures_respect_limit(self):
+        actual = list(self.subject.departures(0, 0, limit=1))
+        self.assertEqual(actual, [('T1', 21600)])
+
+
+class HeadwayPatternTimetableTest(TestCase):
+    def setUp(self):
+        trips = [
+            ('T1', 21600, [21600, 21600, 21900, 21960], 'WEEKDAY'),
+            ('F1', 23400, [23400, 23400, 23700, 23760], 'WEEKDAY'),
+            ('T2', 25200, [25200, 25200, 25500, 25560], 'WEEKDAY'),
+        ]
+        # F1 runs every 15 minutes from 6:30 to 7:00
+        headways = {'F1': HeadwayTrip.from_times(
+            'F1', [(23400, 25200, 900)], ['A', 'B'],
+            [23400, 23400, 23700, 23760])}
+        self.subject = PatternTimetable({'pattern_id': 'AB:0:x'}, trips,
+                                        headways)
+
+    def test_runs_are_merged_with_scheduled_trips(self):
+        actual = list(self.subject.departures(1, 22000))
+        self.assertEqual(actual, [('F1', 23760), ('F1', 24660),
+                                  ('T2', 25560)])
+
+    def test_runs_are_expanded_up_to_the_limit(self):
+        actual = list(self.subject.departures(0, 0, limit=2))
+        self.assertEqual(actual, [('T1', 21600), ('F1', 23400)])
+
+    def test_runs_filter_services(self):
+        actual = list(self.subject.departures(0, 0, services=['SUNDAY']))
+        self.assertEqual(actual, [])
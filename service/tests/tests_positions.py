@@ -0,0 +1,77 @@
+from django.test import TestCase
+from service.positions import *
+
+
+class TripPathTest(TestCase):
+    def setUp(self):
+        self.subject = TripPath.for_stops([(45.0, -73.0), (45.0, -72.99),
+                                           (45.01, -72.99)])
+
+    def test_vehicle_waits_at_stop(self):
+        times = [100, 100, 200, 260, 360, 360]
+        (lat, lon) = self.subject.locate(times, 230)
+        self.assertAlmostEqual(lat, 45.0)
+        self.assertAlmostEqual(lon, -72.99)
+
+    def test_vehicle_moves_between_stops(self):
+        times = [100, 100, 200, 260, 360, 360]
+        (lat, lon) = self.subject.locate(times, 310)
+        self.assertAlmostEqual(lat, 45.005, places=4)
+        self.assertAlmostEqual(lon, -72.99)
+
+    def test_shape_path_uses_stop_distances(self):
+        rows = [{'geopoint': [45.0, -73.0], 'dist_traveled': 0.0},
+                {'geopoint': [45.0, -72.99], 'dist_traveled': 1.0},
+                {'geopoint': [45.01, -72.99], 'dist_traveled': 2.0}]
+        path = TripPath.for_shape(rows, [0.0, 2.0])
+        (lat, lon) = path.locate([0, 0, 100, 100], 50)
+        self.assertAlmostEqual(lat, 45.0)
+        self.assertAlmostEqual(lon, -72.99)
+
+
+class ServiceDayTest(TestCase):
+    def setUp(self):
+        path = TripPath.for_stops([(45.0, -73.0), (45.0, -72.99)])
+        timetable = Timetable([
+            ('T1', 'WEEK', 'P', numpy.array([100, 100, 200, 200])),
+            ('T2', 'WEEK', 'P', numpy.array([150, 150, 1000, 1000])),
+            ('T3', 'SUN', 'P', numpy.array([100, 100, 200, 200])),
+            ('T4', 'WEEK', 'P', numpy.array([300, 300, 400, 400])),
+        ], {'P': path})
+        self.subject = ServiceDay(timetable, set(['WEEK']))
+
+    def test_active_trips(self):
+        actual = [trip_id for (trip_id, lat, lon)
+                  in self.subject.positions(180)]
+        self.assertEqual(actual, ['T1', 'T2'])
+
+    def test_long_trips_stay_active(self):
+        actual = [trip_id for (trip_id, lat, lon)
+                  in self.subject.positions(350)]
+        self.assertEqual(actual, ['T2', 'T4'])
+
+    def test_no_trips_outside_service(self):
+        self.assertEqual(self.subject.positions(2000), [])
+
+
+class HeadwayServiceDayTest(TestCase):
+    def setUp(self):
+        path = TripPath.for_stops([(45.0, -73.0), (45.0, -72.99)])
+        # runs every 10 minutes from 6:00 to 7:00, each taking 15 minutes
+        headway = HeadwayTrip('F1', [(21600, 25200, 600)], [])
+        timetable = Timetable([], {'P': path}, [
+            ('F1', 'WEEK', 'P', numpy.array([0, 0, 900, 900]), headway),
+        ])
+        self.subject = ServiceDay(timetable, set(['WEEK']))
+
+    def test_runs_in_progress_are_generated(self):
+        actual = self.subject.positions(22500)
+        self.assertEqual(len(actual), 2)
+        self.assertEqual([trip_id for (trip_id, lat, lon) in actual],
+                         ['F1', 'F1'])
+        # the run of 6:00 just arrived, the one of 6:10 is a third of the way
+        self.assertAlmostEqual(actual[0][2], -72.99, places=4)
+        self.assertAlmostEqual(actual[1][2], -72.99667, places=4)
+
+    def test_no_runs_after_the_last_one_arrived(self):
+        self.assertEqual(self.subject.positions(26200), [])
@@ -0,0 +1,66 @@
+from django.test import TestCase
+from service.postings import *
+
+
+class TripIndexTest(TestCase):
+    def setUp(self):
+        self.subject = TripIndex()
+        # T1: A -> B -> C, T2: C -> B -> A, T3: A -> C on another service
+        self.subject.add_trip('T1', 'WEEK', ['A', 'B', 'C'],
+                              [61200, 61200, 61500, 61560, 62100, 62100])
+        self.subject.add_trip('T2', 'WEEK', ['C', 'B', 'A'],
+                              [61800, 61800, 62100, 62160, 62700, 62700])
+        self.subject.add_trip('T3', 'SUN', ['A', 'C'],
+                              [64800, 64800, 65400, 65400])
+        self.subject.add_trip('T4', 'WEEK', ['A', 'B', 'C'],
+                              [57600, 57600, 57900, 57960, 58500, 58500])
+
+    def test_trips_must_visit_origin_first(self):
+        actual = self.subject.between('A', 'C')
+        self.assertEqual(actual, [('T4', 57600, 58500), ('T1', 61200, 62100),
+                                  ('T3', 64800, 65400)])
+
+    def test_trips_leave_after_time(self):
+        actual = self.subject.between('A', 'C', after=61200)
+        self.assertEqual(actual, [('T1', 61200, 62100), ('T3', 64800, 65400)])
+
+    def test_trips_filter_services(self):
+        actual = self.subject.between('A', 'C', services=set(['WEEK']))
+        self.assertEqual(actual, [('T4', 57600, 58500), ('T1', 61200, 62100)])
+
+    def test_unknown_stops_have_no_trips(self):
+        self.assertEqual(self.subject.between('A', 'Z'), [])
+
+
+class IntersectTest(TestCase):
+    def test_loop_trips_use_a_later_destination_visit(self):
+        index = TripIndex()
+        index.add_trip('LOOP', 'WEEK', ['B', 'A', 'B'],
+                       [100, 100, 200, 200, 300, 300])
+        actual = list(intersect(index.postings['A'], index.postings['B']))
+        self.assertEqual(actual, [(0, 200, 300, 1, 2)])
+
+
+class HeadwayTripIndexTest(TestCase):
+    def setUp(self):
+        self.subject = TripIndex()
+        self.subject.add_trip('T1', 'WEEK', ['A', 'B', 'C'],
+                              [21600, 21600, 21900, 21960, 22500, 22500])
+        # F1 runs every 20 minutes from 6:00 to 8:00
+        self.subject.add_trip('F1', 'WEEK', ['A', 'B', 'C'],
+                              [21600, 21600, 21900, 21960, 22500, 22500],
+                              periods=[(21600, 28800, 1200)])
+
+    def test_runs_leave_after_time(self):
+        actual = self.subject.between('B', 'C', after=22000, limit=3)
+        self.assertEqual(actual, [('F1', 23160, 23700), ('F1', 24360, 24900),
+                                  ('F1', 25560, 26100)])
+
+    def test_runs_are_merged_with_scheduled_trips(self):
+        actual = self.subject.between('A', 'C', limit=3)
+        self.assertEqual(actual, [('T1', 21600, 22500), ('F1', 21600, 22500),
+                                  ('F1', 22800, 23700)])
+
+    def test_runs_filter_services(self):
+        actual = self.subject.between('A', 'C', services=set(['SUN']))
+        self.assertEqual(actual, [])
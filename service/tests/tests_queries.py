@@ -0,0 +1,53 @@
+from bson import DBRef
+from bson import ObjectId
+from django.test import TestCase
+from service.queries import *
+
+
+class FakeJoin(Join):
+    def __init__(self, field, documents):
+        Join.__init__(self, field, None)
+        self.documents = documents
+        self.fetched = []
+
+    def fetch(self, ids):
+        self.fetched.append(set(ids))
+        return dict((key, value) for (key, value) in self.documents.items()
+                    if key in ids)
+
+
+class ResolveTest(TestCase):
+    def setUp(self):
+        (self.first, self.second, self.third) = [ObjectId() for _ in range(3)]
+        self.documents = {
+            self.first: {'_id': self.first, 'route_id': 'AB'},
+            self.second: {'_id': self.second, 'route_id': 'BFC'},
+        }
+
+    def test_references_are_fetched_once(self):
+        join = FakeJoin('route', self.documents)
+        rows = [{'route': self.first}, {'route': self.second},
+                {'route': self.first}, {'route': None}]
+        resolve(rows, [join])
+
+        self.assertEqual(join.fetched, [set([self.first, self.second])])
+        self.assertEqual(rows[0]['route']['route_id'], 'AB')
+        self.assertEqual(rows[1]['route']['route_id'], 'BFC')
+        self.assertEqual(rows[2]['route']['route_id'], 'AB')
+        self.assertEqual(rows[3]['route'], None)
+
+    def test_reference_lists_are_resolved(self):
+        join = FakeJoin('shapes', self.documents)
+        rows = [{'shapes': [self.first, DBRef('shape', self.second)]},
+                {'shapes': [self.third]}]
+        resolve(rows, [join])
+
+        self.assertEqual(len(join.fetched), 1)
+        self.assertEqual([shape['route_id'] for shape in rows[0]['shapes']],
+                         ['AB', 'BFC'])
+        self.assertEqual(rows[1]['shapes'], [None])
+
+    def test_missing_references_do_not_query(self):
+        join = FakeJoin('route', self.documents)
+        resolve([{}], [join])
+        self.assertEqual(join.fetched, [])
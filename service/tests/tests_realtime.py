@@ -0,0 +1,133 @@
+import calendar
+from datetime import datetime
+from django.test import TestCase
+from service.postings import TripIndex
+from service.realtime import *
+from service.realtime import _midnight
+
+FEED_PATH = 'service/tests/data/realtime/trip-updates.pb'
+
+
+def _feed():
+    with open(FEED_PATH, 'rb') as feed_file:
+        return parse_feed(feed_file.read())
+
+
+class ParseFeedTest(TestCase):
+    def setUp(self):
+        self.subject = _feed()
+
+    def test_header(self):
+        self.assertEqual(self.subject.timestamp, 1400000000)
+        self.assertEqual(self.subject.incrementality, FULL_DATASET)
+
+    def test_stop_updates(self):
+        update = self.subject.updates[0]
+        self.assertEqual(update.trip_id, 'T1')
+        self.assertEqual([(stop.stop_sequence, stop.stop_id, stop.arrival,
+                           stop.departure) for stop in update.stops],
+                         [(2, None, (120, None), (180, None)),
+                          (None, 'C', (-30, None), None)])
+
+    def test_trip_relationships(self):
+        self.assertEqual([(update.trip_id, update.relationship, update.delay)
+                          for update in self.subject.updates[1:]],
+                         [('T2', CANCELED, None), ('T3', 0, 60)])
+        self.assertEqual(self.subject.updates[2].stops[0].relationship,
+                         SKIPPED)
+
+    def test_deleted_entities(self):
+        self.assertEqual(self.subject.deleted, ['T9'])
+
+    def test_invalid_feed(self):
+        self.assertRaises(RealtimeException, parse_feed, b'\x0a\xff')
+
+
+class MidnightTest(TestCase):
+    def test_midnight_of_the_agency_timezone(self):
+        self.assertEqual(_midnight('20140601', 'America/Sao_Paulo'),
+                         calendar.timegm(datetime(2014, 6, 1, 3).timetuple()))
+
+    def test_noon_minus_12h_when_daylight_saving_time_starts(self):
+        # clocks go forward at 2am, noon is 11 hours after midnight
+        self.assertEqual(_midnight('20140309', 'America/Toronto'),
+                         calendar.timegm(datetime(2014, 3, 9, 4).timetuple()))
+
+
+class OverlayTest(TestCase):
+    def setUp(self):
+        schedule = TripSchedule({
+            'T1': ('id1', 'P', 61200, [0, 0, 300, 60, 540, 0]),
+            'T2': ('id2', 'P', 61800, [0, 0, 300, 60, 540, 0]),
+            'T3': ('id3', 'P', 64800, [0, 0, 300, 60, 540, 0]),
+        }, {'P': ('A', 'B', 'C')})
+        schedule.sequences['T1'] = [1, 2, 3]
+        self.subject = Overlay().merge(_feed(), schedule)
+
+    def test_stop_delays(self):
+        delays = self.subject.delays('T1')
+        self.assertEqual(delays.adjust(0, DEPARTURE, 61200), 61200)
+        self.assertEqual(delays.adjust(1, ARRIVAL, 61500), 61620)
+        self.assertEqual(delays.adjust(1, DEPARTURE, 61560), 61740)
+        self.assertEqual(delays.adjust(2, ARRIVAL, 62100), 62070)
+
+    def test_cancelled_trips_are_not_served(self):
+        self.assertEqual(self.subject.delays('id2').adjust(0, DEPARTURE, 0),
+                         None)
+
+    def test_skipped_stops_are_not_served(self):
+        delays = self.subject.delays('T3')
+        self.assertEqual(delays.adjust(0, DEPARTURE, 64800), None)
+        self.assertEqual(delays.adjust(1, ARRIVAL, 65100), 65100)
+
+    def test_max_delay(self):
+        self.assertEqual(self.subject.max_delay, 180)
+
+    def test_merged_departures(self):
+        index = TripIndex()
+        index.add_trip('T1', 'WEEK', ['A', 'B', 'C'],
+                       [61200, 61200, 61500, 61560, 62100, 62100])
+        index.add_trip('T2', 'WEEK', ['A', 'B', 'C'],
+                       [61800, 61800, 62100, 62160, 62700, 62700])
+        actual = index.between('B', 'C', after=61600, overlay=self.subject)
+        self.assertEqual(actual, [('T1', 61740, 62070)])
+
+
+class FixedSchedule(object):
+    def __init__(self, schedule):
+        self.schedule = schedule
+
+    def get(self):
+        return self.schedule
+
+
+class RealtimeFeedTest(TestCase):
+    def setUp(self):
+        schedule = TripSchedule({
+            'T1': ('id1', 'P', 61200, [0, 0, 300, 60, 540, 0]),
+        }, {'P': ('A', 'B', 'C')})
+        schedule.sequences['T1'] = [1, 2, 3]
+        self.subject = RealtimeFeed(FEED_PATH)
+        self.subject.schedule = FixedSchedule(schedule)
+
+    def test_sources_are_read_in_the_background(self):
+        self.subject.get()
+        self.assertTrue(self.subject.refresher.daemon)
+        self.subject.refresher.join()
+        self.assertEqual(len(self.subject.get()), 1)
+
+    def test_reads_are_not_repeated_within_the_interval(self):
+        self.subject.get()
+        refresher = self.subject.refresher
+        refresher.join()
+        self.subject.get()
+        self.assertIs(self.subject.refresher, refresher)
+
+    def test_failing_reads_keep_the_last_overlay(self):
+        self.subject.get()
+        self.subject.refresher.join()
+        self.subject.source = FEED_PATH + '.missing'
+        self.subject.read_at = 0
+        self.subject.get()
+        self.subject.refresher.join()
+        self.assertEqual(len(self.subject.get()), 1)
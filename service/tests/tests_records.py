@@ -0,0 +1,36 @@
+from bson import ObjectId
+from django.test import TestCase
+from service.records import *
+
+
+class StopRecordTest(TestCase):
+    def test_stop_records_can_be_built_from_raw_documents(self):
+        _id = ObjectId()
+        row = {
+            '_id': _id,
+            'stop_id': '1140',
+            'name': 'CRISTIANO KRAEMER 87',
+            'geopoint': [-30.117728, -51.206618],
+        }
+        actual = StopRecord.from_raw(row)
+
+        expected = StopRecord(_id, '1140', None, 'CRISTIANO KRAEMER 87',
+                              None, None, None, None, None,
+                              -30.117728, -51.206618)
+        self.assertEqual(actual, expected)
+
+    def test_stop_records_project_their_fields(self):
+        projection = StopRecord.projection()
+        self.assertTrue(projection['geopoint'])
+        self.assertTrue(projection['_id'])
+        self.assertFalse('lat' in projection)
+
+
+class TripRecordTest(TestCase):
+    def test_trip_records_keep_references_as_ids(self):
+        (route, shape) = (ObjectId(), ObjectId())
+        actual = TripRecord.from_raw({'trip_id': 'AB1', 'route': route,
+                                      'shapes': [shape]})
+        self.assertEqual(actual.route, route)
+        self.assertEqual(actual.shapes, [shape])
+        self.assertEqual(actual.service, None)
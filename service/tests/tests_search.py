@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from django.test import TestCase
+from service.search import *
+
+
+class StopIndexTest(TestCase):
+    def setUp(self):
+        self.subject = StopIndex()
+        self.subject.add('1140', u'CRISTIANO KRAEMER 87')
+        self.subject.add('1234', u'NONOAI 248/260')
+        self.subject.add('10', u'Avenida São João', code=u'SJ')
+        self.subject.add('11', u'Rua Cristiano Fischer')
+
+    def test_search_ignores_case_and_accents(self):
+        actual = self.subject.search(u'SAO joao')
+        self.assertEqual(actual, [('10', u'Avenida São João', u'SJ')])
+
+    def test_search_matches_token_prefixes(self):
+        actual = self.subject.search(u'cristiano kra')
+        self.assertEqual(actual, [('1140', u'CRISTIANO KRAEMER 87', None)])
+
+    def test_search_ranks_leading_matches_first(self):
+        actual = [stop_id for (stop_id, _, _) in self.subject.search(u'cris')]
+        self.assertEqual(actual, ['1140', '11'])
+
+    def test_search_matches_codes(self):
+        actual = self.subject.search(u'sj')
+        self.assertEqual(actual, [('10', u'Avenida São João', u'SJ')])
+
+    def test_search_respects_limit(self):
+        self.assertEqual(len(self.subject.search(u'cris', limit=1)), 1)
+
+    def test_removed_stops_are_not_found(self):
+        self.subject.remove('1140')
+        self.assertEqual(self.subject.search(u'kraemer'), [])
+
+    def test_updated_stops_are_reindexed(self):
+        self.subject.add('1234', u'NONOAI 300')
+        self.assertEqual(self.subject.search(u'248'), [])
+        self.assertEqual(len(self.subject.search(u'nonoai 300')), 1)
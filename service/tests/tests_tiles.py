@@ -0,0 +1,83 @@
+import json
+import os
+from django.conf import settings
+from django.test import TestCase
+from service.tiles import *
+from service.tiles import _shape_pieces
+
+
+class TileForTest(TestCase):
+    def test_world_tile(self):
+        self.assertEqual(tile_for(-30.03, -51.22, 0), (0, 0))
+
+    def test_tiles_follow_the_slippy_map_scheme(self):
+        self.assertEqual(tile_for(-30.03, -51.22, 10), (366, 601))
+        self.assertEqual(tile_for(51.5, -0.12, 1), (0, 0))
+        self.assertEqual(tile_for(-33.9, 151.2, 1), (1, 1))
+
+    def test_points_beyond_the_projection_are_clamped(self):
+        self.assertEqual(tile_for(89.9, 180.0, 2), (3, 0))
+        self.assertEqual(tile_for(-89.9, -180.0, 2), (0, 3))
+
+
+class ShapePiecesTest(TestCase):
+    def test_points_inside_a_tile_form_one_run(self):
+        points = [(-30.03, -51.22), (-30.04, -51.21), (-30.05, -51.20)]
+        self.assertEqual(_shape_pieces(points, 10),
+                         {(366, 601): [[0, 1, 2]]})
+
+    def test_segments_belong_to_the_tiles_they_cross(self):
+        # a diagonal segment through four tiles misses the other twelve of
+        # its bounding box
+        points = [(80.0, -170.0), (-80.0, 100.0)]
+        pieces = _shape_pieces(points, 2)
+        self.assertEqual(sorted(pieces),
+                         [(0, 0), (0, 1), (1, 1), (1, 2), (2, 2), (2, 3),
+                          (3, 3)])
+        self.assertTrue(all(runs == [[0, 1]] for runs in pieces.values()))
+
+    def test_shapes_leaving_a_tile_get_a_run_per_visit(self):
+        points = [(10.0, -100.0), (10.0, 100.0), (20.0, 100.0),
+                  (20.0, -100.0)]
+        pieces = _shape_pieces(points, 1)
+        self.assertEqual(pieces[(0, 0)], [[0, 1], [2, 3]])
+        self.assertEqual(pieces[(1, 0)], [[0, 1, 2, 3]])
+
+
+class BuildTilesTest(TestCase):
+    def setUp(self):
+        self.stops = [('A', 'Alpha', (10.0, -100.0)),
+                      ('B', 'Beta', (10.0, 100.0))]
+        self.shapes = [('S1', [(10.0, -100.0), (10.0, 100.0)])]
+
+    def test_tiles_hold_their_stops_and_shape_pieces(self):
+        tiles = build_tiles(self.stops, self.shapes, 1, 0, 1)
+        self.assertEqual([(zoom, x, y) for (zoom, x, y, _) in tiles],
+                         [(1, 0, 0), (1, 1, 0)])
+        features = json.loads(tiles[0][3])['features']
+        self.assertEqual(sorted(feature['properties']['kind']
+                                for feature in features), ['shape', 'stop'])
+        shape = [feature for feature in features
+                 if feature['properties']['kind'] == 'shape'][0]
+        self.assertEqual(shape['geometry']['coordinates'],
+                         [[-100.0, 10.0], [100.0, 10.0]])
+
+    def test_only_the_requested_columns_are_built(self):
+        tiles = build_tiles(self.stops, self.shapes, 1, 1, 1)
+        self.assertEqual([(zoom, x, y) for (zoom, x, y, _) in tiles],
+                         [(1, 1, 0)])
+        features = json.loads(tiles[0][3])['features']
+        self.assertEqual([feature['properties'].get('stop_id')
+                          for feature in features], ['B', None])
+
+
+class TilesPathTest(TestCase):
+    def test_default_feed_uses_the_configured_file(self):
+        self.assertEqual(tiles_path(), settings.TILES_PATH)
+
+    def test_other_feeds_get_their_own_file(self):
+        (root, extension) = os.path.splitext(settings.TILES_PATH)
+        self.assertEqual(tiles_path('metro'), root + '-metro' + extension)
+
+    def test_feed_names_cannot_leave_the_directory(self):
+        self.assertRaises(ValueError, tiles_path, '../metro')
@@ -0,0 +1,30 @@
+from django.test import TestCase
+from service.transfers import *
+
+
+class StopGridTest(TestCase):
+    def setUp(self):
+        # two stops 100m apart, a third one about 1km away
+        self.lats = [-30.0, -30.0009, -30.009]
+        self.lons = [-51.2, -51.2, -51.2]
+        self.subject = StopGrid(self.lats, self.lons, 400.0)
+
+    def test_close_stops_are_paired_once(self):
+        (origins, destinations, meters) = self.subject.pairs(
+            sorted(self.subject.cells))
+        actual = sorted(zip(origins.tolist(), destinations.tolist()))
+        self.assertEqual(actual, [(0, 1)])
+        self.assertAlmostEqual(meters[0], 100.0, delta=1.0)
+
+    def test_find_pairs_matches_grid(self):
+        pairs = list(find_pairs(self.lats, self.lons, 400.0, processes=1))
+        self.assertEqual(sum(len(origins) for (origins, _, _) in pairs), 1)
+
+    def test_cells_are_wide_enough_far_from_the_mean_latitude(self):
+        # about 390m apart at 75 degrees, the mean latitude being 37.5
+        lats = [0.0, 75.0, 75.0]
+        lons = [10.0, 10.0, 10.01354]
+        grid = StopGrid(lats, lons, 400.0)
+        (origins, destinations, _) = grid.pairs(sorted(grid.cells))
+        actual = sorted(zip(origins.tolist(), destinations.tolist()))
+        self.assertEqual(actual, [(1, 2)])
@@ -0,0 +1,19 @@
+from django.test import TestCase
+from service.versioned import *
+
+
+class VersionedByFeedTest(TestCase):
+    def setUp(self):
+        self.subject = VersionedByFeed(lambda feed: feed.upper(), max_feeds=2)
+
+    def test_feeds_share_their_holder(self):
+        self.assertIs(self.subject.holder('a'), self.subject.holder('a'))
+
+    def test_least_recently_used_feeds_are_dropped(self):
+        first = self.subject.holder('a')
+        self.subject.holder('b')
+        self.subject.holder('a')
+        self.subject.holder('c')
+        self.assertEqual(len(self.subject.feeds), 2)
+        self.assertIs(self.subject.holder('a'), first)
+        self.assertIsNone(self.subject.feeds.get('b'))
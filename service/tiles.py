@@ -0,0 +1,267 @@
+""" Offline GeoJSON tile pyramid for stops and route shapes.
+
+Tiles follow the slippy map scheme (`zoom/x/y`) and are stored in an MBTiles
+file: a single SQLite database with `metadata` and `tiles` tables, rows being
+flipped to the TMS scheme as the specification requires. Every tile holds a
+GeoJSON FeatureCollection with the stops inside it and the pieces of the
+shapes crossing it, the shapes being taken from the
+:py:class:`service.models.ShapeGeometry` level matching the tile zoom.
+
+Every feed gets a file of its own: `TILES_PATH` for the default feed, the
+feed name being appended to it for the others (see :py:func:`tiles_path`).
+
+"""
+import json
+import math
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+from multiprocessing import Pool
+from django.conf import settings
+from service.geometry import decode_polyline
+from service.models import DEFAULT_FEED
+from service.models import ShapeGeometry
+from service.models import Stop
+
+# tile columns handed to a worker process at once
+COLUMN_BAND = 64
+# feed names allowed in a tiles file name
+FEED_NAME = re.compile(r'^[\w-]+$')
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS metadata (name TEXT, value TEXT)',
+    'CREATE TABLE IF NOT EXISTS tiles (zoom_level INTEGER, '
+    'tile_column INTEGER, tile_row INTEGER, tile_data BLOB)',
+    'CREATE UNIQUE INDEX IF NOT EXISTS tile_index '
+    'ON tiles (zoom_level, tile_column, tile_row)',
+]
+
+
+def tiles_path(feed=DEFAULT_FEED):
+    """The MBTiles file of `feed`. Raises ValueError for feed names that
+    cannot be part of a file name."""
+    if feed == DEFAULT_FEED:
+        return settings.TILES_PATH
+    if not FEED_NAME.match(feed):
+        raise ValueError('Invalid feed [%s]' % feed)
+    (root, extension) = os.path.splitext(settings.TILES_PATH)
+    return '%s-%s%s' % (root, feed, extension)
+
+
+def _position(lat, lon, zoom):
+    """Fractional slippy map tile coordinates of a point."""
+    n = 2 ** zoom
+    lat = max(min(lat, 85.0511), -85.0511)
+    lat_rad = math.radians(lat)
+    return ((lon + 180.0) / 360.0 * n,
+            (1.0 - math.log(math.tan(lat_rad) + 1 / math.cos(lat_rad))
+             / math.pi) / 2.0 * n)
+
+
+def _tile_of(position, zoom):
+    n = 2 ** zoom
+    return (min(max(int(position[0]), 0), n - 1),
+            min(max(int(position[1]), 0), n - 1))
+
+
+def tile_for(lat, lon, zoom):
+    return _tile_of(_position(lat, lon, zoom), zoom)
+
+
+def _boundary_distance(start, delta):
+    """Fraction of a segment travelled before its first tile border."""
+    if delta > 0:
+        return (math.floor(start) + 1 - start) / delta
+    if delta < 0:
+        return (start - math.floor(start)) / -delta
+    return float('inf')
+
+
+def _crossed_tiles(start, end, zoom):
+    """Tiles crossed by the segment between two fractional positions, in
+    order, stepping from tile to tile along the segment."""
+    (x, y) = _tile_of(start, zoom)
+    (last_x, last_y) = _tile_of(end, zoom)
+    (dx, dy) = (end[0] - start[0], end[1] - start[1])
+    (step_x, step_y) = (1 if dx > 0 else -1, 1 if dy > 0 else -1)
+    (next_x, next_y) = (_boundary_distance(start[0], dx),
+                        _boundary_distance(start[1], dy))
+    (delta_x, delta_y) = (abs(1.0 / dx) if dx else float('inf'),
+                          abs(1.0 / dy) if dy else float('inf'))
+    tiles = [(x, y)]
+    for _ in range(abs(last_x - x) + abs(last_y - y)):
+        if y == last_y or (x != last_x and next_x < next_y):
+            x += step_x
+            next_x += delta_x
+        else:
+            y += step_y
+            next_y += delta_y
+        tiles.append((x, y))
+    return tiles
+
+
+def _stop_feature(stop):
+    (stop_id, name, (lat, lon)) = stop
+    return {
+        'type': 'Feature',
+        'geometry': {'type': 'Point', 'coordinates': [lon, lat]},
+        'properties': {'kind': 'stop', 'stop_id': stop_id, 'name': name},
+    }
+
+
+def _shape_feature(shape_id, points):
+    return {
+        'type': 'Feature',
+        'geometry': {'type': 'LineString',
+                     'coordinates': [[lon, lat] for (lat, lon) in points]},
+        'properties': {'kind': 'shape', 'shape_id': shape_id},
+    }
+
+
+def _shape_pieces(points, zoom):
+    """Maps each tile crossed by `points` to the runs of points inside it."""
+    pieces = {}
+    positions = [_position(lat, lon, zoom) for (lat, lon) in points]
+    for index in range(len(points) - 1):
+        for tile in _crossed_tiles(positions[index], positions[index + 1],
+                                   zoom):
+            runs = pieces.setdefault(tile, [])
+            if runs and runs[-1][-1] == index:
+                runs[-1].append(index + 1)
+            else:
+                runs.append([index, index + 1])
+    return pieces
+
+
+def build_tiles(stops, shapes, zoom, first_column, last_column):
+    """Builds the tiles of `zoom` whose column is in the given range.
+
+    `stops` are `(stop_id, name, (lat, lon))` tuples and `shapes` are
+    `(shape_id, points)` pairs already simplified for `zoom`. Returns
+    `(zoom, x, y, geojson)` tuples.
+    """
+    features = {}
+    for stop in stops:
+        (x, y) = tile_for(stop[2][0], stop[2][1], zoom)
+        if first_column <= x <= last_column:
+            features.setdefault((x, y), []).append(_stop_feature(stop))
+
+    for (shape_id, points) in shapes:
+        for ((x, y), runs) in _shape_pieces(points, zoom).items():
+            if first_column <= x <= last_column:
+                for run in runs:
+                    piece = [points[index] for index in run]
+                    features.setdefault((x, y), []).append(
+                        _shape_feature(shape_id, piece))
+
+    return [(zoom, x, y, json.dumps({'type': 'FeatureCollection',
+                                     'features': tile_features},
+                                    sort_keys=True))
+            for ((x, y), tile_features) in sorted(features.items())]
+
+
+class TileStore(object):
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+
+    def create(self, metadata):
+        for statement in SCHEMA:
+            self.connection.execute(statement)
+        self.connection.executemany(
+            'INSERT INTO metadata (name, value) VALUES (?, ?)',
+            sorted(metadata.items()))
+        self.connection.commit()
+
+    def write(self, tiles):
+        rows = [(zoom, x, 2 ** zoom - 1 - y, sqlite3.Binary(data))
+                for (zoom, x, y, data) in tiles]
+        self.connection.executemany(
+            'INSERT OR REPLACE INTO tiles (zoom_level, tile_column, tile_row, '
+            'tile_data) VALUES (?, ?, ?, ?)', rows)
+        self.connection.commit()
+
+    def read(self, zoom, x, y):
+        row = self.connection.execute(
+            'SELECT tile_data FROM tiles WHERE zoom_level = ? AND '
+            'tile_column = ? AND tile_row = ?',
+            (zoom, x, 2 ** zoom - 1 - y)).fetchone()
+        return bytes(row[0]) if row else None
+
+    def close(self):
+        self.connection.close()
+
+
+def load_stops(feed=DEFAULT_FEED):
+    cursor = Stop._get_collection().find(
+        {'feed': feed}, {'stop_id': True, 'name': True, 'geopoint': True})
+    return [(row['stop_id'], row.get('name'), tuple(row['geopoint']))
+            for row in cursor]
+
+
+def load_shapes(zoom, feed=DEFAULT_FEED):
+    shapes = []
+    for geometry in ShapeGeometry.objects(feed=feed):
+        level = geometry.level_for(zoom)
+        shapes.append((geometry.shape_id, decode_polyline(level.polyline)))
+    return shapes
+
+
+# workers inherit the features loaded by the parent process
+_features = {}
+
+
+def _build_band(job):
+    (zoom, first_column, last_column) = job
+    return build_tiles(_features['stops'], _features['shapes'][zoom],
+                       zoom, first_column, last_column)
+
+
+def generate(path, min_zoom, max_zoom, processes=None, feed=DEFAULT_FEED):
+    """Builds every tile of `feed` between `min_zoom` and `max_zoom` into
+    a new file replacing `path`."""
+    _features['stops'] = load_stops(feed)
+    _features['shapes'] = dict((zoom, load_shapes(zoom, feed))
+                               for zoom in range(min_zoom, max_zoom + 1))
+    longitudes = [stop[2][1] for stop in _features['stops']]
+    for shapes in _features['shapes'].values():
+        longitudes.extend(lon for (_, points) in shapes for (_, lon) in points)
+    if not longitudes:
+        return 0
+
+    jobs = []
+    for zoom in range(min_zoom, max_zoom + 1):
+        # only the columns covering the feed extent hold any feature
+        first = tile_for(0, min(longitudes), zoom)[0]
+        last = tile_for(0, max(longitudes), zoom)[0]
+        for column in range(first, last + 1, COLUMN_BAND):
+            jobs.append((zoom, column, min(column + COLUMN_BAND - 1, last)))
+
+    # built aside then renamed, the tile view never serves a partial file
+    directory = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(path)))
+    partial = os.path.join(directory, os.path.basename(path))
+    count = 0
+    try:
+        store = TileStore(partial)
+        store.create({
+            'name': 'pygtfs',
+            'description': 'Stops and shapes of feed %s' % feed,
+            'format': 'geojson',
+            'minzoom': str(min_zoom),
+            'maxzoom': str(max_zoom),
+        })
+        pool = Pool(processes)
+        try:
+            for tiles in pool.imap_unordered(_build_band, jobs):
+                store.write(tiles)
+                count += len(tiles)
+        finally:
+            pool.close()
+            pool.join()
+            store.close()
+        os.rename(partial, path)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return count
@@ -0,0 +1,54 @@
+""" GTFS times.
+
+GTFS times are measured from "noon minus 12h" of the service day and may go
+past 24:00:00 for trips running after midnight, so they are handled as
+seconds since the start of the service day rather than as `time` objects.
+
+"""
+import numbers
+from datetime import date
+from datetime import datetime
+from datetime import time
+
+DAY = 24 * 60 * 60
+
+
+def parse_time(text):
+    """Parses `H:MM:SS` into seconds, keeping times past 24:00:00."""
+    (hours, minutes, seconds) = [int(part) for part in text.strip().split(':')]
+    if not (0 <= minutes < 60 and 0 <= seconds < 60) or hours < 0:
+        raise ValueError('Invalid GTFS time [%s]' % text)
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def format_time(seconds):
+    return '%02d:%02d:%02d' % (seconds // 3600, seconds // 60 % 60,
+                               seconds % 60)
+
+
+def seconds_of(value):
+    """Seconds since midnight of a stored time, None when unknown."""
+    if value is None:
+        return None
+    if isinstance(value, numbers.Integral):
+        return value
+    if isinstance(value, (datetime, time)):
+        return value.hour * 3600 + value.minute * 60 + value.second
+    if isinstance(value, date):
+        return 0
+    raise ValueError('Invalid time [%r]' % (value,))
+
+
+def monotonic(seconds):
+    """Unwraps times that went past midnight but were stored modulo 24h."""
+    result = []
+    offset = 0
+    previous = None
+    for value in seconds:
+        if value is not None:
+            if previous is not None and value + offset < previous:
+                offset += DAY
+            value += offset
+            previous = value
+        result.append(value)
+    return result
@@ -0,0 +1,164 @@
+""" Walking transfers between nearby stops.
+
+Few feeds ship transfers.txt, yet routing needs footpaths between stops. The
+stops are hashed into a grid whose cells are as wide as the walking radius,
+so every stop only has to be compared with the stops of its own and of the 8
+surrounding cells. Cells are processed in chunks by worker processes and every
+resulting pair is stored once as a :py:class:`service.models.Transfer`
+document carrying its walking distance; :py:func:`walking_transfers` reads it
+from either end.
+
+"""
+import math
+from multiprocessing import Pool
+import numpy
+from django.conf import settings
+from service.geometry import haversine
+from service.models import DEFAULT_FEED
+from service.models import Stop
+from service.models import Transfer
+
+# meters
+DEFAULT_RADIUS = 400.0
+# meters per second
+DEFAULT_WALKING_SPEED = 1.2
+# walking paths are longer than the straight line between both stops
+DETOUR_FACTOR = 1.3
+
+METERS_PER_DEGREE = 111320.0
+CELLS_PER_JOB = 256
+BATCH_SIZE = 5000
+
+# transfer_type 2: requires min_transfer_time between arrival and departure
+MINIMUM_TIME_TRANSFER = 2
+
+
+class StopGrid(object):
+    def __init__(self, lats, lons, radius):
+        self.lats = numpy.asarray(lats, dtype=float)
+        self.lons = numpy.asarray(lons, dtype=float)
+        self.radius = radius
+        # a degree of longitude is shortest at the latitude farthest from the
+        # equator, cells sized there are at least as wide as the radius
+        # everywhere in the feed
+        max_lat = abs(self.lats).max() if len(self.lats) else 0.0
+        self.cell_lat = radius / METERS_PER_DEGREE
+        self.cell_lon = radius / (METERS_PER_DEGREE *
+                                  max(math.cos(math.radians(max_lat)), 0.01))
+        rows = numpy.floor(self.lats / self.cell_lat).astype(int)
+        columns = numpy.floor(self.lons / self.cell_lon).astype(int)
+        self.cells = {}
+        for (index, cell) in enumerate(zip(rows, columns)):
+            self.cells.setdefault(cell, []).append(index)
+        self.cells = dict((cell, numpy.array(indexes))
+                          for (cell, indexes) in self.cells.items())
+
+    def neighbours(self, cell):
+        (row, column) = cell
+        indexes = [self.cells[(row + i, column + j)]
+                   for i in (-1, 0, 1) for j in (-1, 0, 1)
+                   if (row + i, column + j) in self.cells]
+        return numpy.concatenate(indexes)
+
+    def pairs(self, cells):
+        """Finds the stops of `cells` within the radius of each other.
+
+        Returns `(from_indexes, to_indexes, meters)` arrays holding every
+        pair once, from the lower to the higher index.
+        """
+        (origins, destinations, meters) = ([], [], [])
+        for cell in cells:
+            from_indexes = self.cells[cell]
+            to_indexes = self.neighbours(cell)
+            distances = haversine(self.lats[from_indexes][:, None],
+                                  self.lons[from_indexes][:, None],
+                                  self.lats[to_indexes][None, :],
+                                  self.lons[to_indexes][None, :])
+            (rows, columns) = numpy.nonzero(distances <= self.radius)
+            ordered = from_indexes[rows] < to_indexes[columns]
+            origins.append(from_indexes[rows][ordered])
+            destinations.append(to_indexes[columns][ordered])
+            meters.append(distances[rows, columns][ordered])
+        if not origins:
+            return (numpy.array([], dtype=int), numpy.array([], dtype=int),
+                    numpy.array([]))
+        return (numpy.concatenate(origins), numpy.concatenate(destinations),
+                numpy.concatenate(meters))
+
+
+# workers inherit the grid built by the parent process
+_grid = {}
+
+
+def _pairs_of(cells):
+    return _grid['grid'].pairs(cells)
+
+
+def find_pairs(lats, lons, radius, processes=None):
+    """Yields `(from_indexes, to_indexes, meters)` arrays, one per job."""
+    grid = StopGrid(lats, lons, radius)
+    cells = sorted(grid.cells)
+    jobs = [cells[index:index + CELLS_PER_JOB]
+            for index in range(0, len(cells), CELLS_PER_JOB)]
+    if processes == 1 or len(jobs) <= 1:
+        for job in jobs:
+            yield grid.pairs(job)
+        return
+
+    _grid['grid'] = grid
+    pool = Pool(processes)
+    try:
+        for pairs in pool.imap_unordered(_pairs_of, jobs):
+            yield pairs
+    finally:
+        pool.close()
+        pool.join()
+        _grid.clear()
+
+
+def build_transfers(feed=DEFAULT_FEED):
+    radius = getattr(settings, 'WALKING_TRANSFER_RADIUS', DEFAULT_RADIUS)
+    speed = getattr(settings, 'WALKING_SPEED', DEFAULT_WALKING_SPEED)
+    processes = getattr(settings, 'WALKING_TRANSFER_PROCESSES', None)
+
+    stops = list(Stop._get_collection().find({'feed': feed},
+                                             {'geopoint': True}))
+    stops = [stop for stop in stops if stop.get('geopoint')]
+    lats = [stop['geopoint'][0] for stop in stops]
+    lons = [stop['geopoint'][1] for stop in stops]
+
+    collection = Transfer._get_collection()
+    collection.remove({'feed': feed, 'walking_distance': {'$exists': True}})
+    count = 0
+    for (origins, destinations, meters) in find_pairs(lats, lons, radius,
+                                                      processes):
+        times = numpy.ceil(meters * DETOUR_FACTOR / speed).astype(int)
+        for start in range(0, len(origins), BATCH_SIZE):
+            end = start + BATCH_SIZE
+            collection.insert([{
+                'feed': feed,
+                'from_stop': stops[origin]['_id'],
+                'to_stop': stops[destination]['_id'],
+                'transfer_type': MINIMUM_TIME_TRANSFER,
+                'min_transfer_time': int(seconds),
+                'walking_distance': round(float(distance), 1),
+            } for (origin, destination, seconds, distance) in zip(
+                origins[start:end], destinations[start:end],
+                times[start:end], meters[start:end])])
+        count += len(origins)
+    return count
+
+
+def walking_transfers(stop, feed=DEFAULT_FEED):
+    """Yields `(stop, min_transfer_time, walking_distance)` for the stops
+    within walking distance of the `stop` ObjectId, looking it up at both
+    ends of the stored pairs.
+    """
+    spec = {'feed': feed, 'walking_distance': {'$exists': True},
+            '$or': [{'from_stop': stop}, {'to_stop': stop}]}
+    for transfer in Transfer._get_collection().find(spec):
+        other = transfer['to_stop']
+        if other == stop:
+            other = transfer['from_stop']
+        yield (other, transfer['min_transfer_time'],
+               transfer['walking_distance'])
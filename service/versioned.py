@@ -0,0 +1,85 @@
+""" Process wide values derived from the loaded feed.
+
+In-memory indexes are built on first use and rebuilt once a newer
+:py:class:`service.models.FeedVersion` shows up. The version is checked at
+most every `check_interval` seconds, keeping the lookup off the hot path.
+Values are kept for the most recently used feeds only, so requests naming
+arbitrary feeds cannot grow the process without bound.
+
+"""
+import time
+from collections import OrderedDict
+from functools import partial
+from service.models import DEFAULT_FEED
+from service.models import FeedVersion
+
+# seconds between two checks of the loaded feed version
+DEFAULT_CHECK_INTERVAL = 5
+# feed namespaces whose values are kept
+DEFAULT_MAX_FEEDS = 16
+
+
+class LRUCache(object):
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        try:
+            value = self._entries.pop(key)
+        except KeyError:
+            return None
+        self._entries[key] = value
+        return value
+
+    def set(self, key, value):
+        self._entries.pop(key, None)
+        self._entries[key] = value
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class Versioned(object):
+    def __init__(self, build, check_interval=DEFAULT_CHECK_INTERVAL):
+        self.build = build
+        self.check_interval = check_interval
+        self.value = None
+        self.version = None
+        self.checked_at = 0
+
+    def get(self):
+        now = time.time()
+        if self.value is None or now - self.checked_at > self.check_interval:
+            version = FeedVersion.current()
+            if self.value is None or version != self.version:
+                self.value = self.build()
+                self.version = version
+            self.checked_at = now
+        return self.value
+
+
+class VersionedByFeed(object):
+    """One :py:class:`Versioned` value per feed namespace, built by
+    `build(feed)` on first use."""
+
+    def __init__(self, build, check_interval=DEFAULT_CHECK_INTERVAL,
+                 max_feeds=DEFAULT_MAX_FEEDS):
+        self.build = build
+        self.check_interval = check_interval
+        self.feeds = LRUCache(max_feeds)
+
+    def holder(self, feed):
+        holder = self.feeds.get(feed)
+        if holder is None:
+            holder = Versioned(partial(self.build, feed), self.check_interval)
+            self.feeds.set(feed, holder)
+        return holder
+
+    def get(self, feed=DEFAULT_FEED):
+        return self.holder(feed).get()
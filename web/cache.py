@@ -0,0 +1,146 @@
+""" Feed-version-aware response cache.
+
+Schedule data only changes when a feed load completes (see
+:py:class:`service.models.FeedVersion`), so a response is fully determined by
+the request path, its query parameters and the active feed version. Responses
+are kept in a bounded in-process LRU and, when `RESPONSE_CACHE_BACKEND` names
+one of the configured django caches, in that shared backend too. Every cached
+view answers with a strong ETag derived from the same key, so clients holding
+a fresh copy get a 304 without the view running at all.
+
+Streamed listings are still streamed: their chunks are collected on the way
+out and stored once the stream completes, unless the page outgrows
+`RESPONSE_CACHE_MAX_ENTRY_SIZE`. The feed version itself is only read again
+every few seconds, like the in-memory indexes of :py:mod:`service.versioned`.
+
+"""
+import hashlib
+import time
+from functools import wraps
+from django.conf import settings
+from django.core.cache import get_cache
+from django.http import HttpResponse
+from django.http import HttpResponseNotModified
+from service.models import FeedVersion
+from service.versioned import DEFAULT_CHECK_INTERVAL
+from service.versioned import LRUCache
+
+DEFAULT_CACHE_SIZE = 512
+# bytes of a streamed response beyond which it is no longer stored
+DEFAULT_MAX_ENTRY_SIZE = 1024 * 1024
+CACHEABLE_METHODS = ('GET', 'HEAD')
+
+
+class ResponseCache(object):
+    def __init__(self, capacity=DEFAULT_CACHE_SIZE, backend=None,
+                 max_entry_size=DEFAULT_MAX_ENTRY_SIZE,
+                 check_interval=DEFAULT_CHECK_INTERVAL):
+        self.local = LRUCache(capacity)
+        self.shared = get_cache(backend) if backend else None
+        self.max_entry_size = max_entry_size
+        self.check_interval = check_interval
+        self.version = None
+        self.checked_at = 0
+
+    def feed_version(self):
+        now = time.time()
+        if self.version is None or \
+                now - self.checked_at > self.check_interval:
+            version = FeedVersion.current()
+            if version != self.version:
+                # entries of older versions can never be hit again
+                self.local.clear()
+                self.version = version
+            self.checked_at = now
+        return self.version
+
+    def get(self, key):
+        entry = self.local.get(key)
+        if entry is None and self.shared is not None:
+            entry = self.shared.get(key)
+            if entry is not None:
+                self.local.set(key, entry)
+        return entry
+
+    def set(self, key, entry):
+        self.local.set(key, entry)
+        if self.shared is not None:
+            self.shared.set(key, entry)
+
+    @staticmethod
+    def key(request, version):
+        params = sorted(request.GET.lists())
+        raw = '%s|%s|%r' % (version, request.path, params)
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+response_cache = ResponseCache(
+    capacity=getattr(settings, 'RESPONSE_CACHE_SIZE', DEFAULT_CACHE_SIZE),
+    backend=getattr(settings, 'RESPONSE_CACHE_BACKEND', None),
+    max_entry_size=getattr(settings, 'RESPONSE_CACHE_MAX_ENTRY_SIZE',
+                           DEFAULT_MAX_ENTRY_SIZE),
+)
+
+
+def _not_modified(request, etag):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH', '')
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    return etag in candidates or '*' in candidates
+
+
+def _storing(chunks, key, content_type):
+    """Yields `chunks`, storing them as the response of `key` once they all
+    went out, unless they add up to more than the maximum entry size."""
+    buffered = []
+    size = 0
+    for chunk in chunks:
+        if buffered is not None:
+            size += len(chunk)
+            if size <= response_cache.max_entry_size:
+                buffered.append(chunk)
+            else:
+                buffered = None
+        yield chunk
+    if buffered is not None:
+        response_cache.set(key, (''.join(buffered), content_type))
+
+
+def cached_response(view):
+    """Caches successful responses of `view` for the active feed version.
+
+    Streaming responses are stored once fully streamed, see
+    :py:func:`_storing`.
+    """
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in CACHEABLE_METHODS:
+            return view(request, *args, **kwargs)
+
+        key = ResponseCache.key(request, response_cache.feed_version())
+        etag = '"%s"' % key
+        if _not_modified(request, etag):
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            return response
+
+        entry = response_cache.get(key)
+        if entry is not None:
+            (content, content_type) = entry
+            response = HttpResponse(content, content_type=content_type)
+        else:
+            response = view(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            if response.streaming:
+                response.streaming_content = _storing(
+                    response.streaming_content, key,
+                    response['Content-Type'])
+            else:
+                response_cache.set(key, (response.content,
+                                         response['Content-Type']))
+
+        response['ETag'] = etag
+        return response
+
+    return wrapper
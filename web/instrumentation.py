@@ -0,0 +1,316 @@
+""" Database statistics of every API request.
+
+Every message sent to MongoDB during a request is timed and counted in the
+:py:class:`RequestStats` of the thread serving it: queries, database time,
+documents returned and bytes received. :py:class:`QueryStatsMiddleware`
+then adds them as `X-DB-*` headers when DEBUG is on, logs the queries
+slower than `SLOW_QUERY_MS` with their filter, and feeds per-endpoint
+histograms served in the Prometheus text format by
+:py:func:`web.views.metrics`.
+
+Streamed responses query the database while their body is sent, after the
+middleware returned. Their statistics stay active around every chunk and
+are recorded once the body is exhausted or closed; their headers are gone
+by then, so they only show in the histograms and the debug log.
+
+Messages are observed with a `pymongo.monitoring` command listener where
+pymongo provides one (3.1 and later, registered before the client
+connects). Older clients have no such hook, so their message sending
+methods are wrapped instead and the wire messages decoded on the fly.
+
+"""
+import logging
+import struct
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+import bson
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SLOW_QUERY_MS = 100
+
+# upper bounds of the histogram buckets
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+DOCUMENT_BUCKETS = (1, 10, 100, 1000, 10000, 100000)
+BYTE_BUCKETS = (1024, 10240, 102400, 1048576, 10485760, 104857600)
+
+# wire protocol operation codes
+OPERATIONS = {2001: 'update', 2002: 'insert', 2004: 'query',
+              2005: 'getmore', 2006: 'delete'}
+HEADER_SIZE = 16
+
+
+class RequestStats(object):
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+        self.documents = 0
+        self.bytes = 0
+
+    def add(self, seconds, documents, size):
+        self.queries += 1
+        self.seconds += seconds
+        self.documents += documents
+        self.bytes += size
+
+
+_local = threading.local()
+
+
+def current_stats():
+    """Statistics of the request served by this thread, None outside of
+    one."""
+    return getattr(_local, 'stats', None)
+
+
+def record(operation, collection, spec, seconds, documents, size):
+    """Counts a database round trip of the current request. `spec` is a
+    callable returning the filter, only called for slow queries."""
+    stats = current_stats()
+    if stats is None:
+        return
+    stats.add(seconds, documents, size)
+    slow_query_ms = getattr(settings, 'SLOW_QUERY_MS', DEFAULT_SLOW_QUERY_MS)
+    if slow_query_ms is not None and seconds * 1000 >= slow_query_ms:
+        logger.warning('Slow %s on [%s] took [%.1f ms], %d documents: %r',
+                       operation, collection, seconds * 1000, documents,
+                       spec())
+
+
+def parse_message(data):
+    """`(operation, collection, filter reader)` of a wire protocol
+    message."""
+    operation = struct.unpack('<i', data[12:16])[0]
+    # insert messages start with their flags, the others with a reserved int
+    start = HEADER_SIZE + 4
+    end = data.index('\x00', start)
+    collection = data[start:end]
+    if operation == 2004:
+        offset = end + 1 + 8
+    elif operation in (2001, 2006):
+        offset = end + 1 + 4
+    else:
+        return OPERATIONS.get(operation, str(operation)), collection, dict
+
+    def spec():
+        length = struct.unpack('<i', data[offset:offset + 4])[0]
+        return bson.BSON(data[offset:offset + length]).decode()
+    return OPERATIONS[operation], collection, spec
+
+
+def _timed(send, with_response):
+    @wraps(send)
+    def wrapper(client, message, *args, **kwargs):
+        if current_stats() is None:
+            return send(client, message, *args, **kwargs)
+        started = time.time()
+        result = send(client, message, *args, **kwargs)
+        seconds = time.time() - started
+        (documents, size) = (0, 0)
+        if with_response:
+            response = result[1][0]
+            documents = struct.unpack('<i', response[16:20])[0]
+            size = len(response)
+        (operation, collection, spec) = parse_message(message[1])
+        record(operation, collection, spec, seconds, documents, size)
+        return result
+    wrapper.instrumented = True
+    wrapper.wrapped = send
+    return wrapper
+
+
+def _reply_documents(reply):
+    cursor = reply.get('cursor') or {}
+    batch = cursor.get('firstBatch', cursor.get('nextBatch'))
+    if batch is not None:
+        return len(batch)
+    return reply.get('n', 0) or 0
+
+
+class CommandListener(object):
+    """A `pymongo.monitoring.CommandListener` recording the commands of the
+    current request."""
+
+    def __init__(self):
+        self._commands = threading.local()
+
+    def _started(self):
+        if not hasattr(self._commands, 'started'):
+            self._commands.started = {}
+        return self._commands.started
+
+    def started(self, event):
+        if current_stats() is not None:
+            self._started()[event.request_id] = event.command
+
+    def succeeded(self, event):
+        command = self._started().pop(event.request_id, None)
+        if command is None:
+            return
+        record(event.command_name, command.get(event.command_name),
+               lambda: command.get('filter', command.get('q', command)),
+               event.duration_micros / 1e6, _reply_documents(event.reply),
+               len(bson.BSON.encode(event.reply)))
+
+    def failed(self, event):
+        command = self._started().pop(event.request_id, None)
+        if command is None:
+            return
+        record(event.command_name, command.get(event.command_name),
+               lambda: command, event.duration_micros / 1e6, 0, 0)
+
+
+def install():
+    """Starts observing the database messages, once per process."""
+    try:
+        from pymongo import monitoring
+    except ImportError:
+        monitoring = None
+    if monitoring is not None:
+        if not getattr(install, 'listener', None):
+            install.listener = CommandListener()
+            monitoring.register(install.listener)
+        return
+    from pymongo.mongo_client import MongoClient
+    from pymongo.mongo_replica_set_client import MongoReplicaSetClient
+    for client_class in (MongoClient, MongoReplicaSetClient):
+        if getattr(client_class._send_message, 'instrumented', False):
+            continue
+        client_class._send_message = _timed(client_class._send_message,
+                                            with_response=False)
+        client_class._send_message_with_response = _timed(
+            client_class._send_message_with_response, with_response=True)
+
+
+class Histogram(object):
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        cumulative = 0
+        bounds = [repr(bound) for bound in self.buckets] + ['+Inf']
+        for (bound, count) in zip(bounds, self.counts):
+            cumulative += count
+            yield '%s_bucket{%s,le="%s"} %d' % (name, labels, bound,
+                                                cumulative)
+        yield '%s_sum{%s} %r' % (name, labels, self.sum)
+        yield '%s_count{%s} %d' % (name, labels, self.count)
+
+
+class EndpointMetrics(object):
+    """Per-endpoint histograms of the request statistics."""
+
+    METRICS = (
+        ('pygtfs_request_db_seconds', 'Database time of a request.',
+         'seconds', SECONDS_BUCKETS),
+        ('pygtfs_request_db_queries', 'Database round trips of a request.',
+         'queries', COUNT_BUCKETS),
+        ('pygtfs_request_db_documents',
+         'Documents returned to a request by the database.', 'documents',
+         DOCUMENT_BUCKETS),
+        ('pygtfs_request_db_bytes',
+         'Bytes returned to a request by the database.', 'bytes',
+         BYTE_BUCKETS),
+    )
+
+    def __init__(self):
+        self.endpoints = {}
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint, stats):
+        with self._lock:
+            histograms = self.endpoints.get(endpoint)
+            if histograms is None:
+                histograms = self.endpoints[endpoint] = [
+                    Histogram(buckets) for (_, _, _, buckets) in self.METRICS]
+            for (histogram, (_, _, attribute, _)) in zip(histograms,
+                                                         self.METRICS):
+                histogram.observe(getattr(stats, attribute))
+
+    def prometheus_text(self):
+        lines = []
+        with self._lock:
+            for (position, (name, description, _, _)) in \
+                    enumerate(self.METRICS):
+                lines.append('# HELP %s %s' % (name, description))
+                lines.append('# TYPE %s histogram' % name)
+                for endpoint in sorted(self.endpoints):
+                    labels = 'endpoint="%s"' % endpoint.replace('"', '\\"')
+                    lines.extend(self.endpoints[endpoint][position]
+                                 .lines(name, labels))
+        return '\n'.join(lines) + '\n'
+
+
+endpoint_metrics = EndpointMetrics()
+
+
+def _measured(chunks, stats, finish):
+    """Yields `chunks` with `stats` active while each one is produced, then
+    calls `finish(stats)` once exhausted or closed."""
+    iterator = iter(chunks)
+    try:
+        while True:
+            _local.stats = stats
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                _local.stats = None
+            yield chunk
+    finally:
+        finish(stats)
+
+
+class QueryStatsMiddleware(object):
+    def __init__(self):
+        install()
+
+    def process_request(self, request):
+        _local.stats = RequestStats()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.endpoint = getattr(view_func, '__name__', None)
+
+    def process_response(self, request, response):
+        stats = current_stats()
+        _local.stats = None
+        if stats is None:
+            return response
+        endpoint = getattr(request, 'endpoint', None)
+        if response.streaming:
+            response.streaming_content = _measured(
+                response.streaming_content, stats,
+                lambda stats: self._streamed(request.path, endpoint, stats))
+            return response
+        if endpoint:
+            endpoint_metrics.observe(endpoint, stats)
+        if settings.DEBUG:
+            response['X-DB-Queries'] = str(stats.queries)
+            response['X-DB-Time'] = '%.3f' % (stats.seconds * 1000)
+            response['X-DB-Documents'] = str(stats.documents)
+            response['X-DB-Bytes'] = str(stats.bytes)
+        return response
+
+    @staticmethod
+    def _streamed(path, endpoint, stats):
+        if endpoint:
+            endpoint_metrics.observe(endpoint, stats)
+        if settings.DEBUG:
+            logger.debug('Streamed [%s]: %d queries, %.3f ms, %d documents, '
+                         '%d bytes', path, stats.queries,
+                         stats.seconds * 1000, stats.documents, stats.bytes)
+
@@ -0,0 +1,121 @@
+""" Streaming JSON serialization of raw documents.
+
+Listing endpoints read documents straight from the pymongo collection, with a
+field projection and without dereferencing, and write the JSON payload
+incrementally. Pagination is cursor based: each page ends with the `_id` of
+its last document, which is handed back as `after` to fetch the next page.
+
+"""
+import json
+from datetime import date
+from datetime import datetime
+from datetime import time
+from bson import DBRef
+from bson import ObjectId
+from django.http import StreamingHttpResponse
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# number of documents encoded before a chunk is handed to the server
+CHUNK_SIZE = 50
+
+
+class PaginationException(Exception):
+    pass
+
+
+class DocumentEncoder(json.JSONEncoder):
+    def default(self, value):
+        if isinstance(value, ObjectId):
+            return str(value)
+        if isinstance(value, DBRef):
+            return str(value.id)
+        if isinstance(value, (datetime, date, time)):
+            return value.isoformat()
+        return json.JSONEncoder.default(self, value)
+
+
+class Page(object):
+    """A single page of raw documents, `limit` documents after `after`."""
+
+    def __init__(self, model_class, fields, after=None,
+                 limit=DEFAULT_PAGE_SIZE, spec=None):
+        self.model_class = model_class
+        self.fields = fields
+        self.after = self._parse_after(after)
+        self.limit = self._parse_limit(limit)
+        self.spec = dict(spec or {})
+
+    @staticmethod
+    def _parse_after(after):
+        if not after:
+            return None
+        if not ObjectId.is_valid(after):
+            raise PaginationException('Invalid cursor [%s]' % after)
+        return ObjectId(after)
+
+    @staticmethod
+    def _parse_limit(limit):
+        try:
+            limit = int(limit)
+        except (TypeError, ValueError):
+            raise PaginationException('Invalid limit [%s]' % limit)
+        if limit <= 0:
+            raise PaginationException('Invalid limit [%s]' % limit)
+        return min(limit, MAX_PAGE_SIZE)
+
+    def documents(self):
+        spec = dict(self.spec)
+        if self.after is not None:
+            spec['_id'] = {'$gt': self.after}
+        projection = dict((field, True) for field in self.fields)
+        collection = self.model_class._get_collection()
+        # one extra document tells whether there is a next page
+        return collection.find(spec, projection) \
+            .sort('_id', 1) \
+            .limit(self.limit + 1)
+
+    def stream(self):
+        encoder = DocumentEncoder()
+        chunk = ['{"results": [']
+        last_id = None
+        has_next = False
+
+        for count, document in enumerate(self.documents()):
+            if count == self.limit:
+                has_next = True
+                break
+            if count:
+                chunk.append(',')
+            chunk.append(encoder.encode(document))
+            last_id = document['_id']
+
+            if len(chunk) >= CHUNK_SIZE:
+                yield ''.join(chunk)
+                chunk = []
+
+        next_cursor = str(last_id) if has_next else None
+        chunk.append('], "next": %s}' % encoder.encode(next_cursor))
+        yield ''.join(chunk)
+
+
+class StreamingJsonResponse(StreamingHttpResponse):
+    def __init__(self, streaming_content, status=None):
+        super(StreamingJsonResponse, self).__init__(
+            streaming_content=streaming_content,
+            status=status,
+            content_type='application/json',
+        )
+
+    @staticmethod
+    def for_page(page):
+        return StreamingJsonResponse(page.stream())
+
+    @staticmethod
+    def for_request(request, model_class, fields, spec=None):
+        page = Page(model_class, fields,
+                    after=request.GET.get('after'),
+                    limit=request.GET.get('limit', DEFAULT_PAGE_SIZE),
+                    spec=spec)
+        return StreamingJsonResponse.for_page(page)
@@ -1,3 +1,299 @@
+import inspect
+import time
+import pymongo
+from django.http import Http404
+from django.http import HttpResponse
+from django.http import StreamingHttpResponse
 from django.test import TestCase
+from django.test.client import RequestFactory
+from pymongo import message
+from service.models import FeedVersion
+from web import cache
+from web import instrumentation
+from web.cache import LRUCache
+from web.cache import ResponseCache
+from web.cache import cached_response
+from web.cache import response_cache
+from web.instrumentation import EndpointMetrics
+from web.instrumentation import Histogram
+from web.instrumentation import QueryStatsMiddleware
+from web.instrumentation import RequestStats
+from web.instrumentation import endpoint_metrics
+from web.instrumentation import parse_message
+from web.views import pattern_trips
+from web.views import tile
 
-# Create your tests here.
+
+class LRUCacheTest(TestCase):
+    def setUp(self):
+        self.subject = LRUCache(2)
+
+    def test_lru_cache_returns_stored_values(self):
+        self.subject.set('a', 1)
+        self.assertEqual(self.subject.get('a'), 1)
+        self.assertEqual(self.subject.get('b'), None)
+
+    def test_lru_cache_evicts_least_recently_used(self):
+        self.subject.set('a', 1)
+        self.subject.set('b', 2)
+        self.subject.get('a')
+        self.subject.set('c', 3)
+        self.assertEqual(self.subject.get('a'), 1)
+        self.assertEqual(self.subject.get('b'), None)
+        self.assertEqual(self.subject.get('c'), 3)
+        self.assertEqual(len(self.subject), 2)
+
+
+def _fresh(cache, version=1):
+    # the feed version was just read, no database round trip needed
+    cache.version = version
+    cache.checked_at = time.time()
+    cache.check_interval = 3600
+
+
+class StoredVersion(object):
+    # stands for the FeedVersion collection
+    version = 1
+
+    @staticmethod
+    def current():
+        return StoredVersion.version
+
+
+class ResponseCacheTest(TestCase):
+    def setUp(self):
+        self.subject = ResponseCache(capacity=2)
+        _fresh(self.subject)
+        self.request = RequestFactory().get('/routes/', {'limit': '10'})
+        StoredVersion.version = 1
+        cache.FeedVersion = StoredVersion
+
+    def tearDown(self):
+        cache.FeedVersion = FeedVersion
+
+    def test_keys_depend_on_path_parameters_and_version(self):
+        key = ResponseCache.key(self.request, 1)
+        self.assertEqual(key, ResponseCache.key(
+            RequestFactory().get('/routes/', {'limit': '10'}), 1))
+        self.assertNotEqual(key, ResponseCache.key(self.request, 2))
+        self.assertNotEqual(key, ResponseCache.key(
+            RequestFactory().get('/routes/', {'limit': '20'}), 1))
+
+    def test_feed_version_is_read_again_after_the_interval(self):
+        self.subject.set('key', ('content', 'application/json'))
+        StoredVersion.version = 2
+        # still within the interval, the new version is not seen yet
+        self.assertEqual(self.subject.feed_version(), 1)
+        self.assertEqual(self.subject.get('key'),
+                         ('content', 'application/json'))
+
+        self.subject.checked_at -= self.subject.check_interval + 1
+        self.assertEqual(self.subject.feed_version(), 2)
+        self.assertIsNone(self.subject.get('key'))
+
+
+class CachedResponseTest(TestCase):
+    def setUp(self):
+        self.saved = (response_cache.version, response_cache.checked_at,
+                      response_cache.check_interval)
+        response_cache.local.clear()
+        _fresh(response_cache, version=-1)
+        self.calls = []
+        self.factory = RequestFactory()
+
+    def tearDown(self):
+        response_cache.local.clear()
+        (response_cache.version, response_cache.checked_at,
+         response_cache.check_interval) = self.saved
+
+    def _view(self, streaming=False):
+        @cached_response
+        def view(request):
+            self.calls.append(request)
+            if streaming:
+                return StreamingHttpResponse(iter(['{"results"', ': []}']),
+                                             content_type='application/json')
+            return HttpResponse('{}', content_type='application/json')
+        return view
+
+    def test_responses_are_served_from_the_cache(self):
+        view = self._view()
+        first = view(self.factory.get('/routes/'))
+        second = view(self.factory.get('/routes/'))
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(second.content, '{}')
+        self.assertEqual(first['ETag'], second['ETag'])
+
+    def test_matching_etags_get_not_modified(self):
+        view = self._view()
+        etag = view(self.factory.get('/routes/'))['ETag']
+        response = view(self.factory.get('/routes/',
+                                         HTTP_IF_NONE_MATCH=etag))
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(len(self.calls), 1)
+
+    def test_streamed_responses_are_stored_once_streamed(self):
+        view = self._view(streaming=True)
+        first = view(self.factory.get('/stops/'))
+        self.assertEqual(''.join(first.streaming_content),
+                         '{"results": []}')
+        second = view(self.factory.get('/stops/'))
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(second.content, '{"results": []}')
+
+    def test_large_streamed_responses_are_not_stored(self):
+        response_cache.max_entry_size = 4
+        try:
+            view = self._view(streaming=True)
+            ''.join(view(self.factory.get('/stops/')).streaming_content)
+            view(self.factory.get('/stops/'))
+        finally:
+            response_cache.max_entry_size = 1024 * 1024
+        self.assertEqual(len(self.calls), 2)
+
+
+class InstrumentationTest(TestCase):
+    def tearDown(self):
+        instrumentation._local.stats = None
+
+    def test_queries_are_parsed_from_wire_messages(self):
+        (_, data) = message.query(0, 'pygtfs.stop', 0, 0,
+                                  {'feed': 'default'})[:2]
+        (operation, collection, spec) = parse_message(data)
+        self.assertEqual(operation, 'query')
+        self.assertEqual(collection, 'pygtfs.stop')
+        self.assertEqual(spec(), {'feed': 'default'})
+
+    def test_round_trips_count_towards_the_current_request(self):
+        instrumentation._local.stats = RequestStats()
+        instrumentation.record('query', 'pygtfs.stop', dict, 0.002, 10, 512)
+        instrumentation.record('getmore', 'pygtfs.stop', dict, 0.001, 5, 256)
+        stats = instrumentation.current_stats()
+        self.assertEqual(stats.queries, 2)
+        self.assertAlmostEqual(stats.seconds, 0.003)
+        self.assertEqual(stats.documents, 15)
+        self.assertEqual(stats.bytes, 768)
+
+    def test_round_trips_outside_requests_are_ignored(self):
+        instrumentation.record('query', 'pygtfs.stop', dict, 0.002, 10, 512)
+        self.assertIsNone(instrumentation.current_stats())
+
+
+class SendMessageHooksTest(TestCase):
+    """Guards the private pymongo 2 methods `instrumentation.install`
+    wraps when pymongo has no command monitoring."""
+
+    def setUp(self):
+        try:
+            from pymongo import monitoring
+        except ImportError:
+            return
+        self.skipTest('observed through pymongo.monitoring')
+
+    @staticmethod
+    def _method(client_class, name):
+        method = getattr(client_class, name)
+        # install() may already have wrapped it
+        return getattr(method, 'wrapped', method)
+
+    def test_messages_are_the_first_argument(self):
+        from pymongo.mongo_client import MongoClient
+        from pymongo.mongo_replica_set_client import MongoReplicaSetClient
+        for client_class in (MongoClient, MongoReplicaSetClient):
+            for name in ('_send_message', '_send_message_with_response'):
+                args = inspect.getargspec(self._method(client_class,
+                                                       name)).args
+                self.assertIn(args[1], ('message', 'msg'))
+
+    def test_responses_hold_the_reply_second(self):
+        # both clients return `(server, (reply, ...))`, unpacked by _timed
+        from pymongo.mongo_client import MongoClient
+        from pymongo.mongo_replica_set_client import MongoReplicaSetClient
+        self.assertEqual(pymongo.version_tuple[0], 2)
+        source = inspect.getsource(
+            self._method(MongoClient, '_send_message_with_response'))
+        self.assertIn('return (None, (response, sock_info, member.pool))',
+                      source)
+        source = inspect.getsource(
+            self._method(MongoReplicaSetClient, '_send_message_with_response'))
+        self.assertIn('return member.host, response', source)
+
+
+class StreamedStatsTest(TestCase):
+    def setUp(self):
+        self.middleware = QueryStatsMiddleware()
+        self.request = RequestFactory().get('/stops/')
+
+    def tearDown(self):
+        instrumentation._local.stats = None
+        endpoint_metrics.endpoints.pop('streamed_stops', None)
+
+    def _chunks(self):
+        for chunk in ('[', '{}', ']'):
+            instrumentation.record('query', 'pygtfs.stop', dict, 0.001, 1,
+                                   100)
+            yield chunk
+
+    def _response(self):
+        def streamed_stops(request):
+            return StreamingHttpResponse(self._chunks())
+        self.middleware.process_request(self.request)
+        self.middleware.process_view(self.request, streamed_stops, (), {})
+        return self.middleware.process_response(
+            self.request, streamed_stops(self.request))
+
+    def test_queries_of_streamed_bodies_are_recorded(self):
+        response = self._response()
+        self.assertEqual(''.join(response.streaming_content), '[{}]')
+        histograms = endpoint_metrics.endpoints['streamed_stops']
+        self.assertEqual([histogram.sum for histogram in histograms][1:],
+                         [3, 3, 300])
+        self.assertIsNone(instrumentation.current_stats())
+
+    def test_closed_streams_are_recorded(self):
+        response = self._response()
+        next(iter(response.streaming_content))
+        response.close()
+        histograms = endpoint_metrics.endpoints['streamed_stops']
+        self.assertEqual(histograms[1].sum, 1)
+
+
+class HistogramTest(TestCase):
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram((1, 10))
+        for value in (1, 5, 50):
+            histogram.observe(value)
+        self.assertEqual(list(histogram.lines('queries', 'endpoint="x"')), [
+            'queries_bucket{endpoint="x",le="1"} 1',
+            'queries_bucket{endpoint="x",le="10"} 2',
+            'queries_bucket{endpoint="x",le="+Inf"} 3',
+            'queries_sum{endpoint="x"} 56',
+            'queries_count{endpoint="x"} 3',
+        ])
+
+    def test_endpoint_metrics_are_exported_per_endpoint(self):
+        subject = EndpointMetrics()
+        stats = RequestStats()
+        stats.add(0.02, 3, 2048)
+        subject.observe('routes', stats)
+        text = subject.prometheus_text()
+        self.assertIn('# TYPE pygtfs_request_db_seconds histogram', text)
+        self.assertIn('pygtfs_request_db_queries_count{endpoint="routes"} 1',
+                      text)
+        self.assertIn('pygtfs_request_db_documents_sum{endpoint="routes"} 3',
+                      text)
+
+
+class PatternTripsTest(TestCase):
+    def test_negative_stop_indexes_are_rejected(self):
+        request = RequestFactory().get('/patterns/AB:0:x/trips/',
+                                       {'stop_index': '-1'})
+        self.assertEqual(pattern_trips(request, 'AB:0:x').status_code, 400)
+
+
+class TileTest(TestCase):
+    def test_unusable_feed_names_are_not_found(self):
+        request = RequestFactory().get('/tiles/10/366/601.json',
+                                       {'feed': '../../etc'})
+        self.assertRaises(Http404, tile, request, '10', '366', '601')
@@ -5,5 +5,25 @@ from web import views
 urlpatterns = patterns('',
     url(r'^$', views.index, name='index'),
     url(r'^bus/lines/$', views.bus_lines, name='bus_lines'),
+    url(r'^routes/$', views.routes, name='routes'),
+    url(r'^stops/$', views.stops, name='stops'),
+    url(r'^stops/autocomplete/$', views.stops_autocomplete,
+        name='stops_autocomplete'),
+    url(r'^stops/(?P<stop_id>[^/]+)/routes/$', views.stop_routes,
+        name='stop_routes'),
+    url(r'^routes/(?P<route_id>[^/]+)/stops/$', views.route_stops,
+        name='route_stops'),
+    url(r'^shapes/(?P<shape_id>[^/]+)/$', views.shape, name='shape'),
+    url(r'^patterns/(?P<pattern_id>[^/]+)/trips/$', views.pattern_trips,
+        name='pattern_trips'),
+    url(r'^trips/between/$', views.trips_from_to, name='trips_between'),
+    url(r'^analytics/routes/$', views.routes_analytics,
+        name='routes_analytics'),
+    url(r'^analytics/routes/(?P<route_id>[^/]+)/$', views.route_analytics,
+        name='route_analytics'),
+    url(r'^metrics/$', views.metrics, name='metrics'),
+    url(r'^vehicles/$', views.vehicles, name='vehicles'),
+    url(r'^tiles/(?P<zoom>\d+)/(?P<x>\d+)/(?P<y>\d+)\.json$', views.tile,
+        name='tile'),
     # url(r'^articles/(?P<pk>\d+)/$', views.ShowView.as_view(), name='detail'),
-)
\ No newline at end of file
+)
@@ -1,8 +1,37 @@
 from django.http import HttpResponse
+from django.http import Http404
 from django.core import serializers
+from service.models import DEFAULT_FEED
+from service.models import Route
+from service.models import ShapeGeometry
+from service.models import Stop
 from service.models import Trip
+from service.adjacency import directions_of
+from service.adjacency import routes_of
+from service.adjacency import stops_of
+from service.patterns import trips_after
+from service.postings import trips_between
+from service.search import autocomplete
+from service.times import format_time
+from service.times import parse_time
+from web.cache import cached_response
+from web.instrumentation import endpoint_metrics
+from web.streaming import PaginationException
+from web.streaming import StreamingJsonResponse
 
 import json
+import os
+from datetime import date
+from datetime import datetime
+from datetime import timedelta
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4'
+ROUTE_FIELDS = ('route_id', 'agency', 'short_name', 'long_name', 'desc',
+                'route_type', 'url', 'color', 'text_color')
+STOP_FIELDS = ('stop_id', 'code', 'name', 'desc', 'zone', 'location_type',
+               'parent_station', 'wheelchair', 'geopoint')
+TRIP_FIELDS = ('trip_id', 'route', 'service', 'headsign', 'direction',
+               'block', 'wheelchair', 'short_name')
 
 
 class JsonResponse(HttpResponse):
@@ -15,9 +44,9 @@ class JsonResponse(HttpResponse):
         )
 
     @staticmethod
-    def for_dict(content):
+    def for_dict(content, status=None):
         content_as_json = json.dumps(content)
-        return JsonResponse(content_as_json)
+        return JsonResponse(content_as_json, status=status)
 
     @staticmethod
     def for_model(content):
@@ -25,9 +54,226 @@ class JsonResponse(HttpResponse):
         return JsonResponse(content_as_json)
 
 
+def _feed(request):
+    return request.GET.get('feed', DEFAULT_FEED)
+
+
+def _listing(request, model_class, fields):
+    try:
+        return StreamingJsonResponse.for_request(
+            request, model_class, fields, spec={'feed': _feed(request)})
+    except PaginationException as e:
+        return JsonResponse.for_dict({"error": str(e)}, status=400)
+
+
 def index(request):
     return JsonResponse.for_dict({"status": "ok"})
 
 
+@cached_response
 def bus_lines(request):
-    return JsonResponse.for_model(Trip.objects.all()[:1])
+    return _listing(request, Trip, TRIP_FIELDS)
+
+
+@cached_response
+def routes(request):
+    return _listing(request, Route, ROUTE_FIELDS)
+
+
+@cached_response
+def stops(request):
+    return _listing(request, Stop, STOP_FIELDS)
+
+
+@cached_response
+def shape(request, shape_id):
+    # numpy backed modules are only imported by the views using them, so
+    # they stay out of the startup of every process serving the API
+    from service.shapes import ZOOM_LEVELS
+    try:
+        zoom = int(request.GET.get('zoom', ZOOM_LEVELS[-1]))
+    except ValueError:
+        return JsonResponse.for_dict({"error": "Invalid zoom"}, status=400)
+    try:
+        geometry = ShapeGeometry.objects.get(feed=_feed(request),
+                                             shape_id=shape_id)
+    except ShapeGeometry.DoesNotExist:
+        return JsonResponse.for_dict({"error": "Unknown shape"}, status=404)
+    level = geometry.level_for(zoom)
+    return JsonResponse.for_dict({
+        "shape_id": shape_id,
+        "zoom": level.zoom,
+        "points": level.points,
+        "polyline": level.polyline,
+    })
+
+
+def tile(request, zoom, x, y):
+    from service.tiles import TileStore
+    from service.tiles import tiles_path
+    try:
+        path = tiles_path(_feed(request))
+    except ValueError:
+        raise Http404
+    if not os.path.exists(path):
+        raise Http404
+    store = TileStore(path)
+    try:
+        data = store.read(int(zoom), int(x), int(y))
+    finally:
+        store.close()
+    if data is None:
+        raise Http404
+    return HttpResponse(data, content_type='application/json')
+
+
+def stops_autocomplete(request):
+    try:
+        limit = int(request.GET.get('limit', 10))
+    except ValueError:
+        return JsonResponse.for_dict({"error": "Invalid limit"}, status=400)
+    results = autocomplete(request.GET.get('q', ''), min(limit, 50),
+                           _feed(request))
+    return JsonResponse.for_dict({"results": [
+        {"stop_id": stop_id, "name": name, "code": code}
+        for (stop_id, name, code) in results
+    ]})
+
+
+def pattern_trips(request, pattern_id):
+    try:
+        after = parse_time(request.GET.get('after', '0:00:00'))
+        stop_index = int(request.GET.get('stop_index', 0))
+        limit = int(request.GET.get('limit', 20))
+    except ValueError:
+        return JsonResponse.for_dict({"error": "Invalid parameters"},
+                                     status=400)
+    if stop_index < 0:
+        return JsonResponse.for_dict({"error": "Invalid stop_index"},
+                                     status=400)
+    try:
+        departures = trips_after(pattern_id, after, stop_index, limit=limit,
+                                 feed=_feed(request))
+    except ValueError:
+        return JsonResponse.for_dict({"error": "Invalid stop_index"},
+                                     status=400)
+    trip_ids = dict((trip['_id'], trip['trip_id']) for trip in
+                    Trip._get_collection().find(
+                        {'_id': {'$in': [trip for (trip, _) in departures]}},
+                        {'trip_id': True}))
+    return JsonResponse.for_dict({"results": [
+        {"trip_id": trip_ids.get(trip), "departure": format_time(departure)}
+        for (trip, departure) in departures
+    ]})
+
+
+@cached_response
+def stop_routes(request, stop_id):
+    routes = routes_of(stop_id, _feed(request))
+    if routes is None:
+        return JsonResponse.for_dict({"error": "Unknown stop"}, status=404)
+    return JsonResponse.for_dict({"stop_id": stop_id, "routes": routes})
+
+
+@cached_response
+def route_stops(request, route_id):
+    direction = request.GET.get('direction')
+    try:
+        direction = int(direction) if direction else None
+    except ValueError:
+        return JsonResponse.for_dict({"error": "Invalid direction"},
+                                     status=400)
+    if direction is None:
+        # every direction of the route, whether or not the feed sets them
+        directions = directions_of(route_id, _feed(request))
+        if not directions:
+            return JsonResponse.for_dict({"error": "Unknown route"},
+                                         status=404)
+        return JsonResponse.for_dict({"route_id": route_id, "directions": [
+            {"direction": direction, "stops": stops}
+            for (direction, stops) in directions
+        ]})
+    stops = stops_of(route_id, direction, _feed(request))
+    if stops is None:
+        return JsonResponse.for_dict({"error": "Unknown route"}, status=404)
+    return JsonResponse.for_dict({"route_id": route_id,
+                                  "direction": direction, "stops": stops})
+
+
+def _parse_day(value):
+    if not value:
+        return date.today()
+    return datetime.strptime(value, '%Y%m%d').date()
+
+
+def trips_from_to(request):
+    origin = request.GET.get('from')
+    destination = request.GET.get('to')
+    if not origin or not destination:
+        return JsonResponse.for_dict({"error": "from and to are required"},
+                                     status=400)
+    try:
+        day = _parse_day(request.GET.get('date'))
+        after = parse_time(request.GET.get('after', '0:00:00'))
+        limit = int(request.GET.get('limit', 20))
+    except ValueError:
+        return JsonResponse.for_dict({"error": "Invalid parameters"},
+                                     status=400)
+    trips = trips_between(origin, destination, day, after, min(limit, 100),
+                          _feed(request))
+    return JsonResponse.for_dict({"results": [
+        {"trip_id": trip_id, "departure": format_time(departure),
+         "arrival": format_time(arrival)}
+        for (trip_id, departure, arrival) in trips
+    ]})
+
+
+def vehicles(request):
+    from service.positions import vehicle_positions
+    try:
+        if request.GET.get('time'):
+            moment = datetime.combine(_parse_day(request.GET.get('date')),
+                                      datetime.min.time()) + \
+                timedelta(seconds=parse_time(request.GET['time']))
+        else:
+            moment = datetime.now()
+    except ValueError:
+        return JsonResponse.for_dict({"error": "Invalid parameters"},
+                                     status=400)
+    return JsonResponse.for_dict({"results": [
+        {"trip_id": trip_id, "geopoint": [lat, lon]}
+        for (trip_id, lat, lon) in vehicle_positions(moment, _feed(request))
+    ]})
+
+
+def routes_analytics(request):
+    from service.analytics import formatted
+    from service.analytics import route_metrics
+    try:
+        day = _parse_day(request.GET.get('date'))
+    except ValueError:
+        return JsonResponse.for_dict({"error": "Invalid date"}, status=400)
+    metrics = route_metrics(day, feed=_feed(request))
+    return JsonResponse.for_dict({"date": day.strftime('%Y%m%d'), "routes": [
+        formatted(metric) for metric in metrics
+    ]})
+
+
+def route_analytics(request, route_id):
+    from service.analytics import formatted
+    from service.analytics import route_metrics
+    try:
+        day = _parse_day(request.GET.get('date'))
+    except ValueError:
+        return JsonResponse.for_dict({"error": "Invalid date"}, status=400)
+    metrics = route_metrics(day, route_id, _feed(request))
+    if not metrics:
+        return JsonResponse.for_dict(
+            {"error": "Unknown route or no service that day"}, status=404)
+    return JsonResponse.for_dict({"date": day.strftime('%Y%m%d'),
+                                  "route": formatted(metrics[0])})
+
+
+def metrics(request):
+    return HttpResponse(endpoint_metrics.prometheus_text(),
+                        content_type=PROMETHEUS_CONTENT_TYPE)